@@ -0,0 +1,263 @@
+"""
+Classes for random access to a file compressed by bgzip (BGZF) and for
+writing BGZF files
+
+A BGZF file is a series of gzip members (blocks) and each block has at most
+64 KiB of uncompressed data. The block which has an uncompressed offset is
+found from a .gzi index (made by 'bgzip -r' or 'samtools faidx') or from
+the block headers, and recently decompressed blocks are kept in an LRU cache.
+Since every block is compressed independently, the blocks to write are
+compressed in parallel by threads (zlib releases the GIL).
+"""
+import os
+import struct
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# Magic bytes of a BGZF block (gzip magic, deflate, FEXTRA flag)
+_BGZF_MAGIC = b'\x1f\x8b\x08\x04'
+_BGZF_HEADER_SIZE = 18
+_BGZF_BLOCK_DATA_SIZE = 0xff00  # Max. uncompressed bytes in a block (bgzip)
+_BGZF_EOF = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000'
+                          '000000000000')
+
+
+def is_bgzf(file_path: str) -> bool:
+    """ Return True if the file starts with a BGZF block header """
+    with open(file_path, 'rb') as infile:
+        header = infile.read(_BGZF_HEADER_SIZE)
+
+    return len(header) == _BGZF_HEADER_SIZE and \
+        header.startswith(_BGZF_MAGIC) and header[12:14] == b'BC'
+
+
+def read_gzi(gzi_path: str) -> (np.ndarray, np.ndarray):
+    """ Parse the .gzi index and return arrays of compressed and uncompressed
+    offsets of the blocks including the first block (0, 0).
+    """
+    with open(gzi_path, 'rb') as gzi_file:
+        num_entry, = struct.unpack('<Q', gzi_file.read(8))
+        offsets = np.frombuffer(gzi_file.read(16 * num_entry), dtype='<u8')
+
+    offsets = offsets.reshape(-1, 2).astype(np.int64)
+    return np.concatenate([[0], offsets[:, 0]]), \
+        np.concatenate([[0], offsets[:, 1]])
+
+
+def scan_bgzf_blocks(file_path: str) -> (np.ndarray, np.ndarray):
+    """ Read the header and the footer of every block and return arrays of
+    compressed and uncompressed offsets of the blocks like 'read_gzi'
+    """
+    coffsets = []
+    uoffsets = []
+    coffset = 0
+    uoffset = 0
+
+    with open(file_path, 'rb') as infile:
+        while True:
+            header = infile.read(_BGZF_HEADER_SIZE)
+            if len(header) < _BGZF_HEADER_SIZE:
+                break
+
+            block_size = struct.unpack('<H', header[16:18])[0] + 1
+            infile.seek(coffset + block_size - 4)
+            data_size, = struct.unpack('<I', infile.read(4))
+
+            if data_size > 0:  # Skip empty blocks (e.g. the EOF marker)
+                coffsets.append(coffset)
+                uoffsets.append(uoffset)
+
+            coffset += block_size
+            uoffset += data_size
+
+    return np.array(coffsets, dtype=np.int64), \
+        np.array(uoffsets, dtype=np.int64)
+
+
+class BgzfReader:
+    def __init__(self, file_path: str, gzi_path: str = None,
+                 cache_size: int = 256):
+        """
+        :param file_path: Path of the BGZF file
+        :param gzi_path: Path of the .gzi index (Default: '{file_path}.gzi').
+                         If the file does not exist, the blocks are scanned.
+        :param cache_size: Maximum number of decompressed blocks in the cache
+        """
+        if gzi_path is None:
+            gzi_path = file_path + '.gzi'
+
+        if os.path.isfile(gzi_path):
+            self._block_coffsets, self._block_uoffsets = read_gzi(gzi_path)
+        else:
+            self._block_coffsets, self._block_uoffsets = \
+                scan_bgzf_blocks(file_path)
+
+        self._file = open(file_path, 'rb')
+        self._cache_size = cache_size
+        self._block_cache = OrderedDict()  # Key: Block index, Value: bytes
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self._file.close()
+        self._block_cache.clear()
+
+    def read(self, offset: int, size: int) -> bytes:
+        """ Return the uncompressed data of the input size
+        from the uncompressed offset
+        """
+        block_idx = self._find_block(offset)
+        chunks = []
+
+        while size > 0 and block_idx < len(self._block_coffsets):
+            block = self._get_block(block_idx)
+            block_offset = offset - self._block_uoffsets[block_idx]
+            chunk = block[block_offset:block_offset + size]
+            chunks.append(chunk)
+            offset += len(chunk)
+            size -= len(chunk)
+            block_idx += 1
+
+        return b''.join(chunks)
+
+    def read_at(self, offsets: np.ndarray) -> np.ndarray:
+        """ Return an array of bytes (uint8) at the uncompressed offsets """
+        offsets = np.asarray(offsets, dtype=np.int64)
+        block_ind = self._find_block(offsets)
+        values = np.empty(len(offsets), dtype=np.uint8)
+
+        # Group the offsets by their blocks
+        order = np.argsort(block_ind, kind='stable')
+        sorted_block_ind = block_ind[order]
+        uniq_block_ind, group_starts = \
+            np.unique(sorted_block_ind, return_index=True)
+        group_ends = np.append(group_starts[1:], len(order))
+
+        for block_idx, group_start, group_end in \
+                zip(uniq_block_ind, group_starts, group_ends):
+            group_order = order[group_start:group_end]
+            block = np.frombuffer(self._get_block(int(block_idx)),
+                                  dtype=np.uint8)
+            values[group_order] = \
+                block[offsets[group_order] - self._block_uoffsets[block_idx]]
+
+        return values
+
+    def _find_block(self, offset):
+        """ Return the index of the block which has the uncompressed offset
+        (The input can be an integer or an array of integers.)
+        """
+        return np.searchsorted(self._block_uoffsets, offset, side='right') - 1
+
+    def _get_block(self, block_idx: int) -> bytes:
+        """ Return the decompressed block from the cache or the file """
+        block = self._block_cache.get(block_idx)
+
+        if block is not None:
+            self._block_cache.move_to_end(block_idx)
+            return block
+
+        block_start = int(self._block_coffsets[block_idx])
+        self._file.seek(block_start)
+        header = self._file.read(_BGZF_HEADER_SIZE)
+        block_size = struct.unpack('<H', header[16:18])[0] + 1
+        block = zlib.decompress(
+            header + self._file.read(block_size - _BGZF_HEADER_SIZE),
+            wbits=31
+        )
+
+        self._block_cache[block_idx] = block
+        if len(self._block_cache) > self._cache_size:
+            self._block_cache.popitem(last=False)
+
+        return block
+
+
+def compress_bgzf_block(data: bytes, compress_level: int = 6) -> bytes:
+    """ Compress the data (at most 0xff00 bytes) into a BGZF block """
+    compressor = zlib.compressobj(compress_level, zlib.DEFLATED, -15)
+    cdata = compressor.compress(data) + compressor.flush()
+    block_size = _BGZF_HEADER_SIZE + len(cdata) + 8
+    header = _BGZF_MAGIC + b'\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00' + \
+        struct.pack('<H', block_size - 1)
+    return header + cdata + struct.pack('<II', zlib.crc32(data), len(data))
+
+
+class BgzfWriter:
+    def __init__(self, file_path: str, num_thread: int = 1,
+                 compress_level: int = 6, blocks_per_batch: int = 64):
+        """
+        :param file_path: Path of the output BGZF file
+        :param num_thread: Number of threads compressing blocks
+        :param compress_level: Compression level of zlib (0-9)
+        :param blocks_per_batch: Number of blocks compressed at once
+        """
+        self._file = open(file_path, 'wb')
+        self._compress_level = compress_level
+        self._batch_size = _BGZF_BLOCK_DATA_SIZE * blocks_per_batch
+        self._pending = bytearray()
+        self._executor = ThreadPoolExecutor(num_thread) \
+            if num_thread > 1 else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def write(self, data: bytes):
+        self._pending += data
+
+        if len(self._pending) >= self._batch_size:
+            self._write_blocks(is_last=False)
+
+    def close(self):
+        """ Write the remaining data and the EOF marker and close the file """
+        if self._file.closed:
+            return
+
+        self._write_blocks(is_last=True)
+        self._file.write(_BGZF_EOF)
+        self._file.close()
+
+        if self._executor is not None:
+            self._executor.shutdown()
+
+    def abort(self):
+        """ Discard the pending data and close the file without the EOF
+        marker, so the incomplete output is not taken as a valid BGZF file
+        """
+        if self._file.closed:
+            return
+
+        self._pending.clear()
+        self._file.close()
+
+        if self._executor is not None:
+            self._executor.shutdown()
+
+    def _write_blocks(self, is_last: bool):
+        """ Compress the pending data into blocks and write them.
+        The last partial block is kept unless 'is_last' is True.
+        """
+        data_size = len(self._pending) if is_last else \
+            len(self._pending) // _BGZF_BLOCK_DATA_SIZE * _BGZF_BLOCK_DATA_SIZE
+        chunks = [bytes(self._pending[i:i + _BGZF_BLOCK_DATA_SIZE])
+                  for i in range(0, data_size, _BGZF_BLOCK_DATA_SIZE)]
+        del self._pending[:data_size]
+
+        map_func = map if self._executor is None else self._executor.map
+        self._file.write(b''.join(map_func(
+            lambda chunk: compress_bgzf_block(chunk, self._compress_level),
+            chunks
+        )))
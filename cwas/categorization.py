@@ -1,10 +1,29 @@
+"""
+Categorization of de novo variants annotated by VEP into CWAS categories.
+The result is a sparse matrix of the numbers of variants of each category
+per sample (.npz) or, for other output paths, a tab-separated table.
+"""
 import argparse
 import os
 
+import yaml
+
 import cwas.utils.error as error
 import cwas.utils.log as log
+from cwas.core.categorization import AF_KNOWN_MODES, categorize_variants, \
+    filter_by_af_known, load_rdd_cat_mask, parse_vep_vcf
+from cwas.core.gene_list_table import GeneListTable
 from cwas.runnable import Runnable
 
+# Columns of the parsed VCF file not used for the categorization
+_RDD_COLNAMES = [
+    'CHROM', 'POS', 'QUAL', 'FILTER', 'INFO', 'Allele', 'IMPACT', 'Gene',
+    'Feature_type', 'Feature', 'EXON', 'INTRON', 'HGVSc', 'HGVSp',
+    'cDNA_position', 'CDS_position', 'Protein_position', 'Amino_acids',
+    'Codons', 'Existing_variation', 'STRAND', 'FLAGS', 'SYMBOL_SOURCE',
+    'HGNC_ID', 'CANONICAL', 'TSL', 'APPRIS', 'CCDS', 'SOURCE', 'gnomADg',
+]
+
 
 class Categorization(Runnable):
     @staticmethod
@@ -16,12 +35,18 @@ class Categorization(Runnable):
         parser.add_argument('-o', '--outfile', dest='outfile_path',
                             required=False, type=str,
                             help='Path of the output',
-                            default='cwas_categorization_result.txt')
+                            default='cwas_categorization_result.npz')
         parser.add_argument('-p', '--num_proc', dest='num_proc', required=False,
                             type=int,
                             help='Number of worker processes for the '
                                  'categorization',
                             default=1)
+        parser.add_argument('-a', '--af_known', dest='af_known',
+                            required=False, type=str, choices=AF_KNOWN_MODES,
+                            help='Keep the variants with known allele '
+                                 'frequencies in gnomAD (no: only AF-unknown '
+                                 'variants, only: only AF-known variants)',
+                            default='yes')
         return parser
 
     @staticmethod
@@ -30,6 +55,8 @@ class Categorization(Runnable):
         log.print_arg('The output path', args.outfile_path)
         log.print_arg('No. worker processes for the categorization',
                       f'{args.num_proc: ,d}')
+        log.print_arg('Keep the variants with known allele frequencies',
+                      args.af_known)
 
     @staticmethod
     def _check_args_validity(args: argparse.Namespace):
@@ -39,4 +66,36 @@ class Categorization(Runnable):
         error.check_num_proc(args.num_proc)
 
     def run(self):
-        pass
+        project_dir = os.path.dirname(
+            os.path.dirname(os.path.abspath(__file__)))
+        conf_dir = os.path.join(project_dir, 'conf')
+
+        log.print_progress('Load the input VCF file into a DataFrame')
+        variant_df, annot_keys = parse_vep_vcf(self.args.in_vcf_path,
+                                               _RDD_COLNAMES)
+        log.print_progress(f'No. input variants: {len(variant_df.index):,d}')
+
+        if self.args.af_known != 'yes':
+            variant_df = filter_by_af_known(variant_df, self.args.af_known)
+            log.print_progress(f'No. variants after the AF filter '
+                               f'({self.args.af_known}): '
+                               f'{len(variant_df.index):,d}')
+
+        with open(os.path.join(conf_dir, 'categories.yaml')) as cat_conf_file:
+            category_dict = yaml.safe_load(cat_conf_file)
+
+        gene_list_table = \
+            GeneListTable.load(os.path.join(conf_dir, 'gene_matrix.txt'))
+
+        is_rdd_cat = load_rdd_cat_mask(
+            os.path.join(conf_dir, 'redundant_categories.yaml'), category_dict)
+
+        log.print_progress('Categorize the variants of all the samples')
+        cat_result = categorize_variants(variant_df, category_dict,
+                                         gene_list_table, annot_keys,
+                                         self.args.num_proc, is_rdd_cat)
+        log.print_progress(f'No. non-redundant CWAS categories with at least '
+                           f'1 variant: {len(cat_result.cat_names):,d}')
+
+        log.print_progress('Write the result of the categorization')
+        cat_result.write(self.args.outfile_path)
@@ -0,0 +1,188 @@
+"""
+Table of allele frequencies (AFs) of known variants (e.g. gnomAD)
+
+The alternative alleles of each chromosome in a sites VCF file are stored in
+three .npy files ({chrom}.pos.npy, {chrom}.allele.npy and {chrom}.af.npy):
+uint32 positions, uint64 hashes of the (REF, ALT) pairs and float32 AFs,
+sorted by the positions and then the hashes. The alleles are trimmed to their
+minimal representation before hashing, so the alleles of multi-allelic records
+match the same variants from other VCF files. Variants are annotated by
+memory-mapping the arrays and searching all the variants of a chromosome
+at once, which replaces the per-variant exact matching of VEP.
+"""
+import os
+import re
+
+import numpy as np
+import pandas as pd
+import pysam
+
+ARR_NAMES = ['pos', 'allele', 'af']
+_BATCH_SIZE = 1 << 20  # No. alleles hashed at once
+_AF_PATTERN = re.compile(r'(?:^|;)AF=([^;]*)')
+
+
+def get_af_table_path(table_dir: str, chrom: str, arr_name: str) -> str:
+    return os.path.join(table_dir, f'{chrom}.{arr_name}.npy')
+
+
+def has_af_table(table_dir: str, chroms: list) -> bool:
+    """ Return True if the table files of all the chromosomes exist """
+    return all(os.path.isfile(get_af_table_path(table_dir, chrom, arr_name))
+               for chrom in chroms for arr_name in ARR_NAMES)
+
+
+def trim_alleles(pos: int, ref: str, alt: str) -> (int, str, str):
+    """ Remove the common suffix and then the common prefix of the alleles
+    leaving at least one base in each and return the adjusted variant
+    """
+    while len(ref) > 1 and len(alt) > 1 and ref[-1] == alt[-1]:
+        ref = ref[:-1]
+        alt = alt[:-1]
+
+    while len(ref) > 1 and len(alt) > 1 and ref[0] == alt[0]:
+        ref = ref[1:]
+        alt = alt[1:]
+        pos += 1
+
+    return pos, ref, alt
+
+
+def hash_alleles(allele_strs: list) -> np.ndarray:
+    """ Return an uint64 array of the hashes of the allele strings """
+    return pd.util.hash_array(np.array(allele_strs, dtype=object))
+
+
+def make_af_table(vcf_path: str, chrom: str, table_dir: str) -> int:
+    """ Make the table files of the AFs (the 'AF' INFO field) of the
+    alternative alleles of the chromosome in the bgzipped and indexed VCF file
+    and return the number of the alleles. Alleles without AFs and spanning
+    deletions ('*') are not stored.
+    """
+    os.makedirs(table_dir, exist_ok=True)
+    pos_arrs = []
+    hash_arrs = []
+    af_arrs = []
+    positions = []
+    allele_strs = []
+    afs = []
+
+    def hash_batch():
+        pos_arrs.append(np.array(positions, dtype=np.uint32))
+        hash_arrs.append(hash_alleles(allele_strs))
+        af_arrs.append(np.array(afs, dtype=np.float32))
+        positions.clear()
+        allele_strs.clear()
+        afs.clear()
+
+    with pysam.TabixFile(vcf_path) as vcf_file:
+        vcf_lines = vcf_file.fetch(chrom) if chrom in vcf_file.contigs else []
+
+        for line in vcf_lines:
+            fields = line.split('\t', 8)
+            af_match = _AF_PATTERN.search(fields[7])
+
+            if af_match is None:
+                continue
+
+            for alt, af in zip(fields[4].split(','),
+                               af_match.group(1).split(',')):
+                if alt == '*' or af == '.':
+                    continue
+
+                pos, ref, alt = trim_alleles(int(fields[1]), fields[3], alt)
+                positions.append(pos)
+                allele_strs.append(f'{ref}>{alt}')
+                afs.append(float(af))
+
+            if len(positions) >= _BATCH_SIZE:
+                hash_batch()
+
+    hash_batch()
+    pos_arr = np.concatenate(pos_arrs)
+    hash_arr = np.concatenate(hash_arrs)
+    af_arr = np.concatenate(af_arrs)
+    order = np.lexsort((hash_arr, pos_arr))
+
+    for arr_name, arr in zip(ARR_NAMES, [pos_arr, hash_arr, af_arr]):
+        np.save(get_af_table_path(table_dir, chrom, arr_name), arr[order])
+
+    return len(order)
+
+
+def lookup_afs(pos_arr: np.ndarray, hash_arr: np.ndarray, af_arr: np.ndarray,
+               positions: np.ndarray, allele_hashes: np.ndarray) -> np.ndarray:
+    """ Return a float32 array of the AFs of the variants (positions and
+    allele hashes) in the table arrays of a chromosome. Variants not in the
+    table get NaN.
+    """
+    positions = np.asarray(positions, dtype=np.int64)
+    var_afs = np.full(len(positions), np.nan, dtype=np.float32)
+
+    # Alleles at the position of each variant are in [first_ind, last_ind).
+    first_ind = np.searchsorted(pos_arr, positions, side='left')
+    last_ind = np.searchsorted(pos_arr, positions, side='right')
+    num_alleles = last_ind - first_ind
+    max_num_allele = num_alleles.max() if len(positions) > 0 else 0
+
+    # Scan the k-th allele at each position at once
+    for k in range(max_num_allele):
+        var_ind = np.flatnonzero((num_alleles > k) & np.isnan(var_afs))
+        allele_ind = first_ind[var_ind] + k
+        is_match = hash_arr[allele_ind] == allele_hashes[var_ind]
+        var_afs[var_ind[is_match]] = af_arr[allele_ind[is_match]]
+
+    return var_afs
+
+
+class AfTable:
+    def __init__(self, table_dir: str, info_key: str):
+        """
+        :param table_dir: Directory of the table files from 'make_af_table'
+        :param info_key: INFO key of the AFs (e.g. 'gnomADg_AF')
+        """
+        self._table_dir = table_dir
+        self.info_key = info_key
+        self._chrom_to_arrs = {}
+
+    def get_arrs(self, chrom: str) -> list:
+        """ Return the memory-mapped table arrays of the chromosome
+        (empty arrays if the chromosome is not in the table)
+        """
+        if chrom not in self._chrom_to_arrs:
+            arr_paths = [get_af_table_path(self._table_dir, chrom, arr_name)
+                         for arr_name in ARR_NAMES]
+
+            if all(os.path.isfile(arr_path) for arr_path in arr_paths):
+                self._chrom_to_arrs[chrom] = \
+                    [np.load(arr_path, mmap_mode='r') for arr_path in arr_paths]
+            else:
+                self._chrom_to_arrs[chrom] = [
+                    np.empty(0, dtype=np.uint32), np.empty(0, dtype=np.uint64),
+                    np.empty(0, dtype=np.float32)
+                ]
+
+        return self._chrom_to_arrs[chrom]
+
+    def get_afs(self, chrom: str, positions: list, refs: list,
+                alts: list) -> np.ndarray:
+        """ Return a float32 array of the AFs of the variants (1-based
+        positions and alleles) of the chromosome. Unknown AFs are NaN.
+        """
+        trim_vars = [trim_alleles(pos, ref, alt)
+                     for pos, ref, alt in zip(positions, refs, alts)]
+        trim_positions = [pos for pos, _, _ in trim_vars]
+        allele_hashes = hash_alleles([f'{ref}>{alt}'
+                                      for _, ref, alt in trim_vars])
+
+        return lookup_afs(*self.get_arrs(chrom), trim_positions, allele_hashes)
+
+    def get_info_strs(self, chrom: str, positions: list, refs: list,
+                      alts: list) -> list:
+        """ Return a list of INFO strings (e.g. 'gnomADg_AF=0.0001') of the
+        variants of the chromosome. Unknown AFs are written as missing
+        values ('.').
+        """
+        return [f'{self.info_key}=.' if np.isnan(af)
+                else f'{self.info_key}={af:g}'
+                for af in self.get_afs(chrom, positions, refs, alts)]
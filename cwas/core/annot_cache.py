@@ -0,0 +1,148 @@
+"""
+Persistent cache of variant annotations
+
+Annotations of each variant (chrom, pos, ref, alt), which are the INFO fields
+added by the annotation (e.g. 'CSQ=...' from VEP) and the annotation integer
+from the merged annotation BED file, are stored in a SQLite database with
+a fingerprint of the annotation settings (e.g. the VEP command and the
+annotation files), so that the variants annotated before are not sent to VEP
+again. The database is in the WAL mode, which allows readers
+to run concurrently with a writer, and the least recently used entries are
+evicted if the number of entries exceeds the maximum. Lookups only read the
+database; the times of use of the found entries are written in one batch
+with the next 'put' or when the cache is closed.
+"""
+import hashlib
+import json
+import sqlite3
+import time
+
+_TIMEOUT = 600  # Seconds waiting for a lock of the database
+
+
+def make_fingerprint(*settings) -> str:
+    """ Return a SHA-1 digest of the JSON representation of the settings """
+    settings_str = json.dumps(settings, sort_keys=True, default=str)
+    return hashlib.sha1(settings_str.encode()).hexdigest()
+
+
+class AnnotCache:
+    def __init__(self, db_path: str, fingerprint: str, max_size: int = None):
+        """
+        :param db_path: Path of the SQLite database (Created if not exists)
+        :param fingerprint: Fingerprint of the annotation settings from
+                            'make_fingerprint'. Entries with different
+                            fingerprints are not visible.
+        :param max_size: Maximum number of entries (Default: No limit)
+        """
+        self._fingerprint = fingerprint
+        self._max_size = max_size
+        self._used_times = {}  # Key: Variant key, Value: Time of the last use
+        self._conn = sqlite3.connect(db_path, timeout=_TIMEOUT)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+
+        with self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS annot ('
+                'fingerprint TEXT NOT NULL, chrom TEXT NOT NULL, '
+                'pos INTEGER NOT NULL, ref TEXT NOT NULL, alt TEXT NOT NULL, '
+                'info TEXT, annot TEXT NOT NULL, last_used REAL NOT NULL, '
+                'UNIQUE (fingerprint, chrom, pos, ref, alt))'
+            )
+            self._conn.execute('CREATE INDEX IF NOT EXISTS annot_last_used '
+                               'ON annot (last_used)')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS header ('
+                'fingerprint TEXT PRIMARY KEY, lines TEXT NOT NULL)'
+            )
+
+        self._conn.execute('CREATE TEMP TABLE query ('
+                           'chrom TEXT, pos INTEGER, ref TEXT, alt TEXT)')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        if self._used_times:
+            with self._conn:
+                self._write_used_times()
+
+        self._conn.close()
+
+    def get(self, var_keys: list) -> dict:
+        """ Return a dictionary which key and value are a variant key
+        (chrom, pos, ref, alt) in the input and a tuple of its annotation
+        INFO fields (None if there is no field) and annotation integer.
+        Variants not in the cache are not listed.
+        The times of use of the found entries are written later.
+        """
+        # Only the temporary table is written, so no lock of the database
+        # is taken for writing.
+        with self._conn:
+            self._conn.execute('DELETE FROM query')
+            self._conn.executemany('INSERT INTO query VALUES (?, ?, ?, ?)',
+                                   var_keys)
+            rows = self._conn.execute(
+                'SELECT a.chrom, a.pos, a.ref, a.alt, a.info, a.annot '
+                'FROM annot a JOIN query q ON a.chrom = q.chrom '
+                'AND a.pos = q.pos AND a.ref = q.ref AND a.alt = q.alt '
+                'WHERE a.fingerprint = ?', (self._fingerprint,)
+            ).fetchall()
+
+        var_annots = {(chrom, pos, ref, alt): (info, int(annot))
+                      for chrom, pos, ref, alt, info, annot in rows}
+        used_time = time.time()
+        self._used_times.update((var_key, used_time) for var_key in var_annots)
+
+        return var_annots
+
+    def put(self, var_annots: dict):
+        """ Store the annotations and evict the least recently used entries
+        if the cache is full
+
+        :param var_annots: Dictionary like the result of 'get'
+        """
+        last_used = time.time()
+
+        with self._conn:
+            self._write_used_times()
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO annot VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                ((self._fingerprint, *var_key, info, str(annot), last_used)
+                 for var_key, (info, annot) in var_annots.items())
+            )
+
+            if self._max_size is not None:
+                self._conn.execute(
+                    'DELETE FROM annot WHERE rowid IN (SELECT rowid FROM annot '
+                    'ORDER BY last_used LIMIT max((SELECT count(*) FROM annot)'
+                    ' - ?, 0))', (self._max_size,)
+                )
+
+    def _write_used_times(self):
+        """ Write the times of use of the entries found by 'get' """
+        self._conn.executemany(
+            'UPDATE annot SET last_used = ? WHERE fingerprint = ? '
+            'AND chrom = ? AND pos = ? AND ref = ? AND alt = ?',
+            ((used_time, self._fingerprint, *var_key)
+             for var_key, used_time in self._used_times.items())
+        )
+        self._used_times.clear()
+
+    def get_header(self) -> list:
+        """ Return the VCF header lines made by the annotation
+        (None if they are not stored)
+        """
+        row = self._conn.execute(
+            'SELECT lines FROM header WHERE fingerprint = ?',
+            (self._fingerprint,)
+        ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def put_header(self, header_lines: list):
+        with self._conn:
+            self._conn.execute('INSERT OR REPLACE INTO header VALUES (?, ?)',
+                               (self._fingerprint, json.dumps(header_lines)))
@@ -0,0 +1,116 @@
+"""
+Index of the positions of each reference base in a masked genome
+
+The 0-based positions of A, C, G and T of each chromosome are stored as
+uint32 arrays in .npy files ({chrom}.{base}.npy). Simulations memory-map
+these files and draw positions of a specific reference base directly.
+The intervals of the chromosome without 'N' are stored together
+({chrom}.non_n.npy) as an uint32 array of (start, end) pairs (0-based,
+half-open).
+"""
+import os
+
+import numpy as np
+
+from cwas.fastafile import FastaFile
+
+BASES = ['A', 'C', 'G', 'T']
+_CHUNK_SIZE = 1 << 24  # No. bases read at once
+_UPPER_MASK = np.uint8(0xDF)  # ASCII code & _UPPER_MASK = Uppercase code
+
+
+def get_base_index_path(index_dir: str, chrom: str, base: str) -> str:
+    return os.path.join(index_dir, f'{chrom}.{base}.npy')
+
+
+def get_non_n_interval_path(index_dir: str, chrom: str) -> str:
+    return os.path.join(index_dir, f'{chrom}.non_n.npy')
+
+
+def has_base_index(index_dir: str, chroms: list) -> bool:
+    """ Return True if the index files of all the chromosomes exist """
+    return all(os.path.isfile(get_base_index_path(index_dir, chrom, base))
+               for chrom in chroms for base in BASES)
+
+
+def make_base_index(fa_path: str, chrom: str, index_dir: str) -> dict:
+    """ Make the index files listing the positions of each base
+    and the intervals without 'N' of the chromosome in the input FASTA file,
+    and return a dictionary of the counts of 'A', 'C', 'G', 'T' and 'N'.
+    Lowercase bases are regarded as uppercase bases
+    and other characters are not indexed.
+    """
+    os.makedirs(index_dir, exist_ok=True)
+
+    with FastaFile(fa_path, use_mmap=not fa_path.endswith('.gz')) \
+            as fasta_file:
+        chrom_size = fasta_file.get_size(chrom)
+        chunk_starts = range(0, chrom_size, _CHUNK_SIZE)
+
+        def iter_chunks():
+            """ Yield ASCII codes of each chunk converted into uppercase """
+            for chunk_start in chunk_starts:
+                chunk_end = min(chunk_start + _CHUNK_SIZE, chrom_size)
+                chunk = fasta_file.get_seq(chrom, chunk_start, chunk_end)
+                yield chunk_start, \
+                    np.frombuffer(chunk.encode(), dtype=np.uint8) & _UPPER_MASK
+
+        # 1st pass: Count each base to allocate the index files
+        base_cnts = np.zeros(256, dtype=np.int64)
+        for _, chunk in iter_chunks():
+            base_cnts += np.bincount(chunk, minlength=256)
+
+        index_files = [
+            np.lib.format.open_memmap(
+                get_base_index_path(index_dir, chrom, base), mode='w+',
+                dtype=np.uint32, shape=(int(base_cnts[ord(base)]),)
+            ) for base in BASES
+        ]
+
+        # 2nd pass: Write the positions of each base
+        # and find the boundaries of the intervals without 'N'
+        offsets = [0] * len(BASES)
+        boundaries = []
+        prev_is_base = False
+
+        for chunk_start, chunk in iter_chunks():
+            for i, base in enumerate(BASES):
+                positions = np.flatnonzero(chunk == ord(base)) + chunk_start
+                index_files[i][offsets[i]:offsets[i] + len(positions)] = \
+                    positions
+                offsets[i] += len(positions)
+
+            is_base = chunk != ord('N')
+            is_changed = np.diff(is_base, prepend=prev_is_base)
+            boundaries.append(np.flatnonzero(is_changed) + chunk_start)
+            prev_is_base = bool(is_base[-1])
+
+        for index_file in index_files:
+            index_file.flush()
+
+    if prev_is_base:
+        boundaries.append([chrom_size])
+
+    non_n_intervals = np.concatenate(boundaries).astype(np.uint32) \
+        .reshape(-1, 2) if boundaries else np.empty((0, 2), dtype=np.uint32)
+    np.save(get_non_n_interval_path(index_dir, chrom), non_n_intervals)
+
+    return {base: int(base_cnts[ord(base)]) for base in BASES + ['N']}
+
+
+def load_base_index(index_dir: str, chroms: list) -> dict:
+    """ Memory-map the index files and return a dictionary which key and value
+    are a chromosome ID and a list of position arrays of A, C, G and T.
+    """
+    return {
+        chrom: [np.load(get_base_index_path(index_dir, chrom, base),
+                        mmap_mode='r') for base in BASES]
+        for chrom in chroms
+    }
+
+
+def load_non_n_intervals(index_dir: str, chrom: str) -> np.ndarray:
+    """ Return an array of the intervals without 'N' of the chromosome
+    which shape is (No. intervals, 2)
+    """
+    return np.load(get_non_n_interval_path(index_dir, chrom))
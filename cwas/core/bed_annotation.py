@@ -0,0 +1,241 @@
+"""
+Annotation of variants by the merged annotation BED file
+
+The merged BED file from the preparation step lists sorted and
+non-overlapping intervals of each chromosome with annotation integers
+(one-hot encodings of the overlapped annotation BED files). The intervals of
+a chromosome are loaded into NumPy arrays and the annotation integer of each
+variant is the bitwise OR of the annotation integers of all the intervals
+overlapping the search region of the variant.
+"""
+import io
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pysam
+
+# The maximum number of annotation keys that fit in an uint64 annotation
+# integer. Object arrays of Python integers are used for more keys.
+MAX_UINT64_ANNOT_KEYS = 64
+
+# The last breakpoints of each chromosome in an AnnotIndex
+_SENTINEL_BREAK = np.iinfo(np.uint32).max
+
+
+def get_annot_dtype(num_annot_key: int) -> np.dtype:
+    """ Return a data type of annotation integers for the number of keys """
+    return np.dtype(np.uint64) if num_annot_key <= MAX_UINT64_ANNOT_KEYS \
+        else np.dtype(object)
+
+
+def load_annot_intervals(annot_bed_file: pysam.TabixFile, chrom: str,
+                         num_annot_key: int) \
+        -> (np.ndarray, np.ndarray, np.ndarray):
+    """ Load the intervals of the chromosome in the merged annotation BED file
+    and return arrays of their starts, ends, and annotation integers
+    """
+    bed_lines = list(annot_bed_file.fetch(chrom)) \
+        if chrom in annot_bed_file.contigs else []
+
+    if not bed_lines:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), \
+            np.empty(0, dtype=get_annot_dtype(num_annot_key))
+
+    bed_df = pd.read_table(io.StringIO('\n'.join(bed_lines)), header=None,
+                           usecols=[1, 2, 3], names=['start', 'end', 'annot'],
+                           dtype={'start': np.int64, 'end': np.int64,
+                                  'annot': str})
+    annot_dtype = get_annot_dtype(num_annot_key)
+    annot_ints = np.array([int(annot) for annot in bed_df['annot']],
+                          dtype=annot_dtype)
+
+    return bed_df['start'].values, bed_df['end'].values, annot_ints
+
+
+def get_search_regions(positions: np.ndarray, ref_lens: np.ndarray,
+                       alt_lens: np.ndarray) -> (np.ndarray, np.ndarray):
+    """ Return arrays of the starts and ends (0-based, half-open) of
+    the regions where annotation intervals of the variants are searched.
+
+    - Substitution: The variant position
+    - Insertion: The variant position and the next position
+    - Deletion: The deleted bases after the variant position
+
+    :param positions: 1-based positions of the variants
+    :param ref_lens: Lengths of reference alleles
+    :param alt_lens: Lengths of alternative alleles
+    """
+    positions = np.asarray(positions, dtype=np.int64) - 1  # 1-based -> 0-based
+    ref_lens = np.asarray(ref_lens, dtype=np.int64)
+    alt_lens = np.asarray(alt_lens, dtype=np.int64)
+    is_del = ref_lens > 1
+
+    region_starts = np.where(is_del, positions + 1, positions)
+    region_ends = np.where(is_del, positions + ref_lens,
+                           np.where(alt_lens > 1, positions + 2,
+                                    positions + 1))
+
+    return region_starts, region_ends
+
+
+def annotate_regions(region_starts: np.ndarray, region_ends: np.ndarray,
+                     starts: np.ndarray, ends: np.ndarray,
+                     annot_ints: np.ndarray) -> np.ndarray:
+    """ Return an array of the bitwise OR of the annotation integers of
+    the intervals (sorted and non-overlapping) overlapping each region
+    """
+    # Overlapping intervals of each region are in [first_ind, last_ind).
+    # The regions are cast to the types of the intervals, so (memory-mapped)
+    # intervals are not copied into a common type.
+    first_ind = np.searchsorted(
+        ends, np.asarray(region_starts).astype(ends.dtype), side='right')
+    last_ind = np.searchsorted(
+        starts, np.asarray(region_ends).astype(starts.dtype), side='left')
+    has_overlap = first_ind < last_ind
+    region_annots = np.zeros(len(region_starts), dtype=annot_ints.dtype)
+
+    if has_overlap.any():
+        # Zero at the end makes every index valid for 'reduceat'. It is not
+        # needed if the intervals end with an empty one (e.g. AnnotIndex).
+        padded_annot_ints = annot_ints \
+            if last_ind[has_overlap].max() < len(annot_ints) \
+            else np.append(annot_ints, np.zeros(1, dtype=annot_ints.dtype))
+        bound_ind = np.column_stack([first_ind[has_overlap],
+                                     last_ind[has_overlap]]).ravel()
+        region_annots[has_overlap] = \
+            np.bitwise_or.reduceat(padded_annot_ints, bound_ind)[::2]
+
+    return region_annots
+
+
+class AnnotIndex:
+    """ Binary index of the merged annotation BED file
+
+    The file starts with a magic string, the length of a JSON header and
+    the header, which lists the annotation keys in the order of the bits
+    of annotation integers and the offsets (from the end of the header
+    aligned to 8 bytes) and lengths of the arrays of each chromosome.
+    Each chromosome has sorted uint32 breakpoints and uint64 annotation
+    integers of the segments starting at each breakpoint.
+    The first breakpoint is 0 and the last segment of the chromosome has no
+    annotation. The breakpoints end with two sentinels (the maximum of
+    uint32), which make an empty segment without annotation, so the starts,
+    ends and annotation integers of the segments are all views of the arrays.
+    The arrays are memory-mapped, so opening the index is instant and
+    all processes share one page-cache copy of it without copies.
+    """
+    MAGIC = b'CWASANN2'
+
+    def __init__(self, index_path: str):
+        self._index_mmap = np.memmap(index_path, dtype=np.uint8, mode='r')
+
+        if self._index_mmap[:len(self.MAGIC)].tobytes() != self.MAGIC:
+            raise ValueError(f'"{index_path}" is not an annotation index.')
+
+        header_start = len(self.MAGIC) + 8
+        header_len = int(self._index_mmap[len(self.MAGIC):header_start]
+                         .view(np.uint64)[0])
+        header = json.loads(self._index_mmap[
+            header_start:header_start + header_len].tobytes())
+        self.annot_keys = header['annot_keys']
+        self._data_start = _align(header_start + header_len)
+        # Key: Chrom ID, Value: (Offset, No. breakpoints)
+        self._chrom_to_loc = header['chroms']
+
+    def get_intervals(self, chrom: str) \
+            -> (np.ndarray, np.ndarray, np.ndarray):
+        """ Return arrays of the starts, ends, and annotation integers of
+        the segments of the chromosome like 'load_annot_intervals'
+        (The arrays are memory-mapped and the last segment is empty.)
+        """
+        if chrom not in self._chrom_to_loc:
+            return np.array([0, _SENTINEL_BREAK], dtype=np.uint32), \
+                np.full(2, _SENTINEL_BREAK, dtype=np.uint32), \
+                np.zeros(2, dtype=np.uint64)
+
+        offset, num_break = self._chrom_to_loc[chrom]
+        offset += self._data_start
+        breaks = self._index_mmap[offset:offset + 4 * num_break] \
+            .view(np.uint32)
+        mask_offset = _align(offset + 4 * num_break)
+        annot_ints = \
+            self._index_mmap[mask_offset:mask_offset + 8 * (num_break - 1)] \
+            .view(np.uint64)
+
+        return breaks[:-1], breaks[1:], annot_ints
+
+
+def is_annot_index(index_path: str) -> bool:
+    """ Return True if the file is an AnnotIndex file of the current format """
+    if not os.path.isfile(index_path):
+        return False
+
+    with open(index_path, 'rb') as index_file:
+        return index_file.read(len(AnnotIndex.MAGIC)) == AnnotIndex.MAGIC
+
+
+def _align(offset: int, size: int = 8) -> int:
+    return (offset + size - 1) // size * size
+
+
+def write_annot_index(annot_bed_path: str, index_path: str):
+    """ Compile the merged annotation BED file into an AnnotIndex file """
+    with pysam.TabixFile(annot_bed_path) as annot_bed_file:
+        annot_keys = annot_bed_file.header[0].split('=')[1].split('|')
+        chroms = list(annot_bed_file.contigs)
+
+        if len(annot_keys) > MAX_UINT64_ANNOT_KEYS:
+            raise ValueError(f'An annotation index supports up to '
+                             f'{MAX_UINT64_ANNOT_KEYS} annotation keys '
+                             f'but "{annot_bed_path}" has {len(annot_keys)}.')
+
+        chrom_arrs = {}
+
+        for chrom in chroms:
+            starts, ends, annot_ints = \
+                load_annot_intervals(annot_bed_file, chrom, len(annot_keys))
+
+            # Breakpoints are the starts and the ends followed by gaps.
+            next_starts = np.append(starts[1:], -1)
+            gap_starts = ends[ends != next_starts]
+            breaks = np.concatenate([starts, gap_starts])
+            break_annot_ints = np.concatenate(
+                [annot_ints, np.zeros(len(gap_starts), dtype=np.uint64)])
+
+            if len(breaks) == 0 or breaks.min() > 0:
+                breaks = np.append(breaks, 0)
+                break_annot_ints = np.append(break_annot_ints, np.uint64(0))
+
+            order = np.argsort(breaks, kind='stable')
+            chrom_arrs[chrom] = (
+                np.append(breaks[order], [_SENTINEL_BREAK] * 2)
+                .astype(np.uint32),
+                np.append(break_annot_ints[order], np.uint64(0))
+                .astype(np.uint64)
+            )
+
+    # Locate the arrays after the header
+    header = {'annot_keys': annot_keys, 'chroms': {}}
+    offset = 0
+
+    for chrom, (breaks, break_annot_ints) in chrom_arrs.items():
+        header['chroms'][chrom] = [offset, len(breaks)]
+        offset = _align(_align(offset + breaks.nbytes)
+                        + break_annot_ints.nbytes)
+
+    header_bytes = json.dumps(header).encode()
+    data_start = _align(len(AnnotIndex.MAGIC) + 8 + len(header_bytes))
+
+    with open(index_path, 'wb') as index_file:
+        index_file.write(AnnotIndex.MAGIC)
+        index_file.write(np.uint64(len(header_bytes)).tobytes())
+        index_file.write(header_bytes)
+
+        for chrom, (breaks, break_annot_ints) in chrom_arrs.items():
+            offset = data_start + header['chroms'][chrom][0]
+            index_file.seek(offset)
+            index_file.write(breaks.tobytes())
+            index_file.seek(_align(offset + breaks.nbytes))
+            index_file.write(break_annot_ints.tobytes())
@@ -0,0 +1,124 @@
+"""
+Annotation of variants by scores in bigWig files (e.g. conservation scores)
+
+The search regions of the variants of a chromosome (see
+'cwas.core.bed_annotation.get_search_regions') are sorted and grouped into
+clusters of nearby regions. The per-base scores of each cluster are read by
+one query and the score of each variant is the maximum score in its region.
+This module requires pyBigWig.
+"""
+import numpy as np
+
+try:
+    import pyBigWig
+except ImportError:
+    pyBigWig = None
+
+_MAX_GAP = 10000  # Max. distance between regions in the same cluster
+_MAX_SPAN = 1 << 20  # Max. No. bases read by one query
+
+
+def iter_region_clusters(starts: np.ndarray, ends: np.ndarray):
+    """ Yield (first index, last index (exclusive)) of each cluster of
+    the regions sorted by their starts
+    """
+    num_region = len(starts)
+    first_idx = 0
+    cluster_end = ends[0] if num_region > 0 else 0
+
+    for i in range(1, num_region):
+        if starts[i] - cluster_end > _MAX_GAP or \
+                max(cluster_end, ends[i]) - starts[first_idx] > _MAX_SPAN:
+            yield first_idx, i
+            first_idx = i
+            cluster_end = ends[i]
+        else:
+            cluster_end = max(cluster_end, ends[i])
+
+    if num_region > 0:
+        yield first_idx, num_region
+
+
+def score_regions(bigwig_file, chrom: str, region_starts: np.ndarray,
+                  region_ends: np.ndarray) -> np.ndarray:
+    """ Return an array of the maximum scores in the regions (0-based,
+    half-open) of the chromosome. Regions without scores get NaN.
+
+    :param bigwig_file: A file object from 'pyBigWig.open'
+    """
+    scores = np.full(len(region_starts), np.nan)
+    chrom_size = bigwig_file.chroms(chrom)
+
+    if not chrom_size or len(region_starts) == 0:
+        return scores
+
+    order = np.argsort(region_starts, kind='stable')
+    starts = np.clip(np.asarray(region_starts)[order], 0, chrom_size)
+    ends = np.clip(np.asarray(region_ends)[order], 0, chrom_size)
+
+    for first_idx, last_idx in iter_region_clusters(starts, ends):
+        cluster_start = int(starts[first_idx])
+        cluster_end = int(ends[first_idx:last_idx].max())
+
+        if cluster_end <= cluster_start:
+            continue
+
+        # NaN at the end makes every index valid for 'reduceat'.
+        values = np.append(
+            bigwig_file.values(chrom, cluster_start, cluster_end, numpy=True),
+            np.nan
+        )
+        rel_starts = starts[first_idx:last_idx] - cluster_start
+        rel_ends = ends[first_idx:last_idx] - cluster_start
+        is_nonempty = rel_starts < rel_ends
+        bound_ind = np.column_stack([rel_starts[is_nonempty],
+                                     rel_ends[is_nonempty]]).ravel()
+        scores[order[first_idx:last_idx][is_nonempty]] = \
+            np.fmax.reduceat(values, bound_ind)[::2]
+
+    return scores
+
+
+class BigWigScorer:
+    def __init__(self, bigwig_path_dict: dict):
+        """
+        :param bigwig_path_dict: Dictionary which key and value are the name
+                                 of a score (INFO key) and a bigWig file path
+        """
+        if pyBigWig is None:
+            raise ImportError('pyBigWig is required to annotate variants '
+                              'by bigWig files.')
+
+        self._bigwig_files = {key: pyBigWig.open(bigwig_path)
+                              for key, bigwig_path in bigwig_path_dict.items()}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        for bigwig_file in self._bigwig_files.values():
+            bigwig_file.close()
+
+    @property
+    def keys(self) -> list:
+        return list(self._bigwig_files)
+
+    def get_info_strs(self, chrom: str, region_starts: np.ndarray,
+                      region_ends: np.ndarray) -> list:
+        """ Return a list of INFO strings (e.g. 'phyloP=1.5;phastCons=0.2')
+        of the regions of the chromosome. Missing scores are written as
+        missing values ('.').
+        """
+        score_strs = []
+
+        for key, bigwig_file in self._bigwig_files.items():
+            scores = score_regions(bigwig_file, chrom, region_starts,
+                                   region_ends)
+            score_strs.append([f'{key}=.' if np.isnan(score)
+                               else f'{key}={score:g}' for score in scores])
+
+        return [';'.join(region_score_strs)
+                for region_score_strs in zip(*score_strs)]
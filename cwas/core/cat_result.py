@@ -0,0 +1,127 @@
+"""
+Result of the CWAS categorization, the numbers of variants of each sample
+and category
+
+Most (sample, category) pairs have no variants, so the result is kept as a
+sparse matrix (CSR) whose rows and columns are samples and categories.
+The result is written into three files: the matrix ({prefix}.npz from
+'scipy.sparse.save_npz') and the sample IDs and the category names in the
+order of the rows and columns ({prefix}.samples.txt and
+{prefix}.categories.txt). Other paths are written and read as the
+tab-separated table of the previous versions, a block of samples at a time,
+so the full matrix is never densified.
+"""
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+_BLOCK_SIZE = 1 << 10  # No. samples (rows) of the text table at once
+
+
+def is_sparse_path(path: str) -> bool:
+    return path.endswith('.npz')
+
+
+def get_index_paths(path: str) -> (str, str):
+    """ Return the paths of the sample IDs and the category names of
+    the result (.npz) file
+    """
+    prefix = path[:-len('.npz')] if is_sparse_path(path) else path
+    return f'{prefix}.samples.txt', f'{prefix}.categories.txt'
+
+
+def _read_lines(path: str) -> np.ndarray:
+    with open(path) as infile:
+        return np.array([line.rstrip('\n') for line in infile], dtype=object)
+
+
+def _write_lines(path: str, values: np.ndarray):
+    with open(path, 'w') as outfile:
+        for value in values:
+            print(value, file=outfile)
+
+
+class CatResult:
+    def __init__(self, cnt_mat, sample_ids, cat_names):
+        """
+        :param cnt_mat: No. variants of each sample (row) and category
+                        (column) (Any matrix 'scipy.sparse.csr_matrix'
+                        accepts)
+        :param sample_ids: Sample IDs of the rows
+        :param cat_names: Category names of the columns
+        """
+        self.cnt_mat = sparse.csr_matrix(cnt_mat)
+        self.sample_ids = np.asarray(sample_ids, dtype=object)
+        self.cat_names = np.asarray(cat_names, dtype=object)
+
+        if self.cnt_mat.shape != (len(self.sample_ids), len(self.cat_names)):
+            raise ValueError(f'The shape of the matrix {self.cnt_mat.shape} '
+                             f'does not match No. samples and categories.')
+
+    @classmethod
+    def read(cls, path: str):
+        """ Read the result from the .npz file and its index files, or the
+        tab-separated table (the 'SAMPLE' column and a column for each
+        category)
+        """
+        if is_sparse_path(path):
+            sample_path, cat_path = get_index_paths(path)
+            return cls(sparse.load_npz(path), _read_lines(sample_path),
+                       _read_lines(cat_path))
+
+        block_mats = []
+        sample_ids = []
+        cat_names = []
+
+        for block_df in pd.read_table(path, index_col='SAMPLE',
+                                      chunksize=_BLOCK_SIZE):
+            block_mats.append(sparse.csr_matrix(block_df.values))
+            sample_ids.extend(block_df.index.astype(str))
+            cat_names = block_df.columns.values
+
+        if not block_mats:
+            return cls(sparse.csr_matrix((0, len(cat_names))), sample_ids,
+                       cat_names)
+
+        return cls(sparse.vstack(block_mats, format='csr'), sample_ids,
+                   cat_names)
+
+    def write(self, path: str):
+        """ Write the result as the .npz file and its index files if the
+        path ends with '.npz', or the tab-separated table otherwise
+        """
+        if is_sparse_path(path):
+            sample_path, cat_path = get_index_paths(path)
+            sparse.save_npz(path, self.cnt_mat)
+            _write_lines(sample_path, self.sample_ids)
+            _write_lines(cat_path, self.cat_names)
+            return
+
+        with open(path, 'w') as outfile:
+            print('SAMPLE', *self.cat_names, sep='\t', file=outfile)
+
+            for start in range(0, len(self.sample_ids), _BLOCK_SIZE):
+                end = start + _BLOCK_SIZE
+                block_df = pd.DataFrame(self.cnt_mat[start:end].toarray(),
+                                        index=self.sample_ids[start:end])
+                block_df.to_csv(outfile, sep='\t', header=False)
+
+    def select_categories(self, is_select: np.ndarray):
+        """ Return the result of the categories where 'is_select' is True """
+        return CatResult(self.cnt_mat[:, is_select], self.sample_ids,
+                         self.cat_names[is_select])
+
+    def drop_categories(self, cat_names: list):
+        """ Return the result without the categories (Names not in the
+        result are ignored.)
+        """
+        return self.select_categories(~np.isin(self.cat_names,
+                                               list(cat_names)))
+
+    def adjust(self, adj_factors: np.ndarray):
+        """ Return the result whose No. variants of each sample are
+        multiplied by its adjustment factor
+        """
+        adj_mat = sparse.diags(np.asarray(adj_factors, dtype=np.float64))
+        return CatResult(adj_mat @ self.cnt_mat, self.sample_ids,
+                         self.cat_names)
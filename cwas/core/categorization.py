@@ -0,0 +1,594 @@
+"""
+Categorization of annotated variants into CWAS categories
+
+A CWAS category is a combination of one annotation term from each group
+(var_type, gene_list, cons, effect and region) in the category configuration
+file, and its name is the alternative names of the terms joined by '_'
+(e.g. 'SNV_Any_All_LoFRegion_Any'). The terms of each variant are represented
+by a boolean matrix (variants x terms) of each group and the ID of
+a category is the mixed-radix number of the indices of its terms.
+
+Variants with the same terms of the groups except the last one (region) share
+the same combinations of those terms, so the combinations of each distinct
+pattern of those terms are expanded only once. The variants of each sample
+and pattern are summed up by the terms of the last group and the sums are
+scattered into the counts of the categories by blocks of samples.
+Redundant categories are left out of the counts: the combinations whose
+categories are all redundant are not expanded at all, and only the cells of
+the non-redundant categories are allocated and counted.
+"""
+import hashlib
+import itertools
+import json
+import multiprocessing as mp
+import os
+import re
+from functools import partial
+
+import numpy as np
+import pandas as pd
+import yaml
+from scipy import sparse
+
+from cwas.core.cat_result import CatResult
+from cwas.core.common import load_npz_cache, save_npz_cache
+from cwas.core.gene_list_table import GeneListTable
+
+# The order of the annotation groups in the category names
+GROUPS = ['var_type', 'gene_list', 'cons', 'effect', 'region']
+
+# A conservation term is assigned if the score is not lower than the cutoff.
+CONS_CUTOFFS = {'phyloP46wayVt': 2.0, 'phastCons46wayVt': 0.2}
+
+# Modes of the filter by whether the allele frequency is known in gnomAD
+# (yes: keep all, no: keep AF-unknown variants, only: keep AF-known variants)
+AF_KNOWN_MODES = ['yes', 'no', 'only']
+_AF_COLNAME = 'gnomADg_AF'
+
+# Sequence Ontology terms of VEP consequences
+_CODING_CSQS = {
+    'frameshift_variant', 'inframe_insertion', 'inframe_deletion',
+    'synonymous_variant', 'stop_retained_variant', 'start_retained_variant',
+    'missense_variant', 'protein_altering_variant', 'stop_gained',
+    'stop_lost', 'start_lost', 'splice_donor_variant',
+    'splice_acceptor_variant', 'coding_sequence_variant',
+    'incomplete_terminal_codon_variant',
+}
+_INFRAME_CSQS = {'inframe_insertion', 'inframe_deletion'}
+_SILENT_CSQS = {'synonymous_variant', 'stop_retained_variant',
+                'start_retained_variant'}
+_LOF_CSQS = {'stop_gained', 'frameshift_variant', 'splice_donor_variant',
+             'splice_acceptor_variant'}
+_UTR_CSQS = {'5_prime_UTR_variant', '3_prime_UTR_variant'}
+_INTERGENIC_CSQS = {'intergenic_variant', 'downstream_gene_variant'}
+_OUT_OF_GENE_CSQS = {'upstream_gene_variant', 'downstream_gene_variant',
+                     'intergenic_variant'}
+
+_MAX_BLOCK_SIZE = 1 << 24  # Max. No. (sample, category) counts in a block
+_MAX_NUM_ANNOT_KEY = 64  # No. bits of an annotation integer
+
+
+def parse_vep_vcf(vep_vcf_path: str, rdd_colnames: list = None) \
+        -> (pd.DataFrame, list):
+    """ Parse the VCF file from VEP and make a pandas.DataFrame object
+    listing the annotated variants. The annotation integers are kept as
+    an uint64 'ANNOT' column, whose i-th bit is set if the variant is
+    in the i-th annotation key (BED file) in the ANNOT header.
+
+    :param vep_vcf_path: The path of the VCF file listing annotated variants
+                         by VEP
+    :param rdd_colnames: The list of column names redundant for CWAS
+                         (Warning: Unavailable column names will be ignored.)
+    :return: The DataFrame object listing annotated variants and the list of
+             the annotation keys in the order of the bits
+    """
+    variant_df_rows = []
+    variant_df_colnames = []
+    # The list of the field names that make up the CSQ information
+    csq_field_names = []
+    annot_field_names = []
+
+    # Parse the VCF file
+    with open(vep_vcf_path, 'r') as vep_vcf_file:
+        for line in vep_vcf_file:
+            if line.startswith('#'):  # The comments
+                if line.startswith('#CHROM'):  # The header
+                    variant_df_colnames = line[1:].rstrip('\n').split('\t')
+                elif line.startswith('##INFO=<ID=CSQ'):
+                    csq_line = line.rstrip('">\n')
+                    info_format_start_idx = \
+                        re.search(r'Format: ', csq_line).span()[1]
+                    csq_field_names = \
+                        csq_line[info_format_start_idx:].split('|')
+                elif line.startswith('##INFO=<ID=ANNOT'):
+                    annot_line = line.rstrip('">\n')
+                    annot_field_str_idx = \
+                        re.search(r'Key=', annot_line).span()[1]
+                    annot_field_names = \
+                        annot_line[annot_field_str_idx:].split('|')
+            else:
+                variant_df_row = line.rstrip('\n').split('\t')
+                variant_df_rows.append(variant_df_row)
+
+    vep_vcf_df = pd.DataFrame(variant_df_rows, columns=variant_df_colnames)
+
+    # Parse the INFO field
+    info_strs = vep_vcf_df['INFO'].values
+    info_dicts = list(map(parse_info_str, info_strs))
+    # Absent or missing ('.') INFO values are normalized into empty strings
+    info_df = pd.DataFrame(info_dicts).fillna('').replace('.', '')
+
+    # Parse the CSQ strings (VEP results)
+    csq_strs = info_df['CSQ'].values
+    csq_records = list(map(lambda csq_str: csq_str.split('|'), csq_strs))
+    csq_df = pd.DataFrame(csq_records, columns=csq_field_names)
+
+    # Parse the annotation integers
+    if len(annot_field_names) > _MAX_NUM_ANNOT_KEY:
+        raise ValueError(f'Too many annotation keys '
+                         f'({len(annot_field_names):,d}) in the ANNOT header. '
+                         f'The maximum is {_MAX_NUM_ANNOT_KEY}.')
+
+    annot_ints = info_df['ANNOT'].to_numpy(dtype=str).astype(np.uint64)
+
+    # Concatenate those DataFrames
+    variant_df = pd.concat([vep_vcf_df.drop(columns='INFO'),
+                            info_df.drop(columns=['CSQ', 'ANNOT']), csq_df],
+                           axis='columns')
+    variant_df['ANNOT'] = annot_ints
+
+    # Trim the columns redundant for CWAS
+    if rdd_colnames is not None:
+        variant_df.drop(columns=rdd_colnames, inplace=True, errors='ignore')
+
+    return variant_df, annot_field_names
+
+
+def filter_by_af_known(variant_df: pd.DataFrame, mode: str) -> pd.DataFrame:
+    """ Return the variants filtered by whether their allele frequencies
+    are known in gnomAD (one of the AF_KNOWN_MODES). Variants without the
+    AF column are regarded as AF-unknown.
+    """
+    if mode not in AF_KNOWN_MODES:
+        raise ValueError(f'Invalid mode "{mode}" of the AF filter. '
+                         f'It must be one of {AF_KNOWN_MODES}.')
+
+    if mode == 'yes':
+        return variant_df
+
+    is_af_known = variant_df[_AF_COLNAME].values != '' \
+        if _AF_COLNAME in variant_df.columns \
+        else np.zeros(len(variant_df.index), dtype=bool)
+
+    return variant_df[is_af_known if mode == 'only' else ~is_af_known]
+
+
+def parse_info_str(info_str: str) -> dict:
+    """ Parse the string in the INFO field of the VCF file from VEP
+    and make a dictionary
+    """
+    info_dict = {}
+    key_value_pairs = info_str.split(';')
+
+    for key_value_pair in key_value_pairs:
+        key, value = key_value_pair.split('=', 1)
+        info_dict[key] = value
+
+    return info_dict
+
+
+def get_category_names(category_dict: dict) -> list:
+    """ Return a list of the names of all the categories in the order of
+    their IDs
+    """
+    return ['_'.join(term_names) for term_names in itertools.product(
+        *[category_dict[group].values() for group in GROUPS]
+    )]
+
+
+def get_rdd_cat_cache_path(rdd_cat_path: str) -> str:
+    return os.path.splitext(rdd_cat_path)[0] + '.bitset.npz'
+
+
+def load_rdd_cat_mask(rdd_cat_path: str, category_dict: dict) -> np.ndarray:
+    """ Return a boolean array which is True for the IDs of the categories
+    listed in the file of redundant categories (YAML)
+
+    The array is compiled into a bitset file next to the list (from
+    'get_rdd_cat_cache_path') and the bitset is reused as long as the digest
+    of the list and the category configuration is unchanged, so the long
+    list is not parsed in every run.
+    """
+    with open(rdd_cat_path, 'rb') as rdd_cat_file:
+        rdd_cat_bytes = rdd_cat_file.read()
+
+    # The category IDs depend on the order of the terms.
+    digest = hashlib.sha1(rdd_cat_bytes +
+                          json.dumps(category_dict).encode()).hexdigest()
+    num_cat = int(np.prod([len(category_dict[group]) for group in GROUPS]))
+    cache_path = get_rdd_cat_cache_path(rdd_cat_path)
+    cache = load_npz_cache(cache_path, digest)
+
+    if cache is not None:
+        return np.unpackbits(cache['bits'], count=num_cat).astype(bool)
+
+    loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+    rdd_cat_set = set(yaml.load(rdd_cat_bytes, Loader=loader) or [])
+    is_rdd_cat = np.array([cat_name in rdd_cat_set for cat_name
+                           in get_category_names(category_dict)], dtype=bool)
+    save_npz_cache(cache_path, digest, bits=np.packbits(is_rdd_cat))
+
+    return is_rdd_cat
+
+
+def get_effect_terms(consequence: str, biotype: str, polyphen: str) -> set:
+    """ Return a set of the effect terms of a variant from the consequence
+    (Sequence Ontology terms joined by '&'), the biotype of the transcript
+    and the PolyPhen prediction from VEP
+    """
+    csq_terms = set(consequence.split('&'))
+    effect_terms = {'Any'}
+
+    if csq_terms & _CODING_CSQS:
+        effect_terms.add('CodingRegion')
+
+        if 'frameshift_variant' in csq_terms:
+            effect_terms.add('FrameshiftRegion')
+        if csq_terms & _INFRAME_CSQS:
+            effect_terms.add('InFrameRegion')
+        if csq_terms & _SILENT_CSQS:
+            effect_terms.add('SilentRegion')
+        if csq_terms & _LOF_CSQS:
+            effect_terms.add('LoFRegion')
+        if 'missense_variant' in csq_terms:
+            effect_terms.add('MissenseRegion')
+
+            if polyphen.startswith('probably_damaging'):
+                effect_terms.add('MissenseHVARDRegionSimple')
+    else:
+        effect_terms.add('NoncodingRegion')
+
+        if 'splice_region_variant' in csq_terms:
+            effect_terms.add('SpliceSiteNoncanonRegion')
+        if 'intron_variant' in csq_terms:
+            effect_terms.add('IntronRegion')
+        if 'upstream_gene_variant' in csq_terms:
+            effect_terms.add('PromoterRegion')
+        if csq_terms & _INTERGENIC_CSQS:
+            effect_terms.add('IntergenicRegion')
+        if csq_terms & _UTR_CSQS:
+            effect_terms.add('UTRsRegion')
+
+        # Non-coding transcripts overlapping the variant
+        if not csq_terms <= _OUT_OF_GENE_CSQS:
+            if biotype == 'antisense':
+                effect_terms.add('AntisenseRegion')
+            elif biotype == 'lincRNA':
+                effect_terms.add('lincRnaRegion')
+            elif biotype not in ('', 'protein_coding'):
+                effect_terms.add('OtherTranscriptRegion')
+
+    return effect_terms
+
+
+def _get_term_mat_by_value(values, terms: list, get_value_terms) \
+        -> np.ndarray:
+    """ Return a boolean matrix (values x terms) of the terms of each value
+    from 'get_value_terms', which is called once for each distinct value
+    """
+    codes, uniq_values = pd.factorize(pd.Series(values), sort=False)
+    uniq_term_mat = np.zeros((len(uniq_values) + 1, len(terms)), dtype=bool)
+
+    for i, value in enumerate(uniq_values):
+        value_terms = get_value_terms(value)
+        uniq_term_mat[i] = [term in value_terms for term in terms]
+
+    return uniq_term_mat[codes]  # Code -1 (missing values) -> No terms
+
+
+def get_var_type_mat(variant_df: pd.DataFrame, terms: list) -> np.ndarray:
+    is_snv = (variant_df['REF'].str.len().values == 1) & \
+        (variant_df['ALT'].str.len().values == 1)
+    term_to_arr = {'All': np.ones(len(is_snv), dtype=bool),
+                   'SNV': is_snv, 'Indel': ~is_snv}
+    return np.column_stack([term_to_arr[term] for term in terms])
+
+
+def get_cons_mat(variant_df: pd.DataFrame, terms: list) -> np.ndarray:
+    term_arrs = []
+
+    for term in terms:
+        if term == 'All':
+            term_arrs.append(np.ones(len(variant_df), dtype=bool))
+        elif term in CONS_CUTOFFS:
+            scores = pd.to_numeric(variant_df[term], errors='coerce').values
+            term_arrs.append(scores >= CONS_CUTOFFS[term])
+        else:
+            raise ValueError(f'The conservation term "{term}" does not have '
+                             f'a cutoff.')
+
+    return np.column_stack(term_arrs)
+
+
+def get_gene_symbols(variant_df: pd.DataFrame) -> np.ndarray:
+    """ Return an array of the gene symbol of each variant, which is
+    the nearest gene symbol if the variant is not assigned to any gene
+    """
+    symbols = variant_df['SYMBOL'].fillna('').values
+
+    if 'NEAREST' not in variant_df.columns:
+        return symbols
+
+    return np.where(symbols == '', variant_df['NEAREST'].fillna('').values,
+                    symbols)
+
+
+def get_gene_list_mat(variant_df: pd.DataFrame, terms: list,
+                      gene_list_table: GeneListTable) -> np.ndarray:
+    masks = gene_list_table.get_masks(get_gene_symbols(variant_df))
+    return np.column_stack([
+        np.ones(len(masks), dtype=bool) if term == 'Any'
+        else (masks & gene_list_table.get_list_mask(term)) != 0
+        for term in terms
+    ])
+
+
+def get_effect_mat(variant_df: pd.DataFrame, terms: list) -> np.ndarray:
+    polyphens = variant_df['PolyPhen'].fillna('') \
+        if 'PolyPhen' in variant_df.columns else ''
+    effect_keys = variant_df['Consequence'].fillna('') + '|' + \
+        variant_df['BIOTYPE'].fillna('') + '|' + polyphens
+    return _get_term_mat_by_value(
+        effect_keys.values, terms,
+        lambda effect_key: get_effect_terms(*effect_key.split('|'))
+    )
+
+
+def get_region_mat(variant_df: pd.DataFrame, terms: list,
+                   annot_keys: list) -> np.ndarray:
+    annot_ints = variant_df['ANNOT'].to_numpy(dtype=np.uint64)
+    term_arrs = []
+
+    for term in terms:
+        if term == 'Any':
+            term_arrs.append(np.ones(len(variant_df), dtype=bool))
+        elif term in annot_keys:
+            term_mask = np.left_shift(np.uint64(1),
+                                      np.uint64(annot_keys.index(term)))
+            term_arrs.append((annot_ints & term_mask) != 0)
+        else:  # Not in the annotation BED files
+            term_arrs.append(np.zeros(len(variant_df), dtype=bool))
+
+    return np.column_stack(term_arrs)
+
+
+def get_term_mats(variant_df: pd.DataFrame, category_dict: dict,
+                  gene_list_table: GeneListTable, annot_keys: list) -> list:
+    """ Return a list of the boolean matrices (variants x terms) of
+    the annotation groups in the order of 'GROUPS'
+    """
+    return [
+        get_var_type_mat(variant_df, list(category_dict['var_type'])),
+        get_gene_list_mat(variant_df, list(category_dict['gene_list']),
+                          gene_list_table),
+        get_cons_mat(variant_df, list(category_dict['cons'])),
+        get_effect_mat(variant_df, list(category_dict['effect'])),
+        get_region_mat(variant_df, list(category_dict['region']),
+                       annot_keys),
+    ]
+
+
+def get_term_patterns(term_mats: list) -> (np.ndarray, list):
+    """ Return an array of the pattern index of each variant and a list of
+    the term matrices of the distinct patterns
+    """
+    packed_terms = np.packbits(np.column_stack(term_mats), axis=1)
+
+    if packed_terms.shape[1] <= 8:  # Faster unique of uint64 keys
+        packed_terms = np.pad(packed_terms,
+                              [(0, 0), (0, 8 - packed_terms.shape[1])])
+        packed_terms = packed_terms.view(np.uint64).ravel()
+
+    _, first_ind, pattern_ind = np.unique(packed_terms, axis=0,
+                                          return_index=True,
+                                          return_inverse=True)
+    return pattern_ind.ravel(), [term_mat[first_ind] for term_mat in term_mats]
+
+
+def _get_rep_offsets(reps: np.ndarray) -> np.ndarray:
+    """ Return [0, 1, ..., reps[0] - 1, 0, 1, ..., reps[1] - 1, ...] """
+    rep_ends = np.cumsum(reps)
+    return np.arange(rep_ends[-1] if len(reps) > 0 else 0) - \
+        np.repeat(rep_ends - reps, reps)
+
+
+def expand_categories(pattern_term_mats: list) -> (np.ndarray, np.ndarray):
+    """ Return the category IDs of all the term combinations of each pattern
+    in the CSR format (pointers and category IDs)
+    """
+    num_pattern = len(pattern_term_mats[0])
+    entry_patterns = np.arange(num_pattern)
+    entry_cats = np.zeros(num_pattern, dtype=np.int64)
+
+    # Combine the terms of each group with the combinations so far
+    for term_mat in pattern_term_mats:
+        term_patterns, terms = np.nonzero(term_mat)  # Sorted by the patterns
+        num_terms = np.bincount(term_patterns, minlength=num_pattern)
+        term_starts = np.cumsum(num_terms) - num_terms
+        reps = num_terms[entry_patterns]
+        entry_terms = terms[np.repeat(term_starts[entry_patterns], reps)
+                            + _get_rep_offsets(reps)]
+        entry_patterns = np.repeat(entry_patterns, reps)
+        entry_cats = np.repeat(entry_cats, reps) * term_mat.shape[1] + \
+            entry_terms
+
+    num_cats = np.bincount(entry_patterns, minlength=num_pattern)
+    return np.append(0, np.cumsum(num_cats)), entry_cats
+
+
+def count_block(sample_range: tuple, key_samples: np.ndarray,
+                key_patterns: np.ndarray, key_tail_cnts: np.ndarray,
+                cat_ptrs: np.ndarray, cat_ids: np.ndarray,
+                counted_cats: np.ndarray, cat_cols: np.ndarray) \
+        -> (np.ndarray, np.ndarray, np.ndarray):
+    """ Count variants of each category of the samples in the range and
+    return arrays of the sample indices, category IDs and non-zero counts
+
+    :param sample_range: (First sample index, last sample index (exclusive))
+    :param key_samples: Sample indices of the (sample, pattern) keys
+                        sorted by the samples
+    :param key_patterns: Pattern indices of the keys
+    :param key_tail_cnts: No. variants of each key with each term of
+                          the last group (keys x terms)
+    :param cat_ptrs: Pointers of the category IDs of each pattern
+    :param cat_ids: Category IDs of the patterns from 'expand_categories'
+    :param counted_cats: Sorted IDs of the categories in the result
+    :param cat_cols: Index of each category ID in the 'counted_cats'
+                     (-1 for the categories not counted)
+    """
+    first_sample, last_sample = sample_range
+    first_key, last_key = np.searchsorted(key_samples, sample_range)
+    num_tail_term = key_tail_cnts.shape[1]
+    num_counted_cat = len(counted_cats)
+    cell_cnts = np.zeros((last_sample - first_sample) * num_counted_cat,
+                         dtype=np.int64)
+
+    # Each (key, term) pair is combined with all the categories of the key.
+    pair_keys, pair_terms = np.nonzero(key_tail_cnts[first_key:last_key])
+    pair_keys += first_key
+    pair_patterns = key_patterns[pair_keys]
+    reps = cat_ptrs[pair_patterns + 1] - cat_ptrs[pair_patterns]
+    chunk_ids = (np.cumsum(reps) - reps) // _MAX_BLOCK_SIZE
+    chunk_bounds = np.concatenate(
+        [[0], np.flatnonzero(np.diff(chunk_ids)) + 1, [len(reps)]])
+
+    for chunk_start, chunk_end in zip(chunk_bounds[:-1], chunk_bounds[1:]):
+        chunk = slice(chunk_start, chunk_end)
+        chunk_reps = reps[chunk]
+        head_cats = cat_ids[np.repeat(cat_ptrs[pair_patterns[chunk]],
+                                      chunk_reps)
+                            + _get_rep_offsets(chunk_reps)]
+        cell_cols = cat_cols[head_cats * num_tail_term
+                             + np.repeat(pair_terms[chunk], chunk_reps)]
+
+        # Redundant categories are not counted.
+        is_counted = cell_cols >= 0
+        cell_ind = np.repeat(
+            (key_samples[pair_keys[chunk]] - first_sample) * num_counted_cat,
+            chunk_reps
+        )[is_counted] + cell_cols[is_counted]
+        pair_cnts = key_tail_cnts[pair_keys[chunk], pair_terms[chunk]]
+        cell_cnts += np.bincount(
+            cell_ind, weights=np.repeat(pair_cnts, chunk_reps)[is_counted],
+            minlength=len(cell_cnts)
+        ).astype(np.int64)
+
+    cell_cnts = cell_cnts.reshape(last_sample - first_sample, num_counted_cat)
+    cnt_samples, cnt_cols = np.nonzero(cell_cnts)
+    return cnt_samples + first_sample, counted_cats[cnt_cols], \
+        cell_cnts[cnt_samples, cnt_cols]
+
+
+def count_categories(sample_ind: np.ndarray, num_sample: int,
+                     term_mats: list, num_proc: int = 1,
+                     is_rdd_cat: np.ndarray = None) \
+        -> (np.ndarray, np.ndarray, np.ndarray):
+    """ Count variants of each sample and category and return arrays of
+    the sample indices, category IDs and counts of non-zero counts
+
+    :param sample_ind: Sample index of each variant
+    :param num_sample: No. samples
+    :param term_mats: Term matrices from 'get_term_mats'
+    :param num_proc: No. processes counting blocks of samples
+    :param is_rdd_cat: Boolean array which is True for the IDs of
+                       the redundant categories, which are left out
+                       (Default: No redundant categories)
+    """
+    num_cat = int(np.prod([term_mat.shape[1] for term_mat in term_mats]))
+
+    if is_rdd_cat is None:
+        is_rdd_cat = np.zeros(num_cat, dtype=bool)
+
+    if len(sample_ind) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), \
+            np.empty(0, dtype=np.int64)
+
+    # The terms of the last group (e.g. region) are summed for each
+    # (sample, pattern of the other groups) key instead of being expanded.
+    head_term_mats = term_mats[:-1]
+    tail_term_mat = term_mats[-1]
+    pattern_ind, pattern_term_mats = get_term_patterns(head_term_mats)
+    cat_ptrs, cat_ids = expand_categories(pattern_term_mats)
+
+    # Drop the combinations whose categories with any term of the last group
+    # are all redundant.
+    num_tail_term = tail_term_mat.shape[1]
+    is_rdd_head = is_rdd_cat.reshape(-1, num_tail_term).all(axis=1)
+    is_kept = ~is_rdd_head[cat_ids]
+    cat_ptrs = np.append(0, np.cumsum(is_kept))[cat_ptrs]
+    cat_ids = cat_ids[is_kept]
+
+    num_pattern = len(pattern_term_mats[0])
+    keys, key_ind = np.unique(
+        np.asarray(sample_ind, dtype=np.int64) * num_pattern + pattern_ind,
+        return_inverse=True
+    )
+    key_ind = key_ind.ravel()
+    key_tail_cnts = np.column_stack([
+        np.bincount(key_ind, weights=tail_term_mat[:, i],
+                    minlength=len(keys)).astype(np.int64)
+        for i in range(tail_term_mat.shape[1])
+    ])
+
+    # Only the cells of the non-redundant categories are allocated.
+    counted_cats = np.flatnonzero(~is_rdd_cat)
+    cat_cols = np.full(num_cat, -1, dtype=np.int64)
+    cat_cols[counted_cats] = np.arange(len(counted_cats))
+
+    block_size = max(1, _MAX_BLOCK_SIZE // max(1, len(counted_cats)))
+    sample_ranges = [(first_sample, min(first_sample + block_size, num_sample))
+                     for first_sample in range(0, num_sample, block_size)]
+    count_func = partial(count_block, key_samples=keys // num_pattern,
+                         key_patterns=keys % num_pattern,
+                         key_tail_cnts=key_tail_cnts, cat_ptrs=cat_ptrs,
+                         cat_ids=cat_ids, counted_cats=counted_cats,
+                         cat_cols=cat_cols)
+
+    if num_proc == 1:
+        block_results = list(map(count_func, sample_ranges))
+    else:
+        with mp.Pool(num_proc) as pool:
+            block_results = pool.map(count_func, sample_ranges)
+
+    return tuple(np.concatenate(arrs) for arrs in zip(*block_results))
+
+
+def categorize_variants(variant_df: pd.DataFrame, category_dict: dict,
+                        gene_list_table: GeneListTable, annot_keys: list,
+                        num_proc: int = 1, is_rdd_cat: np.ndarray = None) \
+        -> CatResult:
+    """ Categorize the variants into CWAS categories and return the sparse
+    matrix of No. variants of each sample (sorted by the IDs) and
+    non-redundant category with at least one variant
+
+    :param variant_df: The DataFrame from 'parse_vep_vcf'
+    :param category_dict: The dictionary from parsing the category
+                          configuration file
+    :param gene_list_table: The table of the gene matrix file
+    :param annot_keys: The annotation keys from 'parse_vep_vcf'
+    :param num_proc: No. processes counting blocks of samples
+    :param is_rdd_cat: The array from 'load_rdd_cat_mask'
+                       (Default: No redundant categories)
+    """
+    sample_ind, sample_ids = pd.factorize(variant_df['SAMPLE'], sort=True)
+    term_mats = get_term_mats(variant_df, category_dict, gene_list_table,
+                              annot_keys)
+    cnt_samples, cnt_cats, cnts = count_categories(
+        sample_ind, len(sample_ids), term_mats, num_proc, is_rdd_cat)
+
+    cat_ids, col_ind = np.unique(cnt_cats, return_inverse=True)
+    cnt_mat = sparse.csr_matrix((cnts, (cnt_samples, col_ind.ravel())),
+                                shape=(len(sample_ids), len(cat_ids)))
+    cat_names = np.array(get_category_names(category_dict))[cat_ids]
+
+    return CatResult(cnt_mat, sample_ids, cat_names)
@@ -1,6 +1,8 @@
 """
 Common algorithms for CWAS
 """
+import os
+
 import numpy as np
 
 
@@ -55,14 +57,32 @@ def div_list(in_list: list, num_sub_list: int) -> list:
     return sub_lists
 
 
-def swap_label(labels: np.ndarray, group_ids: np.ndarray) -> np.ndarray:
+def make_rng(seed: int = None, *task_ids: int) -> np.random.Generator:
+    """ Make a random number generator for a task (e.g. a simulation or
+    a permutation) identified by the task IDs.
+
+    Each generator has an independent stream spawned from the seed and the
+    task IDs, so the result of a task does not depend on which process runs it
+    or how many processes are used. If the seed is None, fresh entropy from
+    the OS is used.
+    """
+    seed_seq = np.random.SeedSequence(seed, spawn_key=task_ids)
+    return np.random.default_rng(seed_seq)
+
+
+def swap_label(labels: np.ndarray, group_ids: np.ndarray,
+               rng: np.random.Generator = None) -> np.ndarray:
     """ Randomly swap labels (case or control) in each group
     and return a list of swapped labels.
 
     :param labels: Array of labels
     :param group_ids: Array of group IDs corresponding to each label
+    :param rng: Random number generator (Default: a new generator)
     :return: Swapped labels
     """
+    if rng is None:
+        rng = make_rng()
+
     # Key: a group ID, Value: No. times the key is referred
     group_to_hit_cnt = {group_id: 0 for group_id in group_ids}
     # Key: A group, Value: The index of a label firstly matched with the group
@@ -71,7 +91,7 @@ def swap_label(labels: np.ndarray, group_ids: np.ndarray) -> np.ndarray:
 
     # Make an array for random swapping
     num_group = len(group_to_hit_cnt.keys())
-    do_swaps = np.random.binomial(1, 0.5, size=num_group)
+    do_swaps = rng.binomial(1, 0.5, size=num_group)
     group_idx = 0
 
     for i, label in enumerate(labels):
@@ -80,7 +100,7 @@ def swap_label(labels: np.ndarray, group_ids: np.ndarray) -> np.ndarray:
         assert group_hit_cnt == 0 or group_hit_cnt == 1, \
             f'Too many labels (more than 2) in a group "{group_id}".'
 
-        if group_to_hit_cnt == 0:
+        if group_hit_cnt == 0:
             group_to_hit_cnt[group_id] = 1
             group_to_idx[group_id] = i
         else:
@@ -96,3 +116,33 @@ def swap_label(labels: np.ndarray, group_ids: np.ndarray) -> np.ndarray:
             group_idx += 1
 
     return swap_labels
+
+
+def load_npz_cache(cache_path: str, digest: str) -> dict:
+    """ Return a dictionary of the arrays in the .npz cache file from
+    'save_npz_cache' if the file exists and has the same digest of its
+    source, otherwise None
+    """
+    if not os.path.isfile(cache_path):
+        return None
+
+    with np.load(cache_path) as cache:
+        if str(cache['digest']) != digest:
+            return None
+
+        return {key: cache[key] for key in cache.files if key != 'digest'}
+
+
+def save_npz_cache(cache_path: str, digest: str, **arrs: np.ndarray):
+    """ Save the arrays and the digest of their source into the .npz cache
+    file. The file is replaced at once, and failures are ignored because
+    the cache is optional (e.g. a read-only directory).
+    """
+    tmp_cache_path = f'{cache_path}.{os.getpid()}.tmp'
+
+    try:
+        with open(tmp_cache_path, 'wb') as cache_file:
+            np.savez(cache_file, digest=np.array(digest), **arrs)
+        os.replace(tmp_cache_path, cache_path)
+    except OSError:
+        pass
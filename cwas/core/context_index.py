@@ -0,0 +1,165 @@
+"""
+Index of the positions of each trinucleotide context in a masked genome
+
+Trinucleotide contexts are collapsed by strand so that the middle base is
+a pyrimidine (C or T), which makes 32 contexts (e.g. 'ACG' also stands for
+'CGT' on the reverse strand). The 0-based positions of the middle bases of
+each context of each chromosome are stored as uint32 arrays in .npy files
+({chrom}.{context}.npy). Simulations memory-map these files and draw
+positions of a specific context directly.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from cwas.core.simulation import BASES, conv_bases_to_codes
+from cwas.fastafile import FastaFile
+
+# Context index = (5' base code) * 8 + (0 if C else 1) * 4 + (3' base code)
+CONTEXTS = [f'{left}{mid}{right}'
+            for left in BASES for mid in 'CT' for right in BASES]
+_NUM_CONTEXT = len(CONTEXTS)
+_CHUNK_SIZE = 1 << 24  # No. bases read at once
+
+
+def get_context_index_path(index_dir: str, chrom: str, context: str) -> str:
+    return os.path.join(index_dir, f'{chrom}.{context}.npy')
+
+
+def has_context_index(index_dir: str, chroms: list) -> bool:
+    """ Return True if the index files of all the chromosomes exist """
+    return all(
+        os.path.isfile(get_context_index_path(index_dir, chrom, context))
+        for chrom in chroms for context in CONTEXTS
+    )
+
+
+def get_context_codes(base_codes: np.ndarray) -> np.ndarray:
+    """ Return an array of the context indices of the middle bases of
+    the input base codes (from 'cwas.core.simulation.conv_bases_to_codes').
+    The result is shorter than the input by 2 and the contexts which contain
+    other characters than A, C, G and T get the index 32.
+    """
+    left = base_codes[:-2].astype(np.int64)
+    mid = base_codes[1:-1].astype(np.int64)
+    right = base_codes[2:].astype(np.int64)
+    is_valid = (left < 4) & (mid < 4) & (right < 4)
+
+    # Take the reverse complement if the middle base is a purine (A or G).
+    # The complement of a base code is (3 - code).
+    is_purine = (mid == 0) | (mid == 2)
+    left, mid, right = np.where(is_purine, 3 - right, left), \
+        np.where(is_purine, 3 - mid, mid), np.where(is_purine, 3 - left, right)
+
+    context_codes = left * 8 + (mid == 3) * 4 + right
+    context_codes[~is_valid] = _NUM_CONTEXT
+
+    return context_codes
+
+
+def make_context_index(fa_path: str, chrom: str, index_dir: str):
+    """ Make the index files listing the positions of each trinucleotide
+    context of the chromosome in the input FASTA file.
+    Lowercase bases are regarded as uppercase bases and contexts containing
+    other characters (e.g. 'N') are not indexed.
+    """
+    os.makedirs(index_dir, exist_ok=True)
+
+    with FastaFile(fa_path, use_mmap=not fa_path.endswith('.gz')) \
+            as fasta_file:
+        chrom_size = fasta_file.get_size(chrom)
+        chunk_starts = range(0, chrom_size, _CHUNK_SIZE)
+
+        def iter_chunks():
+            """ Yield context indices of each chunk. The flanking bases of
+            each chunk are read together and the chromosome ends are
+            regarded as 'N'.
+            """
+            for chunk_start in chunk_starts:
+                chunk_end = min(chunk_start + _CHUNK_SIZE, chrom_size)
+                read_start = max(chunk_start - 1, 0)
+                read_end = min(chunk_end + 1, chrom_size)
+                seq = fasta_file.get_seq(chrom, read_start, read_end)
+                seq = 'N' * (read_start - chunk_start + 1) + seq + \
+                    'N' * (chunk_end - read_end + 1)
+                yield chunk_start, get_context_codes(conv_bases_to_codes(seq))
+
+        # 1st pass: Count each context to allocate the index files
+        context_cnts = np.zeros(_NUM_CONTEXT + 1, dtype=np.int64)
+        for _, chunk in iter_chunks():
+            context_cnts += np.bincount(chunk, minlength=_NUM_CONTEXT + 1)
+
+        index_files = [
+            np.lib.format.open_memmap(
+                get_context_index_path(index_dir, chrom, context), mode='w+',
+                dtype=np.uint32, shape=(int(context_cnts[i]),)
+            ) for i, context in enumerate(CONTEXTS)
+        ]
+
+        # 2nd pass: Write the positions of each context
+        offsets = [0] * _NUM_CONTEXT
+        for chunk_start, chunk in iter_chunks():
+            order = np.argsort(chunk, kind='stable')
+            split_points = np.cumsum(
+                np.bincount(chunk, minlength=_NUM_CONTEXT + 1))[:-1]
+            context_pos_arrs = np.split(order + chunk_start, split_points)
+
+            for i in range(_NUM_CONTEXT):
+                positions = context_pos_arrs[i]
+                index_files[i][offsets[i]:offsets[i] + len(positions)] = \
+                    positions
+                offsets[i] += len(positions)
+
+        for index_file in index_files:
+            index_file.flush()
+
+
+def load_context_index(index_dir: str, chroms: list) -> dict:
+    """ Memory-map the index files and return a dictionary which key and value
+    are a chromosome ID and a list of position arrays of the 'CONTEXTS'.
+    """
+    return {
+        chrom: [np.load(get_context_index_path(index_dir, chrom, context),
+                        mmap_mode='r') for context in CONTEXTS]
+        for chrom in chroms
+    }
+
+
+def load_context_mut_rates(rate_path: str) -> np.ndarray:
+    """ Load a tab-separated file listing mutation rates of each trinucleotide
+    context and return an array of the rates which shape is (32, 4).
+    Each row and column correspond to the 'CONTEXTS' and the base code of
+    the alternative middle base, respectively.
+
+    The file must have 'CONTEXT', 'ALT' and 'RATE' columns. Contexts which
+    middle base is a purine are converted into their reverse complements and
+    unlisted mutations get zero.
+    """
+    rate_df = pd.read_table(rate_path, dtype={'CONTEXT': str, 'ALT': str})
+    mut_rates = np.zeros((_NUM_CONTEXT, len(BASES)))
+    is_listed = np.zeros(mut_rates.shape, dtype=bool)
+
+    for context, alt, rate in rate_df[['CONTEXT', 'ALT', 'RATE']].values:
+        base_codes = conv_bases_to_codes(context.upper() + alt.upper())
+
+        if len(context) != 3 or len(alt) != 1 or (base_codes > 3).any() or \
+                base_codes[1] == base_codes[3]:
+            raise ValueError(f'Invalid mutation "{context}>{alt}" '
+                             f'in "{rate_path}"')
+        if rate < 0:
+            raise ValueError(f'Negative mutation rate of "{context}>{alt}" '
+                             f'in "{rate_path}"')
+
+        context_idx = get_context_codes(base_codes[:3])[0]
+        alt_code = base_codes[3] if base_codes[1] in (1, 3) \
+            else 3 - base_codes[3]
+
+        if is_listed[context_idx, alt_code]:
+            raise ValueError(f'Duplicated mutation "{context}>{alt}" '
+                             f'in "{rate_path}"')
+
+        is_listed[context_idx, alt_code] = True
+        mut_rates[context_idx, alt_code] = rate
+
+    return mut_rates
@@ -0,0 +1,107 @@
+"""
+Table of the gene lists (gene sets) where each gene is involved
+
+The gene matrix file (a 'gene' column of gene symbols and a column of 0 or 1
+for each gene list) is compiled into the sorted array of the gene symbols and
+an uint64 bitmask of each gene, whose i-th bit is set if the gene is in
+the i-th gene list. The compiled table is cached next to the gene matrix file
+({name}.bitmask.npz) and reused as long as the digest of the file is
+unchanged. The gene lists of all the variants are looked up at once by
+a binary search of their distinct gene symbols.
+"""
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+from cwas.core.common import load_npz_cache, save_npz_cache
+
+_MAX_NUM_LIST = 64  # No. bits of a mask
+
+
+def get_gene_list_cache_path(gene_mat_path: str) -> str:
+    return os.path.splitext(gene_mat_path)[0] + '.bitmask.npz'
+
+
+def parse_gene_mat(gene_mat_path: str) \
+        -> (np.ndarray, np.ndarray, np.ndarray):
+    """ Parse the gene matrix file and return arrays of the sorted gene
+    symbols, their bitmasks and the names of the gene lists
+    (The last row of a duplicated gene symbol is used.)
+    """
+    gene_mat_df = pd.read_table(gene_mat_path, index_col=0, dtype=str,
+                                keep_default_na=False)
+    gene_mat_df = gene_mat_df[~gene_mat_df.index.duplicated(keep='last')]
+    list_names = gene_mat_df.columns.to_numpy(dtype=str)
+
+    if len(list_names) > _MAX_NUM_LIST:
+        raise ValueError(f'Too many gene lists ({len(list_names):,d}) in '
+                         f'the gene matrix. The maximum is {_MAX_NUM_LIST}.')
+
+    # The bits are disjoint, so the sum of them is their bitwise OR.
+    bits = np.left_shift(np.uint64(1),
+                         np.arange(len(list_names), dtype=np.uint64))
+    masks = ((gene_mat_df.to_numpy() == '1') * bits).sum(axis=1,
+                                                        dtype=np.uint64)
+    symbols = gene_mat_df.index.to_numpy(dtype=str)
+    order = np.argsort(symbols, kind='stable')
+
+    return symbols[order], masks[order], list_names
+
+
+class GeneListTable:
+    def __init__(self, symbols: np.ndarray, masks: np.ndarray,
+                 list_names: np.ndarray):
+        """
+        :param symbols: Sorted gene symbols
+        :param masks: Bitmask of the gene lists of each gene
+        :param list_names: Names of the gene lists in the order of the bits
+        """
+        self.symbols = np.asarray(symbols, dtype=str)
+        self.masks = np.asarray(masks, dtype=np.uint64)
+        self.list_names = np.asarray(list_names, dtype=str)
+
+    @classmethod
+    def load(cls, gene_mat_path: str):
+        """ Load the table of the gene matrix file from its cache, or
+        compile and cache it if the cache is missing or out of date
+        """
+        with open(gene_mat_path, 'rb') as gene_mat_file:
+            digest = hashlib.sha1(gene_mat_file.read()).hexdigest()
+
+        cache_path = get_gene_list_cache_path(gene_mat_path)
+        cache = load_npz_cache(cache_path, digest)
+
+        if cache is not None:
+            return cls(cache['symbols'], cache['masks'], cache['list_names'])
+
+        symbols, masks, list_names = parse_gene_mat(gene_mat_path)
+        save_npz_cache(cache_path, digest, symbols=symbols, masks=masks,
+                       list_names=list_names)
+        return cls(symbols, masks, list_names)
+
+    def get_list_mask(self, list_name: str) -> np.uint64:
+        """ Return the bitmask of the gene list (0 if not in the table) """
+        bit_ind = np.flatnonzero(self.list_names == list_name)
+
+        if len(bit_ind) == 0:
+            return np.uint64(0)
+
+        return np.left_shift(np.uint64(1), np.uint64(bit_ind[0]))
+
+    def get_masks(self, symbols) -> np.ndarray:
+        """ Return an uint64 array of the bitmask of each gene symbol
+        (0 if not in the table)
+        """
+        codes, uniq_symbols = pd.factorize(pd.Series(symbols), sort=False)
+        uniq_symbols = np.asarray(uniq_symbols, dtype=str)
+        uniq_masks = np.zeros(len(uniq_symbols) + 1, dtype=np.uint64)
+
+        if len(self.symbols) > 0:
+            ind = np.searchsorted(self.symbols, uniq_symbols)
+            ind[ind == len(self.symbols)] = 0
+            is_found = self.symbols[ind] == uniq_symbols
+            uniq_masks[:-1][is_found] = self.masks[ind[is_found]]
+
+        return uniq_masks[codes]  # Code -1 (missing values) -> No gene lists
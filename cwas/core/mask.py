@@ -0,0 +1,120 @@
+"""
+Streaming masking of genome sequences
+
+The input FASTA file (plain, gzip or bgzip) is read in chunks of lines and
+the bases in the regions of a BED file are replaced with 'N'. The masked
+sequences keep the line layout of the input and the .fai index of the output
+is written at the same time, so the genome is read only once and the input
+file is left intact.
+"""
+import gzip
+
+import numpy as np
+import pandas as pd
+
+_CHUNK_SIZE = 1 << 24  # Approximate No. bytes read at once
+_NEWLINE = ord('\n')
+
+
+def read_mask_regions(bed_path: str) -> dict:
+    """ Read the BED file and return a dictionary which key and value are
+    a chromosome ID and an array of its regions (start, end; 0-based)
+    """
+    bed_df = pd.read_table(bed_path, header=None, usecols=[0, 1, 2],
+                           names=['chrom', 'start', 'end'],
+                           dtype={'chrom': str}, comment='#')
+    return {
+        chrom: chrom_bed_df[['start', 'end']].values.astype(np.int64)
+        for chrom, chrom_bed_df in bed_df.groupby('chrom', sort=False)
+    }
+
+
+def mask_seq_lines(seq_lines: np.ndarray, seq_start: int,
+                   regions: np.ndarray) -> int:
+    """ Replace the bases in the regions with 'N' in place and return
+    the number of bases in the input
+
+    :param seq_lines: ASCII codes of sequence lines including newlines
+    :param seq_start: The position (0-based) of the first base in the input
+    :param regions: Array of regions (start, end; 0-based)
+    """
+    base_ind = np.flatnonzero(seq_lines != _NEWLINE)
+    num_base = len(base_ind)
+
+    if regions is not None and num_base > 0:
+        starts = np.clip(regions[:, 0] - seq_start, 0, num_base)
+        ends = np.clip(regions[:, 1] - seq_start, 0, num_base)
+        is_overlap = starts < ends
+
+        # Count regions covering each base by the cumulative sum of
+        # +1 at the starts and -1 at the ends
+        cover_diffs = np.zeros(num_base + 1, dtype=np.int32)
+        np.add.at(cover_diffs, starts[is_overlap], 1)
+        np.add.at(cover_diffs, ends[is_overlap], -1)
+        is_masked = np.cumsum(cover_diffs[:-1]) > 0
+        seq_lines[base_ind[is_masked]] = ord('N')
+
+    return num_base
+
+
+def write_masked_fasta(in_fa_path: str, out_fa_path: str,
+                       mask_regions: dict):
+    """ Mask the regions of the input FASTA file, write the result to the
+    output FASTA file and write its index ('{out_fa_path}.fai')
+
+    :param in_fa_path: Path of the input FASTA file (.fa or .fa.gz)
+    :param out_fa_path: Path of the output FASTA file (uncompressed)
+    :param mask_regions: Dictionary from 'read_mask_regions'
+    """
+    open_func = gzip.open if in_fa_path.endswith('.gz') else open
+    fai_entries = []  # [Chrom ID, size, offset, No. bases/line, line length]
+    regions = None
+    out_offset = 0
+
+    with open_func(in_fa_path, 'rb') as infile, \
+            open(out_fa_path, 'wb') as outfile:
+
+        def write_seq_lines(seq_data: bytes):
+            nonlocal out_offset
+            if not seq_data or not fai_entries:
+                return
+
+            fai_entry = fai_entries[-1]
+            seq_lines = np.frombuffer(seq_data, dtype=np.uint8).copy()
+            num_base = mask_seq_lines(seq_lines, fai_entry[1], regions)
+
+            if fai_entry[4] == 0:  # The first sequence line of the record
+                fai_entry[4] = seq_data.find(b'\n') + 1 or len(seq_data)
+                fai_entry[3] = len(seq_data[:fai_entry[4]].rstrip(b'\n'))
+
+            fai_entry[1] += num_base
+            outfile.write(seq_lines.tobytes())
+            out_offset += len(seq_lines)
+
+        for lines in iter(lambda: infile.readlines(_CHUNK_SIZE), []):
+            data = b''.join(lines)
+
+            # Most chunks have no header line.
+            if not data.startswith(b'>') and b'\n>' not in data:
+                write_seq_lines(data)
+                continue
+
+            seq_lines = []
+
+            for line in lines:
+                if line.startswith(b'>'):
+                    write_seq_lines(b''.join(seq_lines))
+                    seq_lines = []
+                    chrom = line[1:].split()[0].decode()
+                    regions = mask_regions.get(chrom)
+                    outfile.write(line)
+                    out_offset += len(line)
+                    fai_entries.append([chrom, 0, out_offset, 0, 0])
+                else:
+                    seq_lines.append(line)
+
+            write_seq_lines(b''.join(seq_lines))
+
+    with open(out_fa_path + '.fai', 'w') as fai_file:
+        for fai_entry in fai_entries:
+            print(*fai_entry, sep='\t', file=fai_file)
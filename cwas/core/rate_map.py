@@ -0,0 +1,134 @@
+"""
+Regional mutation-rate maps for CWAS simulations
+
+A rate map lists genomic windows (e.g. 1 kb) with their mutation rates per
+base in a BED file (chrom, start, end, rate). The windows are drawn by
+Walker's alias method, which takes O(1) per draw, and the alias table is
+cached in a .npz file next to the BED file so that it is built only once.
+"""
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+from cwas.core.common import load_npz_cache, save_npz_cache
+
+_CACHE_SUFFIX = '.alias.npz'
+
+
+def make_alias_table(weights: np.ndarray) -> (np.ndarray, np.ndarray):
+    """ Make an alias table (Vose's algorithm) for the input weights
+    and return acceptance probabilities and alias indices of each item.
+    """
+    num_item = len(weights)
+    scaled_probs = np.asarray(weights, dtype=np.float64)
+    scaled_probs = scaled_probs * (num_item / scaled_probs.sum())
+    accept_probs = np.ones(num_item, dtype=np.float64)
+    alias_ind = np.arange(num_item, dtype=np.int64)
+
+    small = np.flatnonzero(scaled_probs < 1.0).tolist()
+    large = np.flatnonzero(scaled_probs >= 1.0).tolist()
+    remains = scaled_probs.tolist()
+
+    while small and large:
+        small_idx = small.pop()
+        large_idx = large[-1]
+        accept_probs[small_idx] = remains[small_idx]
+        alias_ind[small_idx] = large_idx
+        remains[large_idx] -= 1.0 - remains[small_idx]
+
+        if remains[large_idx] < 1.0:
+            small.append(large.pop())
+
+    # Items left by floating-point errors are always accepted.
+    return accept_probs, alias_ind
+
+
+def draw_from_alias_table(accept_probs: np.ndarray, alias_ind: np.ndarray,
+                          size: int, rng: np.random.Generator) -> np.ndarray:
+    """ Draw indices of items from the alias table """
+    item_ind = rng.integers(0, len(accept_probs), size=size)
+    is_accepted = rng.uniform(0, 1, size=size) < accept_probs[item_ind]
+    return np.where(is_accepted, item_ind, alias_ind[item_ind])
+
+
+class WindowRateMap:
+    """ Genomic windows with mutation rates and their alias table """
+
+    def __init__(self, chrom_ind: np.ndarray, starts: np.ndarray,
+                 ends: np.ndarray, accept_probs: np.ndarray,
+                 alias_ind: np.ndarray):
+        self.chrom_ind = chrom_ind
+        self.starts = starts
+        self.ends = ends
+        self.accept_probs = accept_probs
+        self.alias_ind = alias_ind
+
+    def draw_sites(self, size: int, rng: np.random.Generator) \
+            -> (np.ndarray, np.ndarray):
+        """ Draw random sites. A window is drawn with a probability
+        proportional to (rate) * (window size) and a position is drawn
+        uniformly in the window.
+
+        :returns:
+            1. Indices of chromosomes
+            2. Positions (0-based)
+        """
+        window_ind = draw_from_alias_table(self.accept_probs, self.alias_ind,
+                                           size, rng)
+        positions = rng.integers(self.starts[window_ind],
+                                 self.ends[window_ind])
+        return self.chrom_ind[window_ind].astype(np.int64), positions
+
+
+def get_rate_map_cache_path(bed_path: str) -> str:
+    return bed_path + _CACHE_SUFFIX
+
+
+def load_window_rate_map(bed_path: str, chroms: np.ndarray) -> WindowRateMap:
+    """ Load the rate map in the BED file and return a WindowRateMap.
+    Windows on chromosomes not in the 'chroms' and windows with zero rates
+    are discarded. The alias table is cached next to the BED file and is
+    rebuilt if the content of the BED file or the chromosomes are changed.
+    """
+    chroms = np.asarray(chroms, dtype=str)
+    bed_hash = hashlib.sha1()
+
+    with open(bed_path, 'rb') as bed_file:
+        for block in iter(lambda: bed_file.read(1 << 20), b''):
+            bed_hash.update(block)
+
+    # The chromosome indices depend on the order of the chromosomes.
+    bed_hash.update('\t'.join(chroms).encode())
+    digest = bed_hash.hexdigest()
+    cache_path = get_rate_map_cache_path(bed_path)
+    cache = load_npz_cache(cache_path, digest)
+
+    if cache is not None:
+        return WindowRateMap(cache['chrom_ind'], cache['starts'],
+                             cache['ends'], cache['accept_probs'],
+                             cache['alias_ind'])
+
+    bed_df = pd.read_table(bed_path, header=None, comment='#',
+                           usecols=[0, 1, 2, 3],
+                           names=['chrom', 'start', 'end', 'rate'],
+                           dtype={'chrom': str})
+    chrom_to_idx = {chrom: i for i, chrom in enumerate(chroms)}
+    chrom_ind = bed_df['chrom'].map(chrom_to_idx)
+    bed_df = bed_df[chrom_ind.notna() & (bed_df['rate'] > 0)
+                    & (bed_df['end'] > bed_df['start'])]
+
+    if len(bed_df.index) == 0:
+        raise ValueError(f'"{bed_path}" has no window with a positive rate '
+                         f'on the chromosomes.')
+
+    chrom_ind = chrom_ind[bed_df.index].values.astype(np.uint8)
+    starts = bed_df['start'].values.astype(np.uint32)
+    ends = bed_df['end'].values.astype(np.uint32)
+    weights = bed_df['rate'].values * (bed_df['end'] - bed_df['start']).values
+    accept_probs, alias_ind = make_alias_table(weights)
+
+    save_npz_cache(cache_path, digest, chrom_ind=chrom_ind, starts=starts,
+                   ends=ends, accept_probs=accept_probs, alias_ind=alias_ind)
+
+    return WindowRateMap(chrom_ind, starts, ends, accept_probs, alias_ind)
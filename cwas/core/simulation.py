@@ -0,0 +1,525 @@
+"""
+Algorithms to generate random mutations for CWAS simulations
+
+Random mutations are generated in batches. All chromosomes, positions,
+mutation types and samples for a whole simulation are drawn as NumPy arrays
+and the result is a columnar variant table with integer codes.
+"""
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+from cwas.core.common import make_rng
+from cwas.core.rate_map import WindowRateMap
+from cwas.fastafile import FastaFile
+from cwas.vcf_writer import VcfWriter
+
+# Integer codes of bases. Every other character (e.g. 'N') gets _N_CODE.
+BASES = np.array(['A', 'C', 'G', 'T'])
+_N_CODE = 4
+_BASE_TO_CODE = np.full(256, _N_CODE, dtype=np.uint8)
+for _code, _base in enumerate(BASES):
+    _BASE_TO_CODE[ord(_base)] = _code
+    _BASE_TO_CODE[ord(_base.lower())] = _code
+
+# The mutation distribution model (Lynch 2010)
+# Each item is (REF, ALT, cumulative probability).
+_MUT_SPECTRUM = [
+    ('C', 'T', 0.211062887),
+    ('G', 'A', 0.422125774),
+    ('A', 'G', 0.551200326),
+    ('T', 'C', 0.680274877),
+    ('G', 'T', 0.728393387),
+    ('C', 'A', 0.776511898),
+    ('G', 'C', 0.821985623),
+    ('C', 'G', 0.867459349),
+    ('T', 'A', 0.900590744),
+    ('A', 'T', 0.933722139),
+    ('A', 'C', 0.96686107),
+    ('T', 'G', 1.0),
+]
+MUT_REF_CODES = np.array(
+    [np.where(BASES == ref)[0][0] for ref, _, _ in _MUT_SPECTRUM],
+    dtype=np.uint8,
+)
+MUT_ALT_CODES = np.array(
+    [np.where(BASES == alt)[0][0] for _, alt, _ in _MUT_SPECTRUM],
+    dtype=np.uint8,
+)
+_MUT_CUM_PROBS = np.array([cum_prob for _, _, cum_prob in _MUT_SPECTRUM])
+
+# Column names of a table listing random mutations
+RAND_MUT_COLS = ['SIM', 'CHROM', 'POS', 'REF', 'ALT', 'LABEL', 'SAMPLE']
+
+# Column names of a manifest listing completed simulations
+SIM_MANIFEST_COLS = ['SIM', 'SEED', 'FILE', 'MD5']
+
+# Initial guess of the acceptance rate of randomly drawn sites
+_INIT_ACCEPT_RATE = 0.2
+
+
+def pick_mutations(num_mut: int, rng: np.random.Generator) -> np.ndarray:
+    """ Draw mutation types from the mutation distribution model (Lynch 2010)
+    and return indices of the spectrum (Use MUT_REF_CODES and MUT_ALT_CODES
+    to get their bases).
+    """
+    rand_vals = rng.uniform(0, 1, size=num_mut)
+    return np.searchsorted(_MUT_CUM_PROBS, rand_vals, side='left')
+
+
+def conv_bases_to_codes(bases) -> np.ndarray:
+    """ Convert bases (str or bytes) into an array of integer base codes """
+    if isinstance(bases, str):
+        bases = bases.encode()
+
+    return _BASE_TO_CODE[np.frombuffer(bases, dtype=np.uint8)]
+
+
+def get_base_codes(fasta_file: FastaFile, chrom: str,
+                   positions: np.ndarray) -> np.ndarray:
+    """ Return an array of base codes at the input positions (0-based) """
+    return _BASE_TO_CODE[fasta_file.get_bases(chrom, positions)]
+
+
+def draw_snv_sites(num_snv: int, fasta_file_dict: dict, chroms: np.ndarray,
+                   chrom_probs: np.ndarray, chrom_sizes: np.ndarray,
+                   rng: np.random.Generator, rate_map: WindowRateMap = None) \
+        -> (np.ndarray, np.ndarray, np.ndarray):
+    """ Draw random single nucleotide substitutions in bulk.
+
+    Candidate sites are drawn for all the substitutions at once
+    and rejected in bulk if their reference bases are not matched with
+    the reference bases of drawn mutation types.
+
+    :param num_snv: The number of substitutions
+    :param fasta_file_dict: Dictionary which key and value are
+                            a chromosome ID and its FastaFile, respectively
+    :param chroms: Array of chromosome IDs
+    :param chrom_probs: Probabilities to choose each chromosome
+    :param chrom_sizes: Sizes of each chromosome
+    :param rng: Random number generator
+    :param rate_map: Regional mutation-rate map. If it is given, candidate
+                     sites are drawn from its windows instead of drawing
+                     chromosomes by the 'chrom_probs'.
+    :returns:
+        1. Indices of chromosomes in the 'chroms'
+        2. Positions (0-based)
+        3. Indices of mutation types in the mutation distribution model
+    """
+    chrom_ind_list = []
+    pos_list = []
+    mut_ind_list = []
+    num_remain = num_snv
+    accept_rate = _INIT_ACCEPT_RATE
+
+    while num_remain > 0:
+        num_draw = int(num_remain / accept_rate) + 1
+        if rate_map is None:
+            chrom_ind = rng.choice(len(chrom_probs), size=num_draw,
+                                   p=chrom_probs)
+            positions = rng.integers(0, chrom_sizes[chrom_ind])
+        else:
+            chrom_ind, positions = rate_map.draw_sites(num_draw, rng)
+        mut_ind = pick_mutations(num_draw, rng)
+        base_codes = np.empty(num_draw, dtype=np.uint8)
+
+        for chrom_idx in np.unique(chrom_ind):
+            is_chrom = chrom_ind == chrom_idx
+            chrom = chroms[chrom_idx]
+            base_codes[is_chrom] = get_base_codes(fasta_file_dict[chrom], chrom,
+                                                  positions[is_chrom])
+
+        is_accepted = base_codes == MUT_REF_CODES[mut_ind]
+        num_accept = int(np.sum(is_accepted))
+        accept_rate = max(num_accept / num_draw, 0.01)
+        accept_ind = np.flatnonzero(is_accepted)[:num_remain]
+
+        chrom_ind_list.append(chrom_ind[accept_ind])
+        pos_list.append(positions[accept_ind])
+        mut_ind_list.append(mut_ind[accept_ind])
+        num_remain -= len(accept_ind)
+
+    return np.concatenate(chrom_ind_list), np.concatenate(pos_list), \
+        np.concatenate(mut_ind_list)
+
+
+def take_in_order(arr: np.ndarray, ind: np.ndarray) -> np.ndarray:
+    """ Return arr[ind] reading the (memory-mapped) array in ascending order
+    of the indices for locality. The values stay in the order of 'ind'.
+    """
+    order = np.argsort(ind)
+    values = np.empty(len(ind), dtype=arr.dtype)
+    values[order] = arr[ind[order]]
+    return values
+
+
+def draw_snv_sites_from_index(num_snv: int, base_index_dict: dict,
+                              chroms: np.ndarray, chrom_probs: np.ndarray,
+                              chrom_sizes: np.ndarray,
+                              rng: np.random.Generator) \
+        -> (np.ndarray, np.ndarray, np.ndarray):
+    """ Draw random single nucleotide substitutions without rejection
+    using the index of the positions of each reference base
+    (cwas.core.base_index).
+
+    The joint probability of a chromosome and a mutation type is the same
+    as that of the accepted sites of 'draw_snv_sites', which is proportional
+    to (chromosome probability) * (mutation type probability)
+    * (No. reference bases in the chromosome) / (chromosome size).
+    The position is drawn uniformly from the positions of the reference base.
+
+    :param num_snv: The number of substitutions
+    :param base_index_dict: Dictionary from
+                            'cwas.core.base_index.load_base_index'
+    :param chroms: Array of chromosome IDs
+    :param chrom_probs: Probabilities to choose each chromosome
+    :param chrom_sizes: Sizes of each chromosome
+    :param rng: Random number generator
+    :returns: The same as 'draw_snv_sites'
+    """
+    num_mut_type = len(MUT_REF_CODES)
+    mut_probs = np.diff(_MUT_CUM_PROBS, prepend=0)
+    base_cnts = np.array([[len(pos_arr) for pos_arr in base_index_dict[chrom]]
+                          for chrom in chroms])
+
+    # Joint probabilities of (chromosome, mutation type)
+    joint_probs = \
+        (np.asarray(chrom_probs) / np.asarray(chrom_sizes))[:, np.newaxis] \
+        * mut_probs[np.newaxis, :] * base_cnts[:, MUT_REF_CODES]
+    joint_cum_probs = np.cumsum(joint_probs.ravel())
+    joint_cum_probs /= joint_cum_probs[-1]
+
+    joint_ind = np.searchsorted(joint_cum_probs,
+                                rng.uniform(0, 1, size=num_snv),
+                                side='right')
+    chrom_ind, mut_ind = np.divmod(joint_ind, num_mut_type)
+    ref_codes = MUT_REF_CODES[mut_ind]
+    positions = np.empty(num_snv, dtype=np.int64)
+
+    for chrom_idx, ref_code in set(zip(chrom_ind.tolist(), ref_codes.tolist())):
+        is_target = (chrom_ind == chrom_idx) & (ref_codes == ref_code)
+        pos_arr = base_index_dict[chroms[chrom_idx]][ref_code]
+        pos_ind = rng.integers(0, len(pos_arr), size=int(is_target.sum()))
+        positions[is_target] = take_in_order(pos_arr, pos_ind)
+
+    return chrom_ind, positions, mut_ind
+
+
+def draw_snv_sites_from_context_index(num_snv: int, context_index_dict: dict,
+                                      context_mut_rates: np.ndarray,
+                                      fasta_file_dict: dict,
+                                      chroms: np.ndarray,
+                                      chrom_probs: np.ndarray,
+                                      chrom_sizes: np.ndarray,
+                                      rng: np.random.Generator) \
+        -> (np.ndarray, np.ndarray, np.ndarray, np.ndarray):
+    """ Draw random single nucleotide substitutions from a trinucleotide
+    context mutation model using the index of the positions of each context
+    (cwas.core.context_index).
+
+    The joint probability of a chromosome, a context and an alternative base
+    is proportional to (chromosome probability) * (mutation rate)
+    * (No. the context in the chromosome) / (chromosome size).
+    The position is drawn uniformly from the positions of the context.
+
+    :param num_snv: The number of substitutions
+    :param context_index_dict: Dictionary from
+                               'cwas.core.context_index.load_context_index'
+    :param context_mut_rates: Array of mutation rates from
+                              'cwas.core.context_index.load_context_mut_rates'
+    :param fasta_file_dict: Dictionary which key and value are
+                            a chromosome ID and its FastaFile, respectively.
+                            It is used to get the strands of the contexts.
+    :param chroms: Array of chromosome IDs
+    :param chrom_probs: Probabilities to choose each chromosome
+    :param chrom_sizes: Sizes of each chromosome
+    :param rng: Random number generator
+    :returns:
+        1. Indices of chromosomes in the 'chroms'
+        2. Positions (0-based)
+        3. Base codes of reference bases
+        4. Base codes of alternative bases
+    """
+    num_context, num_alt = context_mut_rates.shape
+    context_cnts = np.array([[len(pos_arr) for pos_arr in
+                              context_index_dict[chrom]] for chrom in chroms])
+
+    # Joint probabilities of (chromosome, context, alternative base)
+    joint_probs = \
+        (np.asarray(chrom_probs) / np.asarray(chrom_sizes))[:, np.newaxis,
+                                                            np.newaxis] \
+        * context_mut_rates[np.newaxis, :, :] \
+        * context_cnts[:, :, np.newaxis]
+    joint_cum_probs = np.cumsum(joint_probs.ravel())
+    joint_cum_probs /= joint_cum_probs[-1]
+
+    joint_ind = np.searchsorted(joint_cum_probs,
+                                rng.uniform(0, 1, size=num_snv),
+                                side='right')
+    chrom_ind, context_ind, alt_codes = np.unravel_index(
+        joint_ind, (len(chroms), num_context, num_alt))
+    positions = np.empty(num_snv, dtype=np.int64)
+    ref_codes = np.empty(num_snv, dtype=np.uint8)
+
+    for chrom_idx, context_idx in \
+            set(zip(chrom_ind.tolist(), context_ind.tolist())):
+        is_target = (chrom_ind == chrom_idx) & (context_ind == context_idx)
+        pos_arr = context_index_dict[chroms[chrom_idx]][context_idx]
+        pos_ind = rng.integers(0, len(pos_arr), size=int(is_target.sum()))
+        positions[is_target] = take_in_order(pos_arr, pos_ind)
+
+    for chrom_idx in np.unique(chrom_ind):
+        is_chrom = chrom_ind == chrom_idx
+        chrom = chroms[chrom_idx]
+        ref_codes[is_chrom] = get_base_codes(fasta_file_dict[chrom], chrom,
+                                             positions[is_chrom])
+
+    # The middle base of a context is C (1) or T (3). If the reference base
+    # is not the middle base, the context is on the reverse strand
+    # so the alternative base is complemented.
+    mid_codes = np.where((context_ind >> 2) & 1, 3, 1)
+    alt_codes = np.where(ref_codes == mid_codes, alt_codes, 3 - alt_codes)
+
+    return chrom_ind, positions, ref_codes, alt_codes.astype(np.uint8)
+
+
+def make_rand_mut_table(fam_to_label_cnt: dict, fam_to_sample_set: dict,
+                        fasta_file_dict: dict, chroms: np.ndarray,
+                        chrom_probs: np.ndarray, chrom_sizes: np.ndarray,
+                        num_sim: int = 1, base_index_dict: dict = None,
+                        context_index_dict: dict = None,
+                        context_mut_rates: np.ndarray = None,
+                        rate_map: WindowRateMap = None,
+                        rng: np.random.Generator = None) \
+        -> (pd.DataFrame, np.ndarray):
+    """ Generate random mutations of one or more simulations
+    and return a columnar table listing them.
+
+    Each family gets the same number of random mutations for each variant
+    label as the 'fam_to_label_cnt', and each mutation is assigned
+    to one of the family's samples randomly.
+
+    :param fam_to_label_cnt: Dictionary which key and value are a family ID
+                             and an array of variant label counts
+    :param fam_to_sample_set: Dictionary which key and value are a family ID
+                              and a set of sample IDs of the family
+    :param fasta_file_dict: Dictionary which key and value are
+                            a chromosome ID and its FastaFile, respectively
+    :param chroms: Array of chromosome IDs
+    :param chrom_probs: Probabilities to choose each chromosome
+    :param chrom_sizes: Sizes of each chromosome
+    :param num_sim: The number of simulations
+    :param base_index_dict: Dictionary from
+                            'cwas.core.base_index.load_base_index'.
+                            If it is given, positions are drawn from this
+                            index without rejection and the 'fasta_file_dict'
+                            is not used.
+    :param context_index_dict: Dictionary from
+                               'cwas.core.context_index.load_context_index'.
+                               If it is given with the 'context_mut_rates',
+                               substitutions follow the trinucleotide context
+                               mutation model instead of the mutation
+                               distribution model (Lynch 2010).
+    :param context_mut_rates: Array of mutation rates from
+                              'cwas.core.context_index.load_context_mut_rates'
+    :param rate_map: Regional mutation-rate map from
+                     'cwas.core.rate_map.load_window_rate_map'. If it is
+                     given, sites are drawn from its windows by rejection
+                     sampling on the 'fasta_file_dict' and the
+                     'base_index_dict' is not used. It cannot be used with
+                     the trinucleotide context mutation model.
+    :param rng: Random number generator (Default: a new generator)
+    :returns:
+        1. A DataFrame listing random mutations with the 'RAND_MUT_COLS'
+           columns. 'CHROM' and 'SAMPLE' are indices of the 'chroms' and
+           the returned sample IDs, 'POS' is 0-based, 'REF' and 'ALT' are
+           base codes, and 'LABEL' is a variant label (0: SNV, 1-3: INDEL).
+           The rows are sorted by 'SIM', the chromosome ID, and 'POS'.
+        2. Array of sample IDs
+    """
+    if rng is None:
+        rng = make_rng()
+
+    # Make arrays listing a family index and a variant label of each mutation
+    sample_ids = []
+    fam_sample_starts = []
+    fam_sample_cnts = []
+    fam_label_cnts = []
+
+    for fam in fam_to_label_cnt:
+        fam_sample_ids = sorted(fam_to_sample_set[fam])
+        fam_sample_starts.append(len(sample_ids))
+        fam_sample_cnts.append(len(fam_sample_ids))
+        fam_label_cnts.append(fam_to_label_cnt[fam])
+        sample_ids += fam_sample_ids
+
+    fam_label_cnts = np.array(fam_label_cnts, dtype=int).reshape(-1, 4)
+    num_fam, num_label = fam_label_cnts.shape
+    fam_ind = np.repeat(np.repeat(np.arange(num_fam), num_label),
+                        fam_label_cnts.ravel())
+    labels = np.repeat(np.tile(np.arange(num_label), num_fam),
+                       fam_label_cnts.ravel())
+    num_mut = len(labels)
+
+    # Draw all the random mutations of all the simulations at once
+    fam_ind = np.tile(fam_ind, num_sim)
+    labels = np.tile(labels, num_sim)
+    sims = np.repeat(np.arange(num_sim), num_mut)
+    sample_ind = np.array(fam_sample_starts, dtype=int)[fam_ind] + \
+        rng.integers(0, np.array(fam_sample_cnts, dtype=int)[fam_ind])
+
+    if context_index_dict is not None and context_mut_rates is not None:
+        chrom_ind, positions, ref_codes, alt_codes = \
+            draw_snv_sites_from_context_index(
+                len(labels), context_index_dict, context_mut_rates,
+                fasta_file_dict, chroms, chrom_probs, chrom_sizes, rng
+            )
+    else:
+        if base_index_dict is None or rate_map is not None:
+            chrom_ind, positions, mut_ind = \
+                draw_snv_sites(len(labels), fasta_file_dict, chroms,
+                               chrom_probs, chrom_sizes, rng, rate_map)
+        else:
+            chrom_ind, positions, mut_ind = \
+                draw_snv_sites_from_index(len(labels), base_index_dict,
+                                          chroms, chrom_probs, chrom_sizes,
+                                          rng)
+        ref_codes = MUT_REF_CODES[mut_ind]
+        alt_codes = MUT_ALT_CODES[mut_ind]
+
+    rand_mut_df = pd.DataFrame({
+        'SIM': sims,
+        'CHROM': chrom_ind,
+        'POS': positions,
+        'REF': ref_codes,
+        'ALT': alt_codes,
+        'LABEL': labels.astype(np.uint8),
+        'SAMPLE': sample_ind,
+    }, columns=RAND_MUT_COLS)
+
+    # Sort by chromosome IDs as strings and positions
+    chrom_ranks = np.argsort(np.argsort(np.asarray(chroms)))
+    order = np.lexsort((positions, chrom_ranks[chrom_ind], sims))
+    rand_mut_df = rand_mut_df.iloc[order].reset_index(drop=True)
+
+    return rand_mut_df, np.array(sample_ids)
+
+
+def save_rand_mut_table(npz_path: str, rand_mut_df: pd.DataFrame,
+                        chroms: np.ndarray, sample_ids: np.ndarray):
+    """ Save the table from 'make_rand_mut_table' into a compact binary file
+    (.npz). Each random mutation takes 13 bytes, an uint32 simulation index,
+    an uint8 chromosome index, an uint32 position, an uint32 sample index,
+    and an uint8 mutation code which packs 2-bit REF and ALT base codes and
+    a 2-bit variant label (REF | ALT << 2 | LABEL << 4).
+    """
+    mut_codes = rand_mut_df['REF'].values.astype(np.uint8) \
+        | (rand_mut_df['ALT'].values.astype(np.uint8) << 2) \
+        | (rand_mut_df['LABEL'].values.astype(np.uint8) << 4)
+    np.savez(
+        npz_path,
+        sim=rand_mut_df['SIM'].values.astype(np.uint32),
+        chrom=rand_mut_df['CHROM'].values.astype(np.uint8),
+        pos=rand_mut_df['POS'].values.astype(np.uint32),
+        mut=mut_codes,
+        sample=rand_mut_df['SAMPLE'].values.astype(np.uint32),
+        chroms=np.asarray(chroms, dtype=str),
+        sample_ids=np.asarray(sample_ids, dtype=str),
+    )
+
+
+def load_rand_mut_table(npz_path: str) \
+        -> (pd.DataFrame, np.ndarray, np.ndarray):
+    """ Load the table of random mutations saved by 'save_rand_mut_table'
+    and return the table, chromosome IDs, and sample IDs.
+    """
+    with np.load(npz_path) as npz_file:
+        mut_codes = npz_file['mut']
+        rand_mut_df = pd.DataFrame({
+            'SIM': npz_file['sim'],
+            'CHROM': npz_file['chrom'],
+            'POS': npz_file['pos'],
+            'REF': mut_codes & 0b11,
+            'ALT': (mut_codes >> 2) & 0b11,
+            'LABEL': (mut_codes >> 4) & 0b11,
+            'SAMPLE': npz_file['sample'],
+        }, columns=RAND_MUT_COLS)
+        chroms = npz_file['chroms']
+        sample_ids = npz_file['sample_ids']
+
+    return rand_mut_df, chroms, sample_ids
+
+
+def write_rand_mut_vcf(out_vcf_path: str, rand_mut_df: pd.DataFrame,
+                       chroms: np.ndarray, sample_ids: np.ndarray,
+                       num_thread: int = 1):
+    """ Write a VCF file listing random mutations in the input table
+    in the order of the table. If the path ends with '.gz', the output is
+    bgzipped and indexed by tabix (cwas.vcf_writer.VcfWriter).
+    """
+    var_chroms = np.asarray(chroms)[rand_mut_df['CHROM'].values]
+    var_positions = rand_mut_df['POS'].values + 1  # 0-based -> 1-based
+    var_refs = BASES[rand_mut_df['REF'].values]
+    var_alts = np.char.add(BASES[rand_mut_df['ALT'].values],
+                           np.array(['', 'A', 'AA', 'AAA'])
+                           [rand_mut_df['LABEL'].values])
+    var_samples = np.asarray(sample_ids)[rand_mut_df['SAMPLE'].values]
+
+    with VcfWriter(out_vcf_path, num_thread) as writer:
+        writer.write_record(['#CHROM', 'POS', 'ID', 'REF', 'ALT', 'QUAL',
+                             'FILTER', 'INFO'])
+        writer.writelines(
+            f'{chrom}\t{pos}\t{chrom}:{pos}:{ref}:{alt}\t{ref}\t{alt}\t.\t.\t'
+            f'SAMPLE={sample_id}\n'
+            for chrom, pos, ref, alt, sample_id in
+            zip(var_chroms, var_positions, var_refs, var_alts, var_samples)
+        )
+
+
+def get_file_md5(file_path: str) -> str:
+    """ Return the MD5 checksum of the file as a hexadecimal string """
+    md5 = hashlib.md5()
+
+    with open(file_path, 'rb') as infile:
+        for chunk in iter(lambda: infile.read(1 << 20), b''):
+            md5.update(chunk)
+
+    return md5.hexdigest()
+
+
+def append_sim_manifest(manifest_path: str, sim_ind: list, seed: int,
+                        file_name: str, md5: str):
+    """ Append records of completed simulations to the manifest.
+    Each line of the manifest lists a simulation index, the seed of random
+    number generators, the name of its output file and the MD5 checksum of
+    the file. The header is written if the manifest does not exist.
+    """
+    is_new = not os.path.isfile(manifest_path)
+
+    with open(manifest_path, 'a') as outfile:
+        if is_new:
+            print(*SIM_MANIFEST_COLS, sep='\t', file=outfile)
+
+        for sim_idx in sim_ind:
+            print(sim_idx, seed, file_name, md5, sep='\t', file=outfile)
+
+
+def read_sim_manifests(manifest_paths: list) -> pd.DataFrame:
+    """ Read the manifests from 'append_sim_manifest' and return a table of
+    completed simulations. 'None' seeds are read as None.
+    """
+    manifest_dfs = [
+        pd.read_table(manifest_path, dtype={'SEED': str, 'FILE': str,
+                                            'MD5': str},
+                      keep_default_na=False)
+        for manifest_path in manifest_paths
+    ]
+    if not manifest_dfs:
+        return pd.DataFrame(columns=SIM_MANIFEST_COLS)
+
+    manifest_df = pd.concat(manifest_dfs, ignore_index=True)
+    manifest_df['SEED'] = [None if seed == 'None' else int(seed)
+                           for seed in manifest_df['SEED']]
+    return manifest_df
@@ -5,12 +5,24 @@ to read genome sequences easily.
 import os
 import gzip
 
+import numpy as np
+
+from cwas.bgzf import BgzfReader, is_bgzf
+
 
 class FastaFile:
-    def __init__(self, fasta_file_path: str):
+    def __init__(self, fasta_file_path: str, use_mmap: bool = False):
         """
         :param fasta_file_path: This file path should end with
                                 '.fa' or '.fa.gz'.
+        :param use_mmap: If True, the fasta file is memory-mapped instead of
+                         being read through a file object. Only uncompressed
+                         fasta files can be memory-mapped. Processes that map
+                         the same file share one page-cache copy of it.
+
+        A fasta file compressed by bgzip is read block by block via
+        cwas.bgzf.BgzfReader (with its .gzi index if available), so random
+        access does not decompress the file from the start.
         """
         if not fasta_file_path.endswith('.fa.gz') \
                 and not fasta_file_path.endswith('fa'):
@@ -22,16 +34,33 @@ class FastaFile:
         else:
             is_gzip = False
 
-        self._fasta_file = \
-            gzip.open(fasta_file_path, 'rt') if is_gzip \
-            else open(fasta_file_path, 'r')
+        if use_mmap and is_gzip:
+            raise ValueError('A compressed fasta file cannot be '
+                             'memory-mapped.')
+
+        self._fasta_file = None
+        self._fasta_mmap = None
+        self._bgzf_reader = None
+
+        if use_mmap:
+            self._fasta_mmap = np.memmap(fasta_file_path, dtype=np.uint8,
+                                         mode='r')
+        elif is_gzip and is_bgzf(fasta_file_path):
+            self._bgzf_reader = BgzfReader(fasta_file_path)
+        else:
+            self._fasta_file = \
+                gzip.open(fasta_file_path, 'rt') if is_gzip \
+                else open(fasta_file_path, 'r')
+
         # Key: Chrom ID, Value: Dictionary contains fields of faidx
         self._idx_info_dict = {}
 
         # Parse a fasta index if available
-        fasta_idx_path = \
-            fasta_file_path.replace('.gz', '.fai') if is_gzip \
-            else fasta_file_path + '.fai'
+        # ('samtools faidx' names the index of a bgzipped file '*.fa.gz.fai'.)
+        fasta_idx_path = fasta_file_path + '.fai'
+
+        if is_gzip and not os.path.isfile(fasta_idx_path):
+            fasta_idx_path = fasta_file_path.replace('.gz', '.fai')
 
         if not os.path.isfile(fasta_idx_path):
             raise FileNotFoundError('A fai index file of the input fasta file '
@@ -61,7 +90,20 @@ class FastaFile:
         self.close()
 
     def close(self):
-        self._fasta_file.close()
+        if self._fasta_file is not None:
+            self._fasta_file.close()
+        if self._bgzf_reader is not None:
+            self._bgzf_reader.close()
+
+        # The memory map is closed when it is garbage-collected.
+        self._fasta_mmap = None
+
+    def get_size(self, chrom: str) -> int:
+        """ Return the size of the input chromosome """
+        if self._idx_info_dict.get(chrom) is None:
+            raise ValueError(f'Invalid chromosome ID "{chrom}"')
+
+        return self._idx_info_dict[chrom]['size']
 
     def get_base(self, chrom: str, pos: int) -> str:
         """ Return a base at the input position (0-based)
@@ -75,11 +117,49 @@ class FastaFile:
                              '[0, chromosome size).')
 
         base_idx = self._conv_pos_to_idx(chrom, pos)
+
+        if self._fasta_mmap is not None:
+            return chr(self._fasta_mmap[base_idx])
+        if self._bgzf_reader is not None:
+            return self._bgzf_reader.read(base_idx, 1).decode()
+
         self._fasta_file.seek(base_idx)
         base = self._fasta_file.read(1)
 
         return base
 
+    def get_bases(self, chrom: str, positions: np.ndarray) -> np.ndarray:
+        """ Return an array of bases (ASCII codes as uint8)
+        at the input positions (0-based) in the input chromosome
+        """
+        if self._idx_info_dict.get(chrom) is None:
+            raise ValueError(f'Invalid chromosome ID "{chrom}"')
+
+        positions = np.asarray(positions, dtype=np.int64)
+
+        if len(positions) == 0:
+            return np.empty(0, dtype=np.uint8)
+
+        if positions.min() < 0 \
+                or positions.max() >= self._idx_info_dict[chrom]['size']:
+            raise ValueError('The input positions should be in the range '
+                             '[0, chromosome size).')
+
+        base_ind = self._conv_pos_to_idx(chrom, positions)
+
+        if self._fasta_mmap is not None:
+            return np.asarray(self._fasta_mmap[base_ind])
+        if self._bgzf_reader is not None:
+            return self._bgzf_reader.read_at(base_ind)
+
+        bases = []
+
+        for base_idx in base_ind:
+            self._fasta_file.seek(int(base_idx))
+            bases.append(self._fasta_file.read(1))
+
+        return np.frombuffer(''.join(bases).encode(), dtype=np.uint8)
+
     def get_seq(self, chrom: str, start: int, end: int) -> str:
         """ Return a sequence at the input position (start, end; 0-based)
         in the input chromosome
@@ -97,15 +177,24 @@ class FastaFile:
 
         start_idx = self._conv_pos_to_idx(chrom, start)
         end_idx = self._conv_pos_to_idx(chrom, end)
-        self._fasta_file.seek(start_idx)
-        seq = self._fasta_file.read(end_idx - start_idx)
+
+        if self._fasta_mmap is not None:
+            seq = self._fasta_mmap[start_idx:end_idx].tobytes().decode()
+        elif self._bgzf_reader is not None:
+            seq = self._bgzf_reader.read(start_idx, end_idx - start_idx) \
+                .decode()
+        else:
+            self._fasta_file.seek(start_idx)
+            seq = self._fasta_file.read(end_idx - start_idx)
+
         seq = seq.replace('\n', '')  # Remove new lines
 
         return seq
 
-    def _conv_pos_to_idx(self, chrom: str, pos: int) -> int:
+    def _conv_pos_to_idx(self, chrom: str, pos):
         """ Convert the input position on the chromosome
         into the index on the fasta file
+        (The input can be an integer or an array of integers.)
         """
         return \
             self._idx_info_dict[chrom]['start_idx'] \
@@ -6,7 +6,8 @@ import sys
 import cwas.utils.log as log
 
 
-def execute(cmd: str, raise_err: bool = False):
+def execute(cmd: str, raise_err: bool = False) -> int:
+    """ Execute the command and return its exit value """
     log.print_log('CMD', cmd, True)
     exit_val = os.system(cmd)
 
@@ -19,6 +20,8 @@ def execute(cmd: str, raise_err: bool = False):
         else:
             log.print_warn(msg)
 
+    return exit_val
+
 
 def bgzip_tabix(in_file_path: str, force_overwrite: int = 0):
     """ Block compression (bgzip) and make an index (tabix)
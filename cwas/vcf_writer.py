@@ -0,0 +1,98 @@
+"""
+Buffered writer of VCF files
+
+Records are gathered in a large buffer and written at once, which makes far
+fewer system calls than writing each record. If the output path ends with
+'.gz', the output is compressed into BGZF blocks (by multiple threads if
+requested) and indexed by tabix when the writer is closed, so the output
+does not need to be compressed again via 'bgzip'. If an error is raised
+while writing in a 'with' block, the partial output is removed instead.
+"""
+import os
+
+import pysam
+
+from cwas.bgzf import BgzfWriter
+
+_BUFFER_SIZE = 1 << 22  # No. characters gathered before a write
+
+
+class VcfWriter:
+    def __init__(self, out_vcf_path: str, num_thread: int = 1,
+                 make_index: bool = True, buffer_size: int = _BUFFER_SIZE):
+        """
+        :param out_vcf_path: Path of the output VCF file (.vcf or .vcf.gz)
+        :param num_thread: Number of threads compressing the output
+        :param make_index: If True, a tabix index of the compressed output
+                           is made when the writer is closed.
+        :param buffer_size: Number of characters gathered before a write
+        """
+        self._out_vcf_path = out_vcf_path
+        self._is_bgzf = out_vcf_path.endswith('.gz')
+        self._make_index = make_index
+        self._buffer_size = buffer_size
+        self._buffer = []
+        self._buffered_size = 0
+        self._file = BgzfWriter(out_vcf_path, num_thread) if self._is_bgzf \
+            else open(out_vcf_path, 'wb')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+    def write(self, text: str):
+        self._buffer.append(text)
+        self._buffered_size += len(text)
+
+        if self._buffered_size >= self._buffer_size:
+            self.flush()
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def write_record(self, fields: list):
+        """ Write a record from the values of its fields """
+        self.write('\t'.join(map(str, fields)) + '\n')
+
+    def flush(self):
+        self._file.write(''.join(self._buffer).encode())
+        self._buffer.clear()
+        self._buffered_size = 0
+
+    def close(self):
+        """ Write the buffered records and close the file. A tabix index is
+        made for the compressed output.
+        """
+        if self._buffer is None:
+            return
+
+        self.flush()
+        self._buffer = None
+        self._file.close()
+
+        if self._is_bgzf and self._make_index:
+            pysam.tabix_index(self._out_vcf_path, preset='vcf', force=True)
+
+    def discard(self):
+        """ Close the file without writing the buffered records and remove
+        the partial output and its stale index if any.
+        """
+        if self._buffer is None:
+            return
+
+        self._buffer = None
+
+        if self._is_bgzf:
+            self._file.abort()
+        else:
+            self._file.close()
+
+        for file_path in [self._out_vcf_path, self._out_vcf_path + '.tbi']:
+            if os.path.isfile(file_path):
+                os.remove(file_path)
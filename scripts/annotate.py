@@ -4,14 +4,30 @@ Script for genomic and functional annotations using Variant Effect Predictor (VE
 """
 
 import argparse
+import gzip
+import itertools
 import multiprocessing as mp
 import os
+import shutil
+import subprocess
+import sys
 import yaml
+from functools import partial
 
+import numpy as np
 import pysam
 
+from cwas.core.af_table import AfTable, get_af_table_path, has_af_table
+from cwas.core.annot_cache import AnnotCache, make_fingerprint
+from cwas.core.bed_annotation import AnnotIndex, annotate_regions, get_search_regions, is_annot_index, \
+    load_annot_intervals
+from cwas.core.bigwig_annotation import BigWigScorer
+from cwas.utils.cmd import execute
+from cwas.vcf_writer import VcfWriter
 from utils import get_curr_time, execute_cmd, bgzip_tabix
-from collections import deque
+
+_STREAM_CHUNK_SIZE = 100000  # No. variants annotated at once in the streaming annotation
+_AF_INFO_KEY = 'gnomADg_AF'  # Same as the key of the VEP custom annotation by the gnomAD VCF file
 
 
 def main():
@@ -20,6 +36,10 @@ def main():
     # Parse arguments
     parser = create_arg_parser()
     args = parser.parse_args()
+
+    if args.num_chunk is None:
+        args.num_chunk = args.num_proc
+
     print_args(args)
     check_args_validity(args)
     print()
@@ -29,11 +49,12 @@ def main():
     project_dir = os.path.dirname(curr_dir)
     vep_custom_conf_path = os.path.join(project_dir, 'conf', 'vep_custom.yaml')
     annot_bed_path = os.path.join(project_dir, 'data', 'annotate', 'merged_annotation.bed.gz')
-    tmp_vcf_path = args.out_vcf_path.replace('.vcf', '.tmp.vcf')  # Temporary file for a result of VEP
-    tmp_vcf_gz_path = tmp_vcf_path + '.gz'
-    tmp_vcf_gz_idx_path = tmp_vcf_gz_path + '.tbi'
+    annot_index_path = os.path.join(project_dir, 'data', 'annotate', 'merged_annotation.idx')
+    chroms = [f'chr{n}' for n in range(1, 23)]
+
+    if not is_annot_index(annot_index_path):
+        annot_index_path = None
 
-    # Annotate by Ensembl Variant Effect Predictor (VEP)
     vep_custom_path_dict = {}
 
     with open(vep_custom_conf_path) as vep_custom_conf_file:
@@ -42,23 +63,122 @@ def main():
     for file_key in vep_custom_conf:
         vep_custom_path_dict[file_key] = os.path.join(project_dir, vep_custom_conf[file_key])
 
+    # The bigWig files are passed to this script instead of VEP.
+    bigwig_path_dict = None
+
+    if args.bigwig:
+        bigwig_path_dict = {file_key: file_path for file_key, file_path in vep_custom_path_dict.items()
+                            if file_path.endswith('bw')}
+        vep_custom_path_dict = {file_key: file_path for file_key, file_path in vep_custom_path_dict.items()
+                                if file_key not in bigwig_path_dict}
+
+    # The AFs in the gnomAD VCF file are looked up in the AF table instead of VEP.
+    af_table_dir = None
+
+    if args.af_table:
+        af_table_dir = os.path.join(project_dir, 'data', 'annotate', 'af_table')
+        assert has_af_table(af_table_dir, chroms), \
+            f'The AF table "{af_table_dir}" cannot be found. Please run "prepare.py annotation" first.'
+        vep_custom_path_dict = {file_key: file_path for file_key, file_path in vep_custom_path_dict.items()
+                                if not (file_path.endswith('vcf') or file_path.endswith('vcf.gz'))}
+
+    annotate_func = partial(annotate_vcf, args=args, vep_custom_path_dict=vep_custom_path_dict,
+                            annot_bed_path=annot_bed_path, annot_index_path=annot_index_path,
+                            bigwig_path_dict=bigwig_path_dict, af_table_dir=af_table_dir)
+
+    if args.cache_path is None:
+        annotate_func(args.in_vcf_path, args.out_vcf_path)
+    else:
+        # The annotations depend on the VEP command and the annotation files.
+        vep_settings = make_vep_cmd(args.vep_script, '', '', vep_custom_path_dict)
+        af_table_paths = [] if af_table_dir is None else \
+            [get_af_table_path(af_table_dir, chrom, 'af') for chrom in chroms]
+        annot_file_sigs = [get_file_sig(file_path)
+                           for file_path in [annot_bed_path, *vep_custom_path_dict.values(),
+                                             *(bigwig_path_dict or {}).values(), *af_table_paths]]
+        fingerprint = make_fingerprint(vep_settings, annot_file_sigs, bigwig_path_dict, af_table_dir)
+
+        with AnnotCache(args.cache_path, fingerprint, args.cache_size) as annot_cache:
+            annotate_with_cache(args.in_vcf_path, args.out_vcf_path, annot_cache, annotate_func)
+
+    print(f'[{get_curr_time()}, Progress] Done')
+
+
+def annotate_vcf(in_vcf_path: str, out_vcf_path: str, args: argparse.Namespace, vep_custom_path_dict: dict,
+                 annot_bed_path: str, annot_index_path: str = None, bigwig_path_dict: dict = None,
+                 af_table_dir: str = None):
+    """ Annotate variants in the input VCF file by VEP and the merged annotation BED file (or its index).
+    If 'bigwig_path_dict' is given, the scores in the bigWig files are also added to the INFO field.
+    If 'af_table_dir' is given, the AFs in the AF table (cwas.core.af_table) are also added to the INFO field.
+    If the input is sorted, the output of VEP is annotated by the BED file on the fly. Otherwise, the output of VEP
+    is written in a temporary file, which is bgzipped and indexed to be annotated in the order of positions.
+    """
+    if is_sorted_vcf(in_vcf_path):
+        annotate_vcf_by_stream(in_vcf_path, out_vcf_path, args, vep_custom_path_dict, annot_bed_path,
+                               annot_index_path, bigwig_path_dict, af_table_dir)
+        return
+
+    print(f'[{get_curr_time()}, Progress] The input VCF file is not sorted so annotate the VEP result by tabix')
+    tmp_vcf_path = get_plain_path(out_vcf_path).replace('.vcf', '.tmp.vcf')  # Temporary file for a result of VEP
+    tmp_vcf_gz_path = tmp_vcf_path + '.gz'
+    tmp_vcf_gz_idx_path = tmp_vcf_gz_path + '.tbi'
+
+    # Annotate by Ensembl Variant Effect Predictor (VEP)
     print(f'[{get_curr_time()}, Progress] Run Variant Effect Predictor (VEP)')
     if os.path.isfile(tmp_vcf_gz_path):
         print(f'[{get_curr_time()}, Progress] The temporary VEP result already exists so skip this VEP step')
     else:
-        cmd = make_vep_cmd(args.vep_script, args.in_vcf_path, tmp_vcf_path, vep_custom_path_dict)
-        execute_cmd(cmd, True)
+        if args.split_vcf:
+            run_vep_by_chunk(in_vcf_path, tmp_vcf_path, args.vep_script, vep_custom_path_dict, args.num_proc,
+                             args.num_chunk, args.vep_fork, args.max_retry)
+        else:
+            cmd = make_vep_cmd(args.vep_script, in_vcf_path, tmp_vcf_path, vep_custom_path_dict, args.vep_fork)
+            execute_cmd(cmd, True)
+
+        sort_vcf_file(tmp_vcf_path)  # For tabix
         bgzip_tabix(tmp_vcf_path)
 
     # Annotate by the early prepared BED file with merged annotation information
     print(f'[{get_curr_time()}, Progress] Annotate by user-added BED files')
-    annotate_by_bed(tmp_vcf_gz_path, args.out_vcf_path, annot_bed_path)
+    annotate_by_bed(tmp_vcf_gz_path, out_vcf_path, annot_bed_path, args.num_proc, annot_index_path,
+                    bigwig_path_dict, af_table_dir)
 
     # Remove the temporary files
     os.remove(tmp_vcf_gz_path)
     os.remove(tmp_vcf_gz_idx_path)
 
-    print(f'[{get_curr_time()}, Progress] Done')
+
+def annotate_vcf_by_stream(in_vcf_path: str, out_vcf_path: str, args: argparse.Namespace,
+                           vep_custom_path_dict: dict, annot_bed_path: str, annot_index_path: str = None,
+                           bigwig_path_dict: dict = None, af_table_dir: str = None):
+    """ Annotate variants in the sorted input VCF file by VEP and the merged annotation BED file (or its index)
+    without temporary bgzipped files. The output of VEP is read from a pipe (or the merged result of chunks) and
+    annotated chunk by chunk.
+    """
+    print(f'[{get_curr_time()}, Progress] Run Variant Effect Predictor (VEP) and annotate by user-added BED files')
+
+    if args.split_vcf:
+        tmp_vcf_path = get_plain_path(out_vcf_path).replace('.vcf', '.tmp.vcf')
+        run_vep_by_chunk(in_vcf_path, tmp_vcf_path, args.vep_script, vep_custom_path_dict, args.num_proc,
+                         args.num_chunk, args.vep_fork, args.max_retry)
+
+        with open(tmp_vcf_path) as vep_vcf_file:
+            annotate_vcf_lines(vep_vcf_file, out_vcf_path, annot_bed_path, annot_index_path, bigwig_path_dict,
+                               af_table_dir)
+
+        os.remove(tmp_vcf_path)
+    else:
+        cmd = make_vep_cmd(args.vep_script, in_vcf_path, 'STDOUT', vep_custom_path_dict, args.vep_fork)
+        print(f'[{get_curr_time()}, CMD] {cmd}')
+
+        with subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, text=True) as vep_proc:
+            annotate_vcf_lines(vep_proc.stdout, out_vcf_path, annot_bed_path, annot_index_path, bigwig_path_dict,
+                               af_table_dir)
+
+        if vep_proc.returncode != 0:
+            print(f'[{get_curr_time()}, ERROR] VEP has failed with an exit value {vep_proc.returncode}.')
+            os.remove(out_vcf_path)
+            sys.exit(1)
 
 
 def create_arg_parser() -> argparse.ArgumentParser:
@@ -68,13 +188,37 @@ def create_arg_parser() -> argparse.ArgumentParser:
     parser.add_argument('-o', '--outfile', dest='out_vcf_path', required=False, type=str,
                         help='Path of the VCF output', default='annotate_output.vcf')
     parser.add_argument('-s', '--split', dest='split_vcf', required=False, type=int, choices={0, 1},
-                        help='Split the input VCF by chromosome and run VEP for each split VCF (Default: 0)',
+                        help='Split the input VCF into chunks with similar numbers of variants and run VEP '
+                             'for the chunks in parallel (Default: 0)',
                         default=0)
     parser.add_argument('-p', '--num_proc', dest='num_proc', required=False, type=int,
-                        help='Number of processes for this script (only necessary for split VCF files) (Default: 1)',
+                        help='Number of processes for this script (for split VCF files and annotation by BED files) '
+                             '(Default: 1)',
                         default=1)
+    parser.add_argument('-n', '--num_chunk', dest='num_chunk', required=False, type=int,
+                        help='Number of chunks of the split input VCF (Default: the number of processes)',
+                        default=None)
     parser.add_argument('--vep', dest='vep_script', required=False, type=str,
                         help='Path of a Perl script to execute VEP (Default: vep (binary))', default='vep')
+    parser.add_argument('--vep_fork', dest='vep_fork', required=False, type=int,
+                        help='Number of forks of each VEP process (VEP --fork option) (Default: 1)', default=1)
+    parser.add_argument('--max_retry', dest='max_retry', required=False, type=int,
+                        help='Maximum number of retries of VEP for a failed chunk (Default: 2)', default=2)
+    parser.add_argument('-b', '--bigwig', dest='bigwig', required=False, type=int, choices={0, 1},
+                        help='Annotate variants by the bigWig files in conf/vep_custom.yaml (e.g. conservation '
+                             'scores) in this script instead of VEP. It requires pyBigWig (Default: 0)',
+                        default=0)
+    parser.add_argument('-g', '--gnomad_af', dest='af_table', required=False, type=int, choices={0, 1},
+                        help='Annotate allele frequencies in gnomAD by the AF table from prepare.py in this script '
+                             'instead of the exact matching of VEP (Default: 0)',
+                        default=0)
+    parser.add_argument('-c', '--cache', dest='cache_path', required=False, type=str,
+                        help='Path of a persistent annotation cache (SQLite database). If it is specified, '
+                             'only variants not in the cache are annotated by VEP (Default: no cache)',
+                        default=None)
+    parser.add_argument('--cache_size', dest='cache_size', required=False, type=int,
+                        help='Maximum number of variants in the annotation cache (Default: no limit)',
+                        default=None)
 
     return parser
 
@@ -84,9 +228,26 @@ def print_args(args: argparse.Namespace):
     print(f'[Setting] The output path: {args.out_vcf_path}')
     print(f'[Setting] VEP script: {args.vep_script}')
 
+    print(f'[Setting] No. processes for this script: {args.num_proc:,d}')
+
+    if args.vep_fork > 1:
+        print(f'[Setting] No. forks of each VEP process: {args.vep_fork:,d}')
+
     if args.split_vcf:
-        print(f'[Setting] Split the input VCF file by chromosome and run vep for each split VCF')
-        print(f'[Setting] No. processes for this script: {args.num_proc:,d}')
+        print(f'[Setting] Split the input VCF file into {args.num_chunk:,d} chunks and run VEP for each chunk')
+        print(f'[Setting] Max. No. retries of VEP for a failed chunk: {args.max_retry:,d}')
+
+    if args.bigwig:
+        print(f'[Setting] Annotate variants by the bigWig files in this script instead of VEP')
+
+    if args.af_table:
+        print(f'[Setting] Annotate allele frequencies in gnomAD by the AF table instead of VEP')
+
+    if args.cache_path is not None:
+        print(f'[Setting] The annotation cache: {args.cache_path}')
+
+        if args.cache_size is not None:
+            print(f'[Setting] Max. No. variants in the annotation cache: {args.cache_size:,d}')
 
 
 def check_args_validity(args: argparse.Namespace):
@@ -97,41 +258,268 @@ def check_args_validity(args: argparse.Namespace):
         f'The VEP script "{args.vep_script}" is not a binary or an invalid path.'
     assert 1 <= args.num_proc <= mp.cpu_count(), \
         f'Invalid number of processes "{args.num_proc:,d}". It must be in the range [1, {mp.cpu_count()}].'
+    assert args.vep_fork >= 1, f'Invalid number of VEP forks "{args.vep_fork:,d}". It must be positive.'
+
+    if args.split_vcf:
+        assert args.num_chunk >= 1, f'Invalid number of chunks "{args.num_chunk:,d}". It must be positive.'
+        assert args.max_retry >= 0, f'Invalid number of retries "{args.max_retry:,d}". It must not be negative.'
 
+    if args.cache_size is not None:
+        assert args.cache_size >= 1, f'Invalid cache size "{args.cache_size:,d}". It must be positive.'
 
-def split_vcf_by_chrom(vcf_file_path: str) -> list:
-    """ Split the input VCF file by each chromosome and return a list of split VCF file paths
-    Each split file has a filename that ends with .{chromosome ID}.vcf.
 
-    :param vcf_file_path: Input VCF file path
-    :return: List of file paths of split VCFs
+def get_plain_path(vcf_path: str) -> str:
+    """ Return the path without the '.gz' extension """
+    return vcf_path[:-3] if vcf_path.endswith('.gz') else vcf_path
+
+
+def is_sorted_vcf(vcf_path: str) -> bool:
+    """ Return True if the variants on chr1-22 in the VCF file are sorted by their chromosomes and positions,
+    which is the order of the output of 'annotate_by_bed'.
     """
-    chrom_to_file = {}
-    vcf_file_paths = []
+    chrom_to_idx = {f'chr{n}': n for n in range(1, 23)}
+    open_func = gzip.open if vcf_path.endswith('.gz') else open
+    prev_var_loc = (0, 0)
+
+    with open_func(vcf_path, 'rt') as vcf_file:
+        for line in vcf_file:
+            if line.startswith('#'):
+                continue
+
+            fields = line.split('\t', 2)
+            chrom_idx = chrom_to_idx.get(fields[0])
+
+            if chrom_idx is None:
+                continue
 
-    with open(vcf_file_path) as in_vcf_file:
-        header = in_vcf_file.readline()
+            var_loc = (chrom_idx, int(fields[1]))
+            if var_loc < prev_var_loc:
+                return False
 
+            prev_var_loc = var_loc
+
+    return True
+
+
+def sort_vcf_file(vcf_path: str):
+    """ Sort variants in the VCF file by their chromosomes (in the order of their first appearance)
+    and positions in place
+    """
+    with open(vcf_path) as vcf_file:
+        vcf_lines = vcf_file.readlines()
+
+    header_lines = [line for line in vcf_lines if line.startswith('#')]
+    var_lines = [line for line in vcf_lines if not line.startswith('#')]
+    chrom_to_idx = {}
+
+    for line in var_lines:
+        chrom_to_idx.setdefault(line.split('\t', 1)[0], len(chrom_to_idx))
+
+    var_lines.sort(key=lambda line: (chrom_to_idx[line.split('\t', 1)[0]], int(line.split('\t', 2)[1])))
+
+    with VcfWriter(vcf_path) as vcf_file:
+        vcf_file.writelines(header_lines + var_lines)
+
+
+def get_file_sig(file_path: str) -> list:
+    """ Return a list of the path, size, and modification time of the file (None if it does not exist) """
+    if not os.path.isfile(file_path):
+        return [file_path, None, None]
+
+    file_stat = os.stat(file_path)
+    return [file_path, file_stat.st_size, file_stat.st_mtime_ns]
+
+
+def get_var_key(vcf_line: str) -> tuple:
+    """ Return a key (chrom, pos, ref, alt) of the variant in the VCF line """
+    fields = vcf_line.split('\t', 5)
+    return fields[0], int(fields[1]), fields[3], fields[4]
+
+
+def annotate_with_cache(in_vcf_path: str, out_vcf_path: str, annot_cache: AnnotCache, annotate_func):
+    """ Annotate variants in the input VCF file using the annotation cache.
+    Each distinct variant (chrom, pos, ref, alt) is looked up in the cache and only the variants not in the cache
+    are annotated by 'annotate_func' (VEP and the BED annotation) once. Their annotations are stored in the cache
+    and the annotations are copied to every input line of the variants.
+    Like 'annotate_by_bed', the output only lists variants on chr1-22 sorted by their positions.
+    """
+    open_func = gzip.open if in_vcf_path.endswith('.gz') else open
+    miss_vcf_path = get_plain_path(out_vcf_path).replace('.vcf', '.miss.vcf')
+    annot_miss_vcf_path = get_plain_path(out_vcf_path).replace('.vcf', '.miss.annot.vcf')
+
+    with open_func(in_vcf_path, 'rt') as in_vcf_file:
+        vcf_lines = in_vcf_file.read().splitlines()
+
+    header_lines = [line for line in vcf_lines if line.startswith('#')]
+    var_lines = [line for line in vcf_lines if not line.startswith('#')]
+    var_keys = list(dict.fromkeys(map(get_var_key, var_lines)))
+    var_annots = annot_cache.get(var_keys)
+    chroms = [f'chr{n}' for n in range(1, 23)]
+    miss_var_keys = [var_key for var_key in var_keys if var_key not in var_annots and var_key[0] in chroms]
+    chrom_to_idx = {chrom: i for i, chrom in enumerate(dict.fromkeys(var_key[0] for var_key in var_keys))}
+    miss_var_keys.sort(key=lambda var_key: (chrom_to_idx[var_key[0]], var_key[1]))  # Sorted for tabix
+    annot_header_lines = annot_cache.get_header()
+    print(f'[{get_curr_time()}, Progress] {len(var_lines):,d} variants ({len(var_keys):,d} distinct), '
+          f'{len(var_annots):,d} distinct variants in the annotation cache')
+
+    if miss_var_keys or annot_header_lines is None:
+        with VcfWriter(miss_vcf_path) as miss_vcf_file:
+            for line in header_lines:
+                print(line, file=miss_vcf_file)
+
+            for chrom, pos, ref, alt in miss_var_keys:
+                miss_vcf_file.write_record([chrom, pos, '.', ref, alt, '.', '.', '.'])
+
+        annotate_func(miss_vcf_path, annot_miss_vcf_path)
+        miss_var_annots = {}
+
+        with open(annot_miss_vcf_path) as annot_miss_vcf_file:
+            annot_header_lines = []
+
+            for line in annot_miss_vcf_file:
+                line = line.rstrip('\n')
+
+                if line.startswith('##'):
+                    if line not in header_lines:
+                        annot_header_lines.append(line)
+                elif not line.startswith('#'):
+                    # The INFO fields added by the annotation (e.g. CSQ) and the annotation integer
+                    infos = [info for info in line.split('\t')[7].split(';') if info != '.']
+                    annot_int = int(infos.pop()[len('ANNOT='):])
+                    miss_var_annots[get_var_key(line)] = (';'.join(infos) or None, annot_int)
+
+        annot_cache.put(miss_var_annots)
+        annot_cache.put_header(annot_header_lines)
+        var_annots.update(miss_var_annots)
+        os.remove(miss_vcf_path)
+        os.remove(annot_miss_vcf_path)
+
+    # Write the annotated variants
+    chrom_to_lines = {chrom: [] for chrom in chroms}
+
+    for line in var_lines:
+        chrom_lines = chrom_to_lines.get(line.split('\t', 1)[0])
+
+        if chrom_lines is not None:
+            chrom_lines.append(line)
+
+    with VcfWriter(out_vcf_path) as out_vcf_file:
+        for line in header_lines[:-1] + annot_header_lines + header_lines[-1:]:
+            print(line, file=out_vcf_file)
+
+        for chrom in chroms:
+            for line in sorted(chrom_to_lines[chrom], key=lambda vcf_line: int(vcf_line.split('\t', 2)[1])):
+                var_annot = var_annots.get(get_var_key(line))
+
+                if var_annot is None:  # Not annotated by VEP
+                    continue
+
+                annot_info, annot_int = var_annot
+                fields = line.split('\t')
+                infos = [] if fields[7] == '.' else [fields[7]]
+
+                if annot_info is not None:
+                    infos.append(annot_info)
+
+                infos.append(f'ANNOT={annot_int}')
+                fields[7] = ';'.join(infos)
+                out_vcf_file.write_record(fields)
+
+
+def split_vcf_into_chunks(vcf_file_path: str, chunk_path_prefix: str, num_chunk: int) -> list:
+    """ Split the input VCF file into consecutive chunks with similar numbers of variants
+    and return a list of the chunk file paths in the order of the chunks.
+    Each chunk has all the header lines and a filename that ends with .chunk{chunk number}.vcf.
+
+    :param vcf_file_path: Input VCF file path (.vcf or .vcf.gz)
+    :param chunk_path_prefix: Prefix of the chunk file paths
+    :param num_chunk: Maximum number of chunks. The input is not split more than the number of variants.
+    :return: List of file paths of the chunks
+    """
+    open_func = gzip.open if vcf_file_path.endswith('.gz') else open
+    header_lines = []
+    num_var = 0
+
+    with open_func(vcf_file_path, 'rt') as in_vcf_file:
         for line in in_vcf_file:
-            chrom = line.split('\t')[0]
-            chr_vcf_file = chrom_to_file.get(chrom)
+            if line.startswith('#'):
+                header_lines.append(line)
+            else:
+                num_var += 1
 
-            if chr_vcf_file is None:
-                chr_vcf_file_path = vcf_file_path.replace('.vcf', f'.{chrom}.vcf')
-                vcf_file_paths.append(chr_vcf_file_path)
-                chr_vcf_file = open(chr_vcf_file_path, 'w')
-                chr_vcf_file.write(header)
-                chrom_to_file[chrom] = chr_vcf_file
+    chunk_size = max(-(-num_var // num_chunk), 1)
+    num_chunk = max(-(-num_var // chunk_size), 1)
+    chunk_paths = [f'{chunk_path_prefix}.chunk{i:04d}.vcf' for i in range(num_chunk)]
 
-            chr_vcf_file.write(line)
+    with open_func(vcf_file_path, 'rt') as in_vcf_file:
+        var_lines = (line for line in in_vcf_file if not line.startswith('#'))
 
-    for chr_vcf_file in chrom_to_file.values():
-        chr_vcf_file.close()
+        for chunk_path in chunk_paths:
+            with VcfWriter(chunk_path) as chunk_file:
+                chunk_file.writelines(header_lines)
+                chunk_file.writelines(itertools.islice(var_lines, chunk_size))
 
-    return vcf_file_paths
+    return chunk_paths
 
 
-def make_vep_cmd(vep_script: str, in_vcf_path: str, out_vcf_path: str, custom_path_dict: dict = None) -> str:
+def run_vep_by_chunk(in_vcf_path: str, out_vcf_path: str, vep_script: str, custom_path_dict: dict,
+                     num_proc: int, num_chunk: int, num_fork: int = 1, max_retry: int = 2):
+    """ Split the input VCF file into chunks, run VEP for the chunks in parallel and merge the results.
+    Since the chunks are consecutive parts of the input, the results are appended to the output VCF file
+    in the order of the chunks as soon as they are ready, which keeps the order of the input variants.
+    """
+    chunk_path_prefix = out_vcf_path.replace('.vcf', '')
+    print(f'[{get_curr_time()}, Progress] Split the input VCF file into chunks')
+    chunk_paths = split_vcf_into_chunks(in_vcf_path, chunk_path_prefix, num_chunk)
+    out_chunk_paths = [chunk_path.replace('.vcf', '.vep.vcf') for chunk_path in chunk_paths]
+
+    run_func = partial(run_vep_chunk, vep_script=vep_script, custom_path_dict=custom_path_dict,
+                       num_fork=num_fork, max_retry=max_retry)
+    failed_chunk_paths = []
+
+    with mp.Pool(min(num_proc, len(chunk_paths))) as pool, VcfWriter(out_vcf_path) as out_vcf_file:
+        chunk_results = pool.imap(run_func, zip(chunk_paths, out_chunk_paths))
+
+        for i, (chunk_path, out_chunk_path, is_done) in \
+                enumerate(zip(chunk_paths, out_chunk_paths, chunk_results)):
+            if is_done and not failed_chunk_paths:
+                append_vcf_file(out_vcf_file, out_chunk_path, write_header=i == 0)
+            elif not is_done:
+                failed_chunk_paths.append(chunk_path)
+
+    if failed_chunk_paths:
+        print(f'[{get_curr_time()}, ERROR] VEP has failed for {len(failed_chunk_paths):,d} chunks '
+              f'({", ".join(failed_chunk_paths)}).')
+        os.remove(out_vcf_path)
+        sys.exit(1)
+
+    for chunk_path, out_chunk_path in zip(chunk_paths, out_chunk_paths):
+        os.remove(chunk_path)
+        os.remove(out_chunk_path)
+
+
+def run_vep_chunk(chunk_paths: tuple, vep_script: str, custom_path_dict: dict, num_fork: int = 1,
+                  max_retry: int = 2) -> bool:
+    """ Run VEP for the chunk and retry it up to 'max_retry' times if it fails.
+    Return True if VEP has succeeded.
+
+    :param chunk_paths: Paths of the input chunk and the VEP output of the chunk
+    """
+    chunk_path, out_chunk_path = chunk_paths
+    cmd = make_vep_cmd(vep_script, chunk_path, out_chunk_path, custom_path_dict, num_fork)
+
+    for num_try in range(max_retry + 1):
+        if num_try > 0:
+            print(f'[{get_curr_time()}, Progress] Retry VEP for "{chunk_path}" ({num_try:,d}/{max_retry:,d})')
+
+        if execute(cmd) == 0 and os.path.isfile(out_chunk_path):
+            return True
+
+    return False
+
+
+def make_vep_cmd(vep_script: str, in_vcf_path: str, out_vcf_path: str, custom_path_dict: dict = None,
+                 num_fork: int = 1) -> str:
     """ Make a command to execute VEP and return it.
     """
     # Basic information
@@ -148,6 +536,9 @@ def make_vep_cmd(vep_script: str, in_vcf_path: str, out_vcf_path: str, custom_pa
         '--polyphen p',
     ]
 
+    if num_fork > 1:
+        cmd_args += ['--fork', str(num_fork)]
+
     # Only the most severe consequence per gene.
     cmd_args += [
         '--per_gene',
@@ -193,89 +584,214 @@ def concat_vcf_files(out_vcf_path: str, vcf_file_paths: list):
     :param out_vcf_path: Path of out VCF file
     :param vcf_file_paths: Paths of input VCF files
     """
-    with open(out_vcf_path, 'w') as outfile:
+    with VcfWriter(out_vcf_path) as outfile:
         for i, vcf_file_path in enumerate(vcf_file_paths):
-            with open(vcf_file_path) as vcf_file:
-                if i == 0:  # Write all lines from the file
-                    for line in vcf_file:
-                        outfile.write(line)
-                else:  # Write all lines except headers
-                    for line in vcf_file:
-                        if not line.startswith('#'):
-                            outfile.write(line)
-
-
-def annotate_by_bed(in_vcf_gz_path: str, out_vcf_path: str, annot_bed_path: str):
-    """ Annotate variants in the input VCF file using the prepared annotation BED file """
+            append_vcf_file(outfile, vcf_file_path, write_header=i == 0)
+
+
+def append_vcf_file(outfile, vcf_file_path: str, write_header: bool):
+    """ Append the lines of the input VCF file to the output file object.
+    The header lines are written only if 'write_header' is True.
+    """
+    with open(vcf_file_path) as vcf_file:
+        if write_header:
+            shutil.copyfileobj(vcf_file, outfile)
+        else:
+            for line in vcf_file:
+                if not line.startswith('#'):
+                    outfile.write(line)
+                    break
+
+            shutil.copyfileobj(vcf_file, outfile)
+
+
+def annotate_by_bed(in_vcf_gz_path: str, out_vcf_path: str, annot_bed_path: str, num_proc: int = 1,
+                    annot_index_path: str = None, bigwig_path_dict: dict = None, af_table_dir: str = None):
+    """ Annotate variants in the input VCF file using the prepared annotation BED file
+    or its binary index (cwas.core.bed_annotation.AnnotIndex) if the index path is given.
+    If 'bigwig_path_dict' or 'af_table_dir' is given, the scores in the bigWig files or the AFs are also added.
+    Each chromosome is annotated in parallel and the results are written in the order of the chromosomes.
+    """
     chroms = [f'chr{n}' for n in range(1, 23)]
 
-    with pysam.TabixFile(in_vcf_gz_path) as in_vcf_file, pysam.TabixFile(annot_bed_path) as annot_bed_file, \
-            open(out_vcf_path, 'w') as out_vcf_file:
-        # Make and write headers
-        vcf_headers = in_vcf_file.header
-        annot_key_str = annot_bed_file.header[0].split('=')[1]
-        annot_info_header = f'##INFO=<ID=ANNOT,Key={annot_key_str}>'
-        vcf_headers.append(annot_info_header)
-        vcf_headers[-1], vcf_headers[-2] = vcf_headers[-2], vcf_headers[-1]  # Swap
+    with pysam.TabixFile(in_vcf_gz_path) as in_vcf_file:
+        vcf_headers = list(in_vcf_file.header)
 
+    # Make headers
+    annot_key_str = get_annot_key_str(annot_bed_path, annot_index_path)
+    vcf_headers[-1:-1] = make_af_info_headers(af_table_dir) + make_bigwig_info_headers(bigwig_path_dict) + \
+        [f'##INFO=<ID=ANNOT,Key={annot_key_str}>']
+    num_annot_key = len(annot_key_str.split('|'))
+
+    with VcfWriter(out_vcf_path, num_proc) as out_vcf_file:
         for vcf_header in vcf_headers:
             print(vcf_header, file=out_vcf_file)
 
         # Annotate by the input BED file
-        for chrom in chroms:
-            var_iter = in_vcf_file.fetch(chrom, parser=pysam.asTuple())
-            bed_iter = annot_bed_file.fetch(chrom, parser=pysam.asTuple())
-            bed_memory = deque()
-            variant = next(var_iter, None)
-
-            while variant is not None:
-                var_pos = int(variant[1]) - 1  # 1-based -> 0-based
-                var_ref = variant[3]
-                var_alt = variant[4]
-
-                # Determine a search region for BED coordinates
-                if len(var_ref) == 1:  # Insertion or substitution
-                    region_start = var_pos
-                    region_end = var_pos + 2 if len(var_alt) > 1 else var_pos + 1
-                else:  # Deletion
-                    region_start = var_pos + 1
-                    region_end = region_start + len(var_ref) - 1
-
-                # Get an annotation integer
-                annot_int = 0
-                stop_bed_iter = False
-
-                # 1. Check the memory of previously checked BED coordinates
-                while len(bed_memory) > 0 and int(bed_memory[0][2]) <= region_start:
-                    # Remove non-overlapped coordinates
-                    bed_memory.popleft()
-
-                for bed in bed_memory:
-                    if int(bed[1]) < region_end:  # Overlap
-                        annot_int |= int(bed[3])
-                    else:
-                        stop_bed_iter = True
-                        break
-
-                # 2. Continuously iterate over the list BED coordinates and check
-                if not stop_bed_iter:
-                    bed = next(bed_iter, None)
-
-                    while bed is not None:
-                        bed_start = int(bed[1])
-                        bed_end = int(bed[2])
-
-                        if region_start < bed_end:
-                            bed_memory.append(bed)
-                            if bed_start < region_end:  # Overlap
-                                annot_int |= int(bed[3])
-                            else:
-                                break
-
-                        bed = next(bed_iter, None)
-
-                print(str(variant) + f';ANNOT={annot_int}', file=out_vcf_file)
-                variant = next(var_iter, None)
+        annotate_func = partial(annotate_chrom_by_bed, in_vcf_gz_path=in_vcf_gz_path, annot_bed_path=annot_bed_path,
+                                num_annot_key=num_annot_key, annot_index_path=annot_index_path,
+                                bigwig_path_dict=bigwig_path_dict, af_table_dir=af_table_dir)
+
+        if num_proc == 1:
+            for chrom in chroms:
+                out_vcf_file.write(annotate_func(chrom))
+        else:
+            with mp.Pool(num_proc) as pool:
+                for chr_out_vcf_str in pool.imap(annotate_func, chroms):
+                    out_vcf_file.write(chr_out_vcf_str)
+
+
+def make_bigwig_info_headers(bigwig_path_dict: dict = None) -> list:
+    """ Return a list of the INFO header lines of the scores in the bigWig files """
+    if bigwig_path_dict is None:
+        return []
+
+    return [f'##INFO=<ID={key},Number=1,Type=Float,Description="Max. score in {os.path.basename(bigwig_path)}">'
+            for key, bigwig_path in bigwig_path_dict.items()]
+
+
+def make_af_info_headers(af_table_dir: str = None) -> list:
+    """ Return a list of the INFO header line of the AFs in the AF table """
+    if af_table_dir is None:
+        return []
+
+    return [f'##INFO=<ID={_AF_INFO_KEY},Number=1,Type=Float,Description="Allele frequency in gnomAD">']
+
+
+def get_annot_key_str(annot_bed_path: str, annot_index_path: str = None) -> str:
+    """ Return the annotation keys joined by '|' from the annotation BED file or its index """
+    if annot_index_path is None:
+        with pysam.TabixFile(annot_bed_path) as annot_bed_file:
+            return annot_bed_file.header[0].split('=')[1]
+
+    return '|'.join(AnnotIndex(annot_index_path).annot_keys)
+
+
+def annotate_chrom_by_bed(chrom: str, in_vcf_gz_path: str, annot_bed_path: str, num_annot_key: int,
+                          annot_index_path: str = None, bigwig_path_dict: dict = None,
+                          af_table_dir: str = None) -> str:
+    """ Annotate variants of the chromosome in the input VCF file using the prepared annotation BED file
+    or its binary index and return VCF lines with the ANNOT field.
+    """
+    with pysam.TabixFile(in_vcf_gz_path) as in_vcf_file:
+        if chrom not in in_vcf_file.contigs:
+            return ''
+
+        vcf_lines = list(in_vcf_file.fetch(chrom))
+
+    if annot_index_path is None:
+        with pysam.TabixFile(annot_bed_path) as annot_bed_file:
+            annot_intervals = load_annot_intervals(annot_bed_file, chrom, num_annot_key)
+    else:
+        annot_intervals = AnnotIndex(annot_index_path).get_intervals(chrom)
+
+    af_table = None if af_table_dir is None else AfTable(af_table_dir, _AF_INFO_KEY)
+
+    if bigwig_path_dict is None:
+        return annotate_lines_by_intervals(vcf_lines, *annot_intervals, af_table=af_table)
+
+    with BigWigScorer(bigwig_path_dict) as bigwig_scorer:
+        return annotate_lines_by_intervals(vcf_lines, *annot_intervals, bigwig_scorer, af_table)
+
+
+def annotate_lines_by_intervals(vcf_lines: list, bed_starts: np.ndarray, bed_ends: np.ndarray,
+                                bed_annot_ints: np.ndarray, bigwig_scorer: BigWigScorer = None,
+                                af_table: AfTable = None) -> str:
+    """ Annotate variants in the VCF lines (without newlines) of a chromosome by the intervals of the chromosome
+    in the annotation BED file and return VCF lines with the ANNOT field.
+    If 'af_table' or 'bigwig_scorer' is given, the AFs and the scores in the bigWig files are added in this order
+    before the ANNOT field.
+    """
+    if not vcf_lines:
+        return ''
+
+    var_fields = [line.split('\t', 5) for line in vcf_lines]
+    positions = [int(fields[1]) for fields in var_fields]
+    ref_lens = [len(fields[3]) for fields in var_fields]
+    alt_lens = [len(fields[4]) for fields in var_fields]
+
+    region_starts, region_ends = get_search_regions(positions, ref_lens, alt_lens)
+    annot_ints = annotate_regions(region_starts, region_ends, bed_starts, bed_ends, bed_annot_ints)
+
+    chrom = var_fields[0][0]
+
+    if af_table is not None:
+        af_strs = af_table.get_info_strs(chrom, positions, [fields[3] for fields in var_fields],
+                                         [fields[4] for fields in var_fields])
+        vcf_lines = [f'{line};{af_str}' for line, af_str in zip(vcf_lines, af_strs)]
+
+    if bigwig_scorer is not None:
+        score_strs = bigwig_scorer.get_info_strs(chrom, region_starts, region_ends)
+        vcf_lines = [f'{line};{score_str}' for line, score_str in zip(vcf_lines, score_strs)]
+
+    return ''.join(f'{line};ANNOT={annot_int}\n' for line, annot_int in zip(vcf_lines, annot_ints))
+
+
+def annotate_vcf_lines(vcf_lines, out_vcf_path: str, annot_bed_path: str, annot_index_path: str = None,
+                       bigwig_path_dict: dict = None, af_table_dir: str = None):
+    """ Annotate variants in the iterable of VCF lines (e.g. a file object) by the annotation BED file or its index
+    and write the output VCF file. The variants are annotated by chunks of consecutive variants on the same
+    chromosome, so the memory usage does not depend on the number of variants. Like 'annotate_by_bed',
+    only the variants on chr1-22 are written.
+    """
+    chroms = {f'chr{n}' for n in range(1, 23)}
+    annot_key_str = get_annot_key_str(annot_bed_path, annot_index_path)
+    num_annot_key = len(annot_key_str.split('|'))
+
+    if annot_index_path is None:
+        annot_bed_file = pysam.TabixFile(annot_bed_path)
+        get_intervals = partial(load_annot_intervals, annot_bed_file, num_annot_key=num_annot_key)
+    else:
+        annot_bed_file = None
+        get_intervals = AnnotIndex(annot_index_path).get_intervals
+
+    bigwig_scorer = None if bigwig_path_dict is None else BigWigScorer(bigwig_path_dict)
+    af_table = None if af_table_dir is None else AfTable(af_table_dir, _AF_INFO_KEY)
+    chunk_chrom = None
+    chunk_lines = []
+    chrom_to_intervals = {}
+
+    with VcfWriter(out_vcf_path) as out_vcf_file:
+        def write_chunk():
+            if chunk_lines:
+                if chunk_chrom not in chrom_to_intervals:
+                    chrom_to_intervals.clear()  # Keep the intervals of only one chromosome
+                    chrom_to_intervals[chunk_chrom] = get_intervals(chunk_chrom)
+
+                out_vcf_file.write(
+                    annotate_lines_by_intervals(chunk_lines, *chrom_to_intervals[chunk_chrom], bigwig_scorer,
+                                                af_table))
+                chunk_lines.clear()
+
+        for line in vcf_lines:
+            if line.startswith('#'):
+                if line.startswith('#CHROM'):
+                    for info_header in make_af_info_headers(af_table_dir) + make_bigwig_info_headers(bigwig_path_dict):
+                        print(info_header, file=out_vcf_file)
+
+                    print(f'##INFO=<ID=ANNOT,Key={annot_key_str}>', file=out_vcf_file)
+
+                out_vcf_file.write(line)
+                continue
+
+            chrom = line.split('\t', 1)[0]
+
+            if chrom not in chroms:
+                continue
+
+            if chrom != chunk_chrom or len(chunk_lines) >= _STREAM_CHUNK_SIZE:
+                write_chunk()
+                chunk_chrom = chrom
+
+            chunk_lines.append(line.rstrip('\n'))
+
+        write_chunk()
+
+    if annot_bed_file is not None:
+        annot_bed_file.close()
+
+    if bigwig_scorer is not None:
+        bigwig_scorer.close()
 
 
 if __name__ == "__main__":
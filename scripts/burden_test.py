@@ -15,7 +15,9 @@ import numpy as np
 import pandas as pd
 from scipy.stats import binom_test, norm
 
-from utils import cmp_two_arr, div_dist_num, get_curr_time, swap_label
+from cwas.core.cat_result import CatResult
+from cwas.core.common import make_rng, swap_label
+from utils import cmp_two_arr, div_dist_num, get_curr_time
 
 
 def main():
@@ -32,32 +34,32 @@ def main():
     print()
 
     # Load and parse the input data
-    print(f'[{get_curr_time()}, Progress] Parse the categorization result into DataFrame')
-    cwas_cat_df = pd.read_table(args.cat_result_path, index_col='SAMPLE')
+    print(f'[{get_curr_time()}, Progress] Load the categorization result')
+    cat_result = CatResult.read(args.cat_result_path)
 
     # Load and parse the file listing sample IDs
     print(f'[{get_curr_time()}, Progress] Parse the file listing sample IDs')
     sample_df = pd.read_table(args.sample_file_path, index_col='SAMPLE')
-    assert cmp_two_arr(cwas_cat_df.index.values, sample_df.index.values), \
-        f'The samples IDs of the categorization result are not the same ' \
-        f'with the sample IDs of the file listing samples.'
+    assert cmp_two_arr(cat_result.sample_ids, sample_df.index.values), \
+        'The samples IDs of the categorization result are not the same ' \
+        'with the sample IDs of the file listing samples.'
 
     # Adjust No. DNVs of each sample in the categorization result
     if args.adj_file_path:
         print(f'[{get_curr_time()}, Progress] Adjust No. DNVs of each sample in the categorization result')
         adj_factor_df = pd.read_table(args.adj_file_path, index_col='SAMPLE')
         assert cmp_two_arr(adj_factor_df.index.values, sample_df.index.values), \
-            f'The samples IDs of the categorization result are not the same ' \
-            f'with the sample IDs of the file listing samples.'
-        cwas_cat_df = adjust_cat_df(cwas_cat_df, adj_factor_df)
+            'The samples IDs of the categorization result are not the same ' \
+            'with the sample IDs of the file listing samples.'
+        cat_result = adjust_cat_result(cat_result, adj_factor_df)
 
     # Run burden tests
     if args.test_type == 'binom':
         print(f'[{get_curr_time()}, Progress] Run burden tests via binomial tests')
-        burden_df = run_burden_binom(cwas_cat_df, sample_df)
+        burden_df = run_burden_binom(cat_result, sample_df)
     else:  # args.test_type == 'perm'
         print(f'[{get_curr_time()}, Progress] Run burden tests via permutation tests')
-        burden_df, perm_rr_df = run_burden_perm(cwas_cat_df, sample_df, args.num_perm, args.num_proc)
+        burden_df, perm_rr_df = run_burden_perm(cat_result, sample_df, args.num_perm, args.num_proc, args.seed)
 
         if args.perm_rr_path:
             print(f'[{get_curr_time()}, Progress] Write lists of relative risks from label-swapping permutations')
@@ -107,28 +109,28 @@ def create_arg_parser() -> argparse.ArgumentParser:
     parser_perm.add_argument('-po', '--perm_outfile', dest='perm_rr_path', required=False, type=str,
                              help='Path of relative risk (RR) outputs from permutations',
                              default='')
+    parser_perm.add_argument('--seed', dest='seed', required=False, type=int,
+                             help='Seed of random number generators for permutations. The results are the same '
+                                  'regardless of the number of processes. (Default: None (random))',
+                             default=None)
 
     return parser
 
 
-def adjust_cat_df(cwas_cat_df: pd.DataFrame, adj_factor_df: pd.DataFrame) -> pd.DataFrame:
-    """ Adjust No. DNVs of each sample in a DataFrame for the result of CWAS categorization
+def adjust_cat_result(cat_result: CatResult, adj_factor_df: pd.DataFrame) -> CatResult:
+    """ Adjust No. DNVs of each sample in the result of CWAS categorization
     by adjustment factors for each sample
 
-    :param cwas_cat_df: A DataFrame that contains the CWAS categorization result
+    :param cat_result: The CWAS categorization result
     :param adj_factor_df: A DataFrame that contains a list of adjustment factors for each sample
-    :return: A DataFrame that contains the CWAS categorization result with adjusted No. DNVs
+    :return: The CWAS categorization result with adjusted No. DNVs
     """
     # Reorder the adjustment factors
-    sample_ids = cwas_cat_df.index.values
     adj_factor_dict = adj_factor_df.to_dict()['AdjustFactor']
-    adj_factors = [adj_factor_dict[sample_id] for sample_id in sample_ids]
+    adj_factors = [adj_factor_dict[sample_id] for sample_id in cat_result.sample_ids]
 
     # Adjust the number of de novo variants of each sample by adjustment factors
-    cwas_cat_df = cwas_cat_df.multiply(adj_factors, axis='index')
-    cwas_cat_df.index.name = 'SampleID'
-
-    return cwas_cat_df
+    return cat_result.adjust(adj_factors)
 
 
 def print_args(args: argparse.Namespace):
@@ -143,6 +145,7 @@ def print_args(args: argparse.Namespace):
         print(f'[Setting] No. label-swapping permutations: {args.num_perm:,d}')
         print(f'[Setting] No. processes for the tests: {args.num_proc:,d}')
         print(f'[Setting] Permutation RR output path: {args.perm_rr_path if args.perm_rr_path else "None"}')
+        print(f'[Setting] Seed of random number generators: {args.seed}')
 
 
 def check_args_validity(args: argparse.Namespace):
@@ -156,30 +159,31 @@ def check_args_validity(args: argparse.Namespace):
     if args.test_type == 'perm':
         assert 1 <= args.num_proc <= mp.cpu_count(), \
             f'Invalid number of processes "{args.num_proc:,d}". It must be in the range [1, {mp.cpu_count()}].'
-        assert args.num_perm >= args.num_proc, f'No. processes must be equal or less than No. permutations.'
+        assert args.num_perm >= args.num_proc, 'No. processes must be equal or less than No. permutations.'
         perm_rr_dir = os.path.dirname(args.perm_rr_path)
         assert perm_rr_dir == '' or os.path.isdir(perm_rr_dir), \
             f'The outfile directory for RRs from permutations "{perm_rr_dir}" cannot be found.'
+        assert args.seed is None or args.seed >= 0, 'The seed must be a non-negative integer.'
 
 
-def run_burden_binom(cwas_cat_df: pd.DataFrame, sample_df: pd.DataFrame) -> pd.DataFrame:
+def run_burden_binom(cat_result: CatResult, sample_df: pd.DataFrame) -> pd.DataFrame:
     """ Function for burden tests via binomial tests
 
-    :param cwas_cat_df: A DataFrame that contains the result of CWAS categorization
+    :param cat_result: The result of CWAS categorization
     :param sample_df: A DataFrame listing sample IDs with their families and sample_types
     :return: A DataFrame that contains binomial p-values and other statistics for each CWAS category
     """
     # Count the number of de novo variants (DNV) for cases and controls
-    cwas_cat_vals = cwas_cat_df.values
+    cwas_cat_vals = cat_result.cnt_mat
     sample_info_dict = sample_df.to_dict()
-    sample_ids = cwas_cat_df.index.values
+    sample_ids = cat_result.sample_ids
     sample_types = np.vectorize(lambda sample_id: sample_info_dict['PHENOTYPE'][sample_id])(sample_ids)
     case_dnv_cnt, ctrl_dnv_cnt = cnt_case_ctrl_dnv(cwas_cat_vals, sample_types)
     dnv_cnt_arr = np.concatenate([case_dnv_cnt[:, np.newaxis], ctrl_dnv_cnt[:, np.newaxis]], axis=1)
 
     # Make a DataFrame for the results of binomial tests
     burden_df = \
-        pd.DataFrame(dnv_cnt_arr, index=cwas_cat_df.columns.values, columns=['Case_DNV_Count', 'Ctrl_DNV_Count'])
+        pd.DataFrame(dnv_cnt_arr, index=cat_result.cat_names, columns=['Case_DNV_Count', 'Ctrl_DNV_Count'])
     burden_df.index.name = 'Category'
     burden_df['Relative_Risk'] = case_dnv_cnt / ctrl_dnv_cnt
 
@@ -202,39 +206,44 @@ def run_burden_binom(cwas_cat_df: pd.DataFrame, sample_df: pd.DataFrame) -> pd.D
     return burden_df
 
 
-def run_burden_perm(cwas_cat_df: pd.DataFrame, sample_df: pd.DataFrame, num_perm: int, num_proc: int) \
-        -> (pd.DataFrame, pd.DataFrame):
+def run_burden_perm(cat_result: CatResult, sample_df: pd.DataFrame, num_perm: int, num_proc: int,
+                    seed: int = None) -> (pd.DataFrame, pd.DataFrame):
     """ Function for burden tests via permutation tests
 
-    :param cwas_cat_df: A DataFrame that contains the result of CWAS categorization
+    :param cat_result: The result of CWAS categorization
     :param sample_df: A DataFrame listing sample IDs with their families and sample_types
     :param num_perm: The number of label-swapping permutation trials
     :param num_proc: The number of processes used in this function (for multiprocessing)
+    :param seed: The seed of random number generators for the permutations
     :returns:
         1. A DataFrame that contains permutation p-values and other statistics for each CWAS category
         2. A DataFrame that contains relative risks for each category from each permutation trial
     """
-    # Arrays and a dictionary from the input DataFrames
-    cwas_cat_vals = cwas_cat_df.values
+    # Arrays and a dictionary from the inputs
+    cwas_cat_vals = cat_result.cnt_mat
     sample_info_dict = sample_df.to_dict()
-    sample_ids = cwas_cat_df.index.values
+    sample_ids = cat_result.sample_ids
     sample_types = np.vectorize(lambda sample_id: sample_info_dict['PHENOTYPE'][sample_id])(sample_ids)
     family_ids = np.vectorize(lambda sample_id: sample_info_dict['FAMILY'][sample_id])(sample_ids)
 
     # Calculate relative risks from label-swapping permutations
     if num_proc == 1:
-        perm_rr_list = cal_perm_rr(num_perm, cwas_cat_vals, sample_types, family_ids)
+        perm_rr_list = cal_perm_rr(range(num_perm), cwas_cat_vals, sample_types, family_ids, seed)
     else:
+        # Divide permutation indices into consecutive ranges for each process
         num_perms = div_dist_num(num_perm, num_proc)
+        perm_ends = np.cumsum(num_perms)
+        perm_ranges = [range(perm_end - n, perm_end) for perm_end, n in zip(perm_ends, num_perms)]
         pool = mp.Pool(num_proc)
         proc_outputs = \
             pool.map(
                 partial(cal_perm_rr,
                         sample_cat_vals=cwas_cat_vals,
                         sample_types=sample_types,
-                        family_ids=family_ids
+                        family_ids=family_ids,
+                        seed=seed,
                         ),
-                num_perms
+                perm_ranges
             )
         pool.close()
         pool.join()
@@ -255,7 +264,7 @@ def run_burden_perm(cwas_cat_df: pd.DataFrame, sample_df: pd.DataFrame, num_perm
     perm_p = ext_rr_cnt / num_perm
 
     # Return the results as a DataFrame
-    cwas_cats = cwas_cat_df.columns.values
+    cwas_cats = cat_result.cat_names
 
     burden_df = pd.concat([
         pd.Series(case_dnv_cnt, index=cwas_cats, name='Case_DNV_Count'),
@@ -272,24 +281,27 @@ def run_burden_perm(cwas_cat_df: pd.DataFrame, sample_df: pd.DataFrame, num_perm
     return burden_df, perm_rr_df
 
 
-def cnt_case_ctrl_dnv(sample_cat_vals: np.ndarray, sample_types: np.ndarray) -> (float, float):
+def cnt_case_ctrl_dnv(sample_cat_vals, sample_types: np.ndarray) -> (np.ndarray, np.ndarray):
     """ Count the number of the de novo variants for each phenotype, case and control.
+    The matrix of the sample values can be sparse and is summed without densifying it.
     """
     are_case = sample_types == 'case'
-    case_dnv_cnt = sample_cat_vals[are_case, :].sum(axis=0)
-    ctrl_dnv_cnt = sample_cat_vals[~are_case, :].sum(axis=0)
+    case_dnv_cnt = are_case @ sample_cat_vals
+    ctrl_dnv_cnt = ~are_case @ sample_cat_vals
 
     return case_dnv_cnt, ctrl_dnv_cnt
 
 
-def cal_perm_rr(num_perm: int, sample_cat_vals: np.ndarray, sample_types: np.ndarray, family_ids: np.ndarray) -> list:
+def cal_perm_rr(perm_ind: range, sample_cat_vals, sample_types: np.ndarray, family_ids: np.ndarray,
+                seed: int = None) -> list:
     """ Calculate relative risks of each category in each permutation trial.
-    The length of the returned list equals to the number of the permutations.
+    The length of the returned list equals to the number of the permutation indices.
+    Each permutation uses its own random stream determined by the seed and its index.
     """
     perm_rr_list = []
 
-    for _ in range(num_perm):
-        swap_sample_types = swap_label(sample_types, family_ids)
+    for perm_idx in perm_ind:
+        swap_sample_types = swap_label(sample_types, family_ids, make_rng(seed, perm_idx))
         case_dnv_cnt, ctrl_dnv_cnt = cnt_case_ctrl_dnv(sample_cat_vals, swap_sample_types)
         perm_rr = case_dnv_cnt / ctrl_dnv_cnt
         perm_rr_list.append(perm_rr[np.newaxis, :])
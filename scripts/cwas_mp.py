@@ -9,8 +9,12 @@ from glob import glob
 
 import yaml
 
+from cwas.vcf_writer import VcfWriter
 from utils import get_curr_time, execute_cmd
 
+SIM_TAG = 'CWAS_SIM'  # INFO key of the indices of input VCF files in a batch VCF file
+SIM_TAG_HEADER = f'##INFO=<ID={SIM_TAG},Number=1,Type=Integer,Description="Index of the input VCF file in the batch">\n'
+
 
 def main():
     print(__doc__)
@@ -38,10 +42,15 @@ def main():
         outfile_paths = [f'{args.out_dir}/{os.path.basename(in_vcf_path).replace(".vcf", ".annot.vcf")}'
                          for in_vcf_path in infile_paths]
 
-        for infile_path, outfile_path in zip(infile_paths, outfile_paths):
-            if args.force_overwrite or not os.path.isfile(outfile_path):
-                cmd = f'{cwas_script} -i {infile_path} -o {outfile_path} --vep {args.vep_script};'
-                cmds.append(cmd)
+        if args.batch_size > 0:
+            todo_paths = [(infile_path, outfile_path) for infile_path, outfile_path in zip(infile_paths, outfile_paths)
+                          if args.force_overwrite or not os.path.isfile(outfile_path)]
+            annotate_by_batch(cwas_script, todo_paths, args.out_dir, args.batch_size, args.vep_script, args.num_proc)
+        else:
+            for infile_path, outfile_path in zip(infile_paths, outfile_paths):
+                if args.force_overwrite or not os.path.isfile(outfile_path):
+                    cmd = f'{cwas_script} -i {infile_path} -o {outfile_path} --vep {args.vep_script};'
+                    cmds.append(cmd)
 
     elif args.step == 'categorize':
         infile_paths = sorted(glob(f'{args.in_dir}/*.vcf'))
@@ -81,6 +90,106 @@ def main():
     print(f'[{get_curr_time()}, Progress] Done')
 
 
+def annotate_by_batch(annot_script: str, todo_paths: list, out_dir: str, batch_size: int, vep_script: str,
+                      num_proc: int = 1):
+    """ Annotate the input VCF files in batches to pay the startup cost of VEP once per batch.
+    The VCF files of each batch are merged into one VCF file, which is annotated by one run of the annotation script
+    (with 'num_proc' VEP processes for its chunks), and the annotated variants are split into the output VCF files.
+
+    :param annot_script: Path of the annotation script (annotate.py)
+    :param todo_paths: List of tuples of the input and output VCF file paths
+    """
+    for batch_start in range(0, len(todo_paths), batch_size):
+        batch_paths = todo_paths[batch_start:batch_start + batch_size]
+        batch_idx = batch_start // batch_size
+        batch_vcf_path = os.path.join(out_dir, f'batch.{batch_idx:05d}.vcf')
+        batch_annot_vcf_path = os.path.join(out_dir, f'batch.{batch_idx:05d}.annot.vcf')
+        print(f'[{get_curr_time()}, Progress] Annotate a batch of {len(batch_paths):,d} VCF files '
+              f'({batch_idx + 1:,d}/{-(-len(todo_paths) // batch_size):,d})')
+
+        mux_vcf_files([in_vcf_path for in_vcf_path, _ in batch_paths], batch_vcf_path)
+        cmd = f'{annot_script} -i {batch_vcf_path} -o {batch_annot_vcf_path} --vep {vep_script} -p {num_proc}'
+        cmd += ' -s 1;' if num_proc > 1 else ';'
+        execute_cmd(cmd)
+        os.remove(batch_vcf_path)
+
+        if not os.path.isfile(batch_annot_vcf_path):
+            print(f'[{get_curr_time()}, WARNING] The annotation of the batch has failed so skip this batch.')
+            continue
+
+        demux_vcf_file(batch_annot_vcf_path, [out_vcf_path for _, out_vcf_path in batch_paths])
+        os.remove(batch_annot_vcf_path)
+
+
+def get_chrom_order(chrom: str) -> tuple:
+    """ Return a key to sort chromosome IDs in the natural order (chr1, chr2, ..., chr10, ..., chrX) """
+    chrom_num = chrom[3:] if chrom.startswith('chr') else chrom
+    return (0, int(chrom_num), '') if chrom_num.isdigit() else (1, 0, chrom_num)
+
+
+def mux_vcf_files(in_vcf_paths: list, out_vcf_path: str):
+    """ Merge the input VCF files into one VCF file sorted by the positions of variants.
+    The index of the input file of each variant is tagged in the INFO field (e.g. CWAS_SIM=0) for 'demux_vcf_file'.
+    The header lines are from the first input file with the INFO header line of the tag.
+    """
+    header_lines = []
+    var_records = []
+
+    for i, in_vcf_path in enumerate(in_vcf_paths):
+        with open(in_vcf_path) as in_vcf_file:
+            for line in in_vcf_file:
+                if line.startswith('#'):
+                    if i == 0:
+                        if line.startswith('#CHROM'):
+                            header_lines.append(SIM_TAG_HEADER)
+                        header_lines.append(line)
+                    continue
+
+                fields = line.rstrip('\n').split('\t')
+                fields[7] = f'{SIM_TAG}={i}' if fields[7] == '.' else f'{fields[7]};{SIM_TAG}={i}'
+                var_records.append((get_chrom_order(fields[0]), int(fields[1]), '\t'.join(fields)))
+
+    var_records.sort(key=lambda var_record: var_record[:2])
+
+    with VcfWriter(out_vcf_path) as out_vcf_file:
+        out_vcf_file.writelines(header_lines)
+
+        for _, _, line in var_records:
+            print(line, file=out_vcf_file)
+
+
+def demux_vcf_file(in_vcf_path: str, out_vcf_paths: list):
+    """ Split the annotated VCF file from 'mux_vcf_files' into the output VCF files by the tags of variants.
+    Every output file has all the header lines except the one of the tag and the tags are removed.
+    Each output file is written in a temporary file first and renamed at the end.
+    """
+    tmp_vcf_paths = [f'{out_vcf_path}.tmp' for out_vcf_path in out_vcf_paths]
+    out_vcf_files = [VcfWriter(tmp_vcf_path, buffer_size=1 << 16) for tmp_vcf_path in tmp_vcf_paths]
+    tag_prefix = f'{SIM_TAG}='
+
+    try:
+        with open(in_vcf_path) as in_vcf_file:
+            for line in in_vcf_file:
+                if line.startswith('#'):
+                    if line != SIM_TAG_HEADER:
+                        for out_vcf_file in out_vcf_files:
+                            out_vcf_file.write(line)
+                    continue
+
+                fields = line.rstrip('\n').split('\t')
+                infos = fields[7].split(';')
+                tag_idx = next(i for i, info in enumerate(infos) if info.startswith(tag_prefix))
+                file_idx = int(infos.pop(tag_idx)[len(tag_prefix):])
+                fields[7] = ';'.join(infos) if infos else '.'
+                out_vcf_files[file_idx].write_record(fields)
+    finally:
+        for out_vcf_file in out_vcf_files:
+            out_vcf_file.close()
+
+    for tmp_vcf_path, out_vcf_path in zip(tmp_vcf_paths, out_vcf_paths):
+        os.replace(tmp_vcf_path, out_vcf_path)
+
+
 def create_arg_parser() -> argparse.ArgumentParser:
     """ Create an argument parser for this script and return it """
     parser = argparse.ArgumentParser(description=__doc__)
@@ -119,6 +228,10 @@ def create_arg_parser() -> argparse.ArgumentParser:
     )
     parser_annot.add_argument('--vep', dest='vep_script', required=False, type=str,
                               help='Path of a Perl script to execute VEP (Default: vep (binary))', default='vep')
+    parser_annot.add_argument('-b', '--batch_size', dest='batch_size', required=False, type=int,
+                              help='Number of input VCF files annotated together by one run of VEP. '
+                                   'If it is 0, each input VCF file is annotated separately (Default: 0)',
+                              default=0)
     add_common_args(parser_annot)
 
     parser_cat = subparsers.add_parser(
@@ -153,6 +266,9 @@ def print_args(args: argparse.Namespace):
     if args.step == 'annotate':
         print(f'[Setting] VEP script: {args.vep_script}')
 
+        if args.batch_size > 0:
+            print(f'[Setting] No. VCF files in a batch for annotation: {args.batch_size:,d}')
+
 
 if __name__ == '__main__':
     main()
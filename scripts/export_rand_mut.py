@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+"""
+Export random mutations in a compact binary file (.npz) from simulate.py
+into sorted VCF files, one VCF file per simulation.
+"""
+import argparse
+import os
+
+import numpy as np
+
+import cwas.utils.error as error
+import cwas.utils.log as log
+from cwas.core.simulation import load_rand_mut_table, write_rand_mut_vcf
+
+
+def main():
+    # Print the script description
+    print(__doc__)
+
+    # Parse arguments
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '-i', '--infile', dest='in_npz_path', required=True, type=str,
+        help='Binary file listing random mutations from simulate.py (.npz)'
+    )
+    parser.add_argument(
+        '-o', '--out_dir', dest='out_dir', required=False, type=str,
+        help='Directory of output VCFs (Default: ./random-mutation)',
+        default='random-mutation'
+    )
+    parser.add_argument(
+        '-t', '--out_tag', dest='out_tag', required=False, type=str,
+        help='Prefix of output files (Default: rand_mut)', default='rand_mut'
+    )
+    parser.add_argument(
+        '-n', '--sim', dest='sim_ind', required=False, type=int, nargs='+',
+        help='Indices of simulations to export (Default: All)', default=None
+    )
+    parser.add_argument(
+        '-z', '--bgzip', dest='bgzip', required=False, type=int,
+        choices={0, 1}, default=1,
+        help='Compress output VCFs via bgzip and index them via tabix '
+             '(Default: 1)'
+    )
+    args = parser.parse_args()
+    log.print_arg('Input file', args.in_npz_path)
+    log.print_arg('Output directory', args.out_dir)
+    log.print_arg('Output tag (prefix of output files)', args.out_tag)
+    log.print_arg('Simulations to export',
+                  'All' if args.sim_ind is None else args.sim_ind)
+    log.print_arg('Compress and index output VCFs', bool(args.bgzip))
+    error.check_is_file(args.in_npz_path)
+
+    # Export
+    log.print_progress('Load the random mutations')
+    rand_mut_df, chroms, sample_ids = load_rand_mut_table(args.in_npz_path)
+    sims = rand_mut_df['SIM'].values
+    sim_ind = np.unique(sims) if args.sim_ind is None else args.sim_ind
+    os.makedirs(args.out_dir, exist_ok=True)
+
+    for sim_idx in sim_ind:
+        sim_rand_mut_df = rand_mut_df[sims == sim_idx]
+
+        if len(sim_rand_mut_df.index) == 0:
+            log.print_warn(f'There is no simulation with the index {sim_idx}.')
+            continue
+
+        out_vcf_path = os.path.join(args.out_dir,
+                                    f'{args.out_tag}.{sim_idx:05d}.vcf')
+        if args.bgzip:  # Compressed and indexed by the VCF writer
+            out_vcf_path += '.gz'
+
+        log.print_progress(f'Write "{out_vcf_path}"')
+        write_rand_mut_vcf(out_vcf_path, sim_rand_mut_df, chroms, sample_ids)
+
+    log.print_progress('Done')
+
+
+if __name__ == '__main__':
+    main()
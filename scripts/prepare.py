@@ -5,13 +5,19 @@ Script for data preparation for category-wide association study (CWAS)
 import argparse
 import multiprocessing as mp
 import os
-from collections import defaultdict
 from functools import partial
 
 import numpy as np
 import pysam
 import yaml
 
+from cwas.core.af_table import has_af_table, make_af_table
+from cwas.core.bed_annotation import is_annot_index, write_annot_index
+from cwas.core.base_index import get_non_n_interval_path, has_base_index, \
+    make_base_index
+from cwas.core.context_index import has_context_index, make_context_index
+from cwas.core.mask import read_mask_regions, write_masked_fasta
+from cwas.fastafile import FastaFile
 from utils import get_curr_time, execute_cmd, bgzip_tabix
 
 
@@ -74,12 +80,13 @@ def main():
         )
 
         chroms = [f'chr{n}' for n in range(1, 23)]
+        mask_regions = read_mask_regions(target_filepath_dict['mask_region'])
         if args.num_proc == 1:
             for chrom in chroms:
                 mask_fasta(
                     ori_filepath_dict[chrom],
                     target_filepath_dict[chrom],
-                    target_filepath_dict['mask_region'],
+                    mask_regions,
                     args.force_overwrite
                 )
         else:
@@ -87,7 +94,7 @@ def main():
             pool.starmap(
                 partial(
                     mask_fasta,
-                    mask_region_path=target_filepath_dict['mask_region'],
+                    mask_regions=mask_regions,
                     force_overwrite=args.force_overwrite
                 ),
                 [(ori_filepath_dict[chrom], target_filepath_dict[chrom])
@@ -98,10 +105,21 @@ def main():
 
         chr_fa_paths = [target_filepath_dict[chrom] for chrom in chroms]
         create_chrom_size_list(
+            chroms,
             chr_fa_paths,
             target_filepath_dict['chrom_size'],
+            target_filepath_dict['base_index'],
+            args.num_proc,
             args.force_overwrite
         )
+        if args.context_index:
+            create_context_index(
+                chroms,
+                chr_fa_paths,
+                target_filepath_dict['context_index'],
+                args.num_proc,
+                args.force_overwrite
+            )
 
     elif args.step == 'annotation':
         print(f'[{get_curr_time()}, Progress] '
@@ -135,6 +153,20 @@ def main():
         merge_annot(merge_bed_path, annot_bed_path_dict, args.num_proc,
                     args.force_overwrite)
 
+        # Compile the merged BED file into a binary annotation index
+        annot_index_path = os.path.join(annot_dir, 'merged_annotation.idx')
+        create_annot_index(merge_bed_path + '.gz', annot_index_path,
+                           args.force_overwrite)
+
+        # Compile the gnomAD VCF file into a table of allele frequencies
+        create_af_table(
+            [f'chr{n}' for n in range(1, 23)],
+            ori_filepath_dict['gnomADg'],
+            target_filepath_dict['af_table'],
+            args.num_proc,
+            args.force_overwrite
+        )
+
     print(f'[{get_curr_time()}, Progress] Done')
 
 
@@ -167,6 +199,12 @@ def create_arg_parser() -> argparse.ArgumentParser:
              '(arg "simulate -h" for usage)'
     )
     add_common_args(parser_sim)
+    parser_sim.add_argument(
+        '-c', '--context_index', dest='context_index',
+        action='store_const', const=1, default=0,
+        help='Create position arrays of each trinucleotide context '
+             'for the context-aware mutation model of simulate.py'
+    )
 
     parser_annot = subparsers.add_parser(
         'annotation',
@@ -181,6 +219,9 @@ def create_arg_parser() -> argparse.ArgumentParser:
 def print_args(args: argparse.Namespace):
     print(f'[Setting] Step to be prepared: {args.step}')
     print(f'[Setting] No. Processes for this script: {args.num_proc}')
+    if args.step == 'simulation':
+        print(f'[Setting] Create position arrays of each trinucleotide '
+              f'context: {bool(args.context_index)}')
 
 
 def check_args_validity(args: argparse.Namespace):
@@ -223,10 +264,10 @@ def make_mask_region(lcr_path: str, sort_gap_path: str, mask_region_path: str,
         execute_cmd(cmd)
 
 
-def mask_fasta(in_fa_path: str, out_fa_path: str, mask_region_path: str,
+def mask_fasta(in_fa_path: str, out_fa_path: str, mask_regions: dict,
                force_overwrite: int = 0):
     """ Mask regions of the input FASTA file
-    and save the result as a new FASTA file
+    and save the result as a new FASTA file with its index
     """
     if not force_overwrite and os.path.isfile(out_fa_path):
         print(f'[{get_curr_time()}, Progress] '
@@ -235,55 +276,54 @@ def mask_fasta(in_fa_path: str, out_fa_path: str, mask_region_path: str,
     else:
         print(f'[{get_curr_time()}, Progress] '
               f'Mask the fasta file "{in_fa_path}" and index the output')
-        if in_fa_path.endswith('.gz'):
-            cmd = f'gunzip {in_fa_path};'
-            in_fa_path = in_fa_path.replace('.gz', '')
-        else:
-            cmd = ''
-
-        cmd += \
-            f'maskFastaFromBed -fi {in_fa_path} -fo {out_fa_path} ' \
-            f'-bed {mask_region_path};'
-        cmd += f'samtools faidx {out_fa_path};'
-        execute_cmd(cmd)
+        write_masked_fasta(in_fa_path, out_fa_path, mask_regions)
 
 
-def create_chrom_size_list(chr_fa_paths: list, out_txt_path: str,
-                           force_overwrite: int = 0):
+def create_chrom_size_list(chroms: list, chr_fa_paths: list,
+                           out_txt_path: str, index_dir: str,
+                           num_proc: int = 1, force_overwrite: int = 0):
     """ Create a txt file listing the sizes total, mapped, AT/GC,
-    and effective sizes of each chromosome
+    and effective sizes of each chromosome. The bases are counted while
+    creating uint32 arrays listing positions of each reference base
+    (A, C, G, and T) and intervals without 'N' of each masked chromosome,
+    so the genome is scanned only once for both outputs.
     """
-    if not force_overwrite and os.path.isfile(out_txt_path):
+    if not force_overwrite and os.path.isfile(out_txt_path) and \
+            has_base_index(index_dir, chroms) and \
+            all(os.path.isfile(get_non_n_interval_path(index_dir, chrom))
+                for chrom in chroms):
         print(f'[{get_curr_time()}, Progress] '
               f'A file listing total, mapped, AT/GC, and effective sizes '
-              f'already exists so skip this step')
+              f'and position arrays of each reference base '
+              f'already exist so skip this step')
     else:
         print(f'[{get_curr_time()}, Progress] '
               f'Create a file listing total, mapped, AT/GC, '
-              f'and effective sizes of each chromosome')
+              f'and effective sizes of each chromosome '
+              f'and position arrays of each reference base')
+        if num_proc == 1:
+            base_cnt_dicts = [
+                make_base_index(chr_fa_path, chrom, index_dir)
+                for chrom, chr_fa_path in zip(chroms, chr_fa_paths)
+            ]
+        else:
+            pool = mp.Pool(num_proc)
+            base_cnt_dicts = pool.starmap(
+                partial(make_base_index, index_dir=index_dir),
+                [(chr_fa_path, chrom)
+                 for chrom, chr_fa_path in zip(chroms, chr_fa_paths)],
+            )
+            pool.close()
+            pool.join()
+
         with open(out_txt_path, 'w') as outfile:
             print('Chrom', 'Size', 'Mapped', 'AT', 'GC', 'Effective',
                   sep='\t', file=outfile)
 
-            for chr_fa_path in chr_fa_paths:
-                print(f'[{get_curr_time()}, Progress] '
-                      f'Write sizes of "{chr_fa_path}"')
-                fa_idx_path = chr_fa_path + '.fai'
-
-                with open(fa_idx_path) as fa_idx_file:
-                    line = fa_idx_file.read()
-                    fields = line.split('\t')
-                    chrom = fields[0]
-                    chrom_size = int(fields[1])
-                    base_start_idx = int(fields[2])
-
-                with open(chr_fa_path, 'r') as mask_fa_file:
-                    base_cnt_dict = defaultdict(int)
-                    mask_fa_file.seek(base_start_idx)
-                    seq = mask_fa_file.read()
-
-                    for base in seq:
-                        base_cnt_dict[base.upper()] += 1
+            for chrom, chr_fa_path, base_cnt_dict in \
+                    zip(chroms, chr_fa_paths, base_cnt_dicts):
+                with FastaFile(chr_fa_path) as fasta_file:
+                    chrom_size = fasta_file.get_size(chrom)
 
                 map_size = chrom_size - base_cnt_dict['N']
                 at_size = base_cnt_dict['A'] + base_cnt_dict['T']
@@ -293,6 +333,33 @@ def create_chrom_size_list(chr_fa_paths: list, out_txt_path: str,
                       effect_size, sep='\t', file=outfile)
 
 
+def create_context_index(chroms: list, chr_fa_paths: list, index_dir: str,
+                         num_proc: int = 1, force_overwrite: int = 0):
+    """ Create uint32 arrays listing positions of each strand-collapsed
+    trinucleotide context (32 contexts) of each masked chromosome
+    """
+    if not force_overwrite and has_context_index(index_dir, chroms):
+        print(f'[{get_curr_time()}, Progress] '
+              f'Position arrays of each trinucleotide context already exist '
+              f'so skip this step')
+    else:
+        print(f'[{get_curr_time()}, Progress] '
+              f'Create position arrays of each trinucleotide context '
+              f'of each chromosome')
+        if num_proc == 1:
+            for chrom, chr_fa_path in zip(chroms, chr_fa_paths):
+                make_context_index(chr_fa_path, chrom, index_dir)
+        else:
+            pool = mp.Pool(num_proc)
+            pool.starmap(
+                partial(make_context_index, index_dir=index_dir),
+                [(chr_fa_path, chrom)
+                 for chrom, chr_fa_path in zip(chroms, chr_fa_paths)],
+            )
+            pool.close()
+            pool.join()
+
+
 def filt_yale_bed(in_bed_path: str, out_bed_path: str,
                   force_overwrite: int = 0):
     """ Filter entries of a BED file from Yale (PsychENCODE Consortium) and
@@ -460,6 +527,54 @@ def merge_annot_by_chrom(chrom: str, out_bed_path: str, bed_path_dict: dict):
             prev_pos = pos
 
 
+def create_annot_index(annot_bed_path: str, index_path: str,
+                       force_overwrite: int = 0):
+    """ Create a binary index of the annotation-merged BED file, which lists
+    breakpoints and annotation integers of each chromosome for annotate.py
+    """
+    if not force_overwrite and is_annot_index(index_path):
+        print(f'[{get_curr_time()}, Progress] '
+              f'An annotation index already exists so skip this step')
+    else:
+        print(f'[{get_curr_time()}, Progress] '
+              f'Create an annotation index from the annotation-merged '
+              f'BED file')
+        try:
+            write_annot_index(annot_bed_path, index_path)
+        except ValueError as e:
+            print(f'[{get_curr_time()}, Warning] {e} '
+                  f'The BED file will be used for annotation.')
+
+
+def create_af_table(chroms: list, vcf_path: str, table_dir: str,
+                    num_proc: int = 1, force_overwrite: int = 0):
+    """ Create arrays listing positions, allele hashes, and allele frequencies
+    of the alternative alleles of each chromosome in the gnomAD VCF file
+    for annotate.py
+    """
+    if not force_overwrite and has_af_table(table_dir, chroms):
+        print(f'[{get_curr_time()}, Progress] '
+              f'An AF table already exists so skip this step')
+    elif not os.path.isfile(vcf_path):
+        print(f'[{get_curr_time()}, Warning] '
+              f'The gnomAD VCF file "{vcf_path}" cannot be found '
+              f'so skip making an AF table.')
+    else:
+        print(f'[{get_curr_time()}, Progress] '
+              f'Create an AF table from the gnomAD VCF file')
+        if num_proc == 1:
+            for chrom in chroms:
+                make_af_table(vcf_path, chrom, table_dir)
+        else:
+            pool = mp.Pool(num_proc)
+            pool.starmap(
+                partial(make_af_table, vcf_path, table_dir=table_dir),
+                [(chrom,) for chrom in chroms],
+            )
+            pool.close()
+            pool.join()
+
+
 def one_hot_to_int(one_hot: np.ndarray) -> int:
     n = 0
 
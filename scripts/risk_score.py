@@ -16,7 +16,14 @@ import yaml
 from glmnet import ElasticNet
 from scipy import stats
 
-from utils import cmp_two_arr, get_curr_time, swap_label, div_dist_num
+from cwas.core.cat_result import CatResult
+from cwas.core.common import make_rng, swap_label
+from utils import cmp_two_arr, get_curr_time, div_dist_num
+
+# IDs of random streams for each task (Streams are derived from the seed and these IDs.)
+_TRAIN_SET_STREAM_ID = 0
+_REGRESSION_STREAM_ID = 1
+_PERMUTATION_STREAM_ID = 2
 
 
 def main():
@@ -39,8 +46,8 @@ def main():
 
     # Print the script description
     # Load and parse the input data
-    print(f'[{get_curr_time()}, Progress] Parse the categorization result into DataFrame')
-    cwas_cat_df = pd.read_table(args.cat_result_path, index_col='SAMPLE')
+    print(f'[{get_curr_time()}, Progress] Load the categorization result')
+    cat_result = CatResult.read(args.cat_result_path)
 
     # Filter the columns (categories)
     if args.cat_group != 'all':
@@ -54,27 +61,28 @@ def main():
         for annot_group in cat_filt_dict:
             cat_filt_dict[annot_group] = set(cat_filt_dict[annot_group])
 
-        cwas_cat_df = filter_categories(cwas_cat_df, cat_filt_dict)
+        cat_result = filter_categories(cat_result, cat_filt_dict)
 
     # Load and parse the file listing sample IDs
     print(f'[{get_curr_time()}, Progress] Parse the file listing sample IDs')
     sample_df = pd.read_table(args.sample_file_path, index_col='SAMPLE')
-    assert cmp_two_arr(cwas_cat_df.index.values, sample_df.index.values), \
-        f'The samples IDs of the categorization result are not the same ' \
-        f'with the sample IDs of the file listing samples.'
+    assert cmp_two_arr(cat_result.sample_ids, sample_df.index.values), \
+        'The samples IDs of the categorization result are not the same ' \
+        'with the sample IDs of the file listing samples.'
 
     # Adjust No. DNVs of each sample in the categorization result
     if args.adj_file_path:
         print(f'[{get_curr_time()}, Progress] Adjust No. DNVs of each sample in the categorization result')
         adj_factor_df = pd.read_table(args.adj_file_path, index_col='SAMPLE')
         assert cmp_two_arr(adj_factor_df.index.values, sample_df.index.values), \
-            f'The samples IDs of the categorization result are not the same ' \
-            f'with the sample IDs of the file listing samples.'
-        cwas_cat_df = adjust_cat_df(cwas_cat_df, adj_factor_df)
-
-    # Arrays and dictionary from the DataFrame (in order to improving performance)
-    cwas_cat_vals = cwas_cat_df.values
-    sample_ids = cwas_cat_df.index.values
+            'The samples IDs of the categorization result are not the same ' \
+            'with the sample IDs of the file listing samples.'
+        cat_result = adjust_cat_result(cat_result, adj_factor_df)
+
+    # Arrays and dictionary from the result (in order to improving performance)
+    # The sparse matrix is not densified and is also the input of the lasso regression.
+    cwas_cat_vals = cat_result.cnt_mat
+    sample_ids = cat_result.sample_ids
     sample_info_dict = sample_df.to_dict()
     sample_types = np.vectorize(lambda sample_id: sample_info_dict['PHENOTYPE'][sample_id])(sample_ids)
     sample_responses = np.vectorize(lambda sample_type: 1.0 if sample_type == 'case' else -1.0)(sample_types)
@@ -88,7 +96,8 @@ def main():
 
     # Determine a training set
     print(f'[{get_curr_time()}, Progress] Divide the samples into training and test set')
-    is_train_set = determine_train_set(sample_ids, sample_families, args.train_set_f)
+    is_train_set = determine_train_set(sample_ids, sample_families, args.train_set_f,
+                                       make_rng(args.seed, _TRAIN_SET_STREAM_ID))
 
     # Train and test a lasso model multiple times
     print(f'[{get_curr_time()}, Progress] Train and test a lasso model to generate de novo risk scores')
@@ -96,10 +105,10 @@ def main():
     coeffs = []
     rsqs = []
 
-    for _ in range(args.num_reg):
+    for reg_idx in range(args.num_reg):
         coeff, rsq = \
             lasso_regression(rare_cat_vals, sample_responses, sample_families, is_train_set,
-                             args.num_cv_fold, num_parallel)
+                             args.num_cv_fold, num_parallel, make_rng(args.seed, _REGRESSION_STREAM_ID, reg_idx))
         coeffs.append(coeff)
         rsqs.append(rsq)
 
@@ -109,7 +118,7 @@ def main():
         # Generate R squares from permutations
         print(f'[{get_curr_time()}, Progress] Generate R squares from permutations')
         perm_rsqs = get_perm_rsq(args.num_perm, cwas_cat_vals, sample_types, sample_families, is_train_set,
-                                 args.rare_cat_cutoff, args.num_cv_fold, num_parallel)
+                                 args.rare_cat_cutoff, args.num_cv_fold, num_parallel, args.seed)
 
         # Estimate a null distribution of R squares and do permutation tests
         print(f'[{get_curr_time()}, Progress] Permutation tests')
@@ -125,7 +134,7 @@ def main():
     num_select = np.sum(np.vectorize(lambda w: w != 0)(coeffs), axis=0)
     m_coeff = np.sum(coeffs, axis=0) / num_select
     is_select_coeff = num_select > int(args.num_reg * 0.5)
-    select_cats = cwas_cat_df.columns.values[is_rare_cat][is_select_coeff]
+    select_cats = cat_result.cat_names[is_rare_cat][is_select_coeff]
     cat_case_dnv_cnt = case_dnv_cnt[is_rare_cat][is_select_coeff]
     cat_ctrl_dnv_cnt = ctrl_dnv_cnt[is_rare_cat][is_select_coeff]
     select_m_coeff = m_coeff[is_select_coeff]
@@ -183,6 +192,9 @@ def create_arg_parser() -> argparse.ArgumentParser:
                         help='Do permutation tests to get a p-value for the R square (Default: 0 (False))', default=0)
     parser.add_argument('--num_perm', dest='num_perm', required=False, type=int,
                         help='No. label-swapping permutations for permutation tests (Default: 1,000)', default=1000)
+    parser.add_argument('--seed', dest='seed', required=False, type=int,
+                        help='Seed of random number generators. The results are the same regardless of '
+                             'the number of processes. (Default: None (random))', default=None)
     return parser
 
 
@@ -199,10 +211,11 @@ def print_args(args: argparse.Namespace):
     print(f'[Setting] No. cross-validation folds: {args.num_cv_fold:,d}')
     print(f'[Setting] Use multiprocessing for the cross-validation: {bool(args.use_parallel)}')
     if args.do_test:
-        print(f'[Setting] Do the significance test (permutaion test)')
+        print('[Setting] Do the significance test (permutaion test)')
         print(f'[Setting] No. label-swapping permutations: {args.num_perm:,d}')
     else:
-        print(f'[Setting] Skip the significance test')
+        print('[Setting] Skip the significance test')
+    print(f'[Setting] Seed of random number generators: {args.seed}')
 
 
 def check_args_validity(args: argparse.Namespace):
@@ -212,19 +225,20 @@ def check_args_validity(args: argparse.Namespace):
         f'The input file "{args.adj_file_path}" cannot be found.'
     outfile_dir = os.path.dirname(args.outfile_path)
     assert outfile_dir == '' or os.path.isdir(outfile_dir), f'The outfile directory "{outfile_dir}" cannot be found.'
-    assert 0 < args.train_set_f < 1, f'The fraction of the training set must be in a range (0, 1).'
+    assert 0 < args.train_set_f < 1, 'The fraction of the training set must be in a range (0, 1).'
+    assert args.seed is None or args.seed >= 0, 'The seed must be a non-negative integer.'
 
 
-def filter_categories(cwas_cat_df: pd.DataFrame, cat_filt_dict: dict) -> pd.DataFrame:
-    """ Filter columns (categories) of a DataFrame for the CWAS categorization result
+def filter_categories(cat_result: CatResult, cat_filt_dict: dict) -> CatResult:
+    """ Filter columns (categories) of the CWAS categorization result
     and leave specific columns according to the input dictionary
 
-    :param cwas_cat_df: A DataFrame that contains the CWAS categorization result
+    :param cat_result: The CWAS categorization result
     :param cat_filt_dict: A dictionary which key and value are a group name of annotation terms and
                           the group's annotation terms that must be included in categories, respectively
-    :return: A filtered DataFrame
+    :return: The filtered result
     """
-    categories = cwas_cat_df.columns.values
+    categories = cat_result.cat_names
     var_type_annot_set = cat_filt_dict.get('var_type')
     gene_list_annot_set = cat_filt_dict.get('gene_list')
     cons_annot_set = cat_filt_dict.get('cons')
@@ -240,49 +254,46 @@ def filter_categories(cwas_cat_df: pd.DataFrame, cat_filt_dict: dict) -> pd.Data
                (region_annot_set is None or region in region_annot_set)
 
     is_passed = np.vectorize(is_passed_category)(categories)
-    return cwas_cat_df.loc[:, is_passed]
+    return cat_result.select_categories(is_passed)
 
 
-def adjust_cat_df(cwas_cat_df: pd.DataFrame, adj_factor_df: pd.DataFrame) -> pd.DataFrame:
-    """ Adjust No. DNVs of each sample in a DataFrame for the result of CWAS categorization
+def adjust_cat_result(cat_result: CatResult, adj_factor_df: pd.DataFrame) -> CatResult:
+    """ Adjust No. DNVs of each sample in the result of CWAS categorization
     by adjustment factors for each sample
 
-    :param cwas_cat_df: A DataFrame that contains the CWAS categorization result
+    :param cat_result: The CWAS categorization result
     :param adj_factor_df: A DataFrame that contains a list of adjustment factors for each sample
-    :return: A DataFrame that contains the CWAS categorization result with adjusted No. DNVs
+    :return: The CWAS categorization result with adjusted No. DNVs
     """
     # Reorder the adjustment factors
-    sample_ids = cwas_cat_df.index.values
     adj_factor_dict = adj_factor_df.to_dict()['AdjustFactor']
-    adj_factors = [adj_factor_dict[sample_id] for sample_id in sample_ids]
+    adj_factors = [adj_factor_dict[sample_id] for sample_id in cat_result.sample_ids]
 
     # Adjust the number of de novo variants of each sample by adjustment factors
-    cwas_cat_df = cwas_cat_df.multiply(adj_factors, axis='index')
-    cwas_cat_df.index.name = 'SampleID'
+    return cat_result.adjust(adj_factors)
 
-    return cwas_cat_df
 
-
-def cnt_case_ctrl_dnv(sample_cat_vals: np.ndarray, sample_types: np.ndarray) -> (float, float):
+def cnt_case_ctrl_dnv(sample_cat_vals, sample_types: np.ndarray) -> (np.ndarray, np.ndarray):
     """ Count the number of the de novo variants for each phenotype, case and control.
+    The matrix of the sample values can be sparse and is summed without densifying it.
     """
     are_case = sample_types == 'case'
-    case_dnv_cnt = sample_cat_vals[are_case, :].sum(axis=0)
-    ctrl_dnv_cnt = sample_cat_vals[~are_case, :].sum(axis=0)
+    case_dnv_cnt = are_case @ sample_cat_vals
+    ctrl_dnv_cnt = ~are_case @ sample_cat_vals
 
     return case_dnv_cnt, ctrl_dnv_cnt
 
 
-def determine_train_set(samples, sample_groups, frac, random_seed=None):
+def determine_train_set(samples, sample_groups, frac, rng: np.random.Generator = None):
     """ Randomly determine a train set from the samples
     """
     uniq_groups = np.unique(sample_groups)
     n_train_group = int(np.rint(len(uniq_groups) * frac))
 
-    if random_seed is not None:
-        np.random.seed(random_seed)
+    if rng is None:
+        rng = make_rng()
 
-    train_group_set = set(np.random.choice(uniq_groups, size=n_train_group, replace=False))
+    train_group_set = set(rng.choice(uniq_groups, size=n_train_group, replace=False))
     is_train_set = np.full(len(samples), False)
 
     for i in range(len(samples)):
@@ -293,10 +304,15 @@ def determine_train_set(samples, sample_groups, frac, random_seed=None):
     return is_train_set
 
 
-def lasso_regression(sample_covariates: np.ndarray, sample_responses: np.ndarray, sample_families: np.ndarray,
-                     is_train_set: np.ndarray, num_cv_fold: int, num_parallel: int, random_state: int = None) \
-        -> (np.ndarray, float):
-    """ Lasso regression to generate a de novo risk score """
+def lasso_regression(sample_covariates, sample_responses: np.ndarray, sample_families: np.ndarray,
+                     is_train_set: np.ndarray, num_cv_fold: int, num_parallel: int,
+                     rng: np.random.Generator = None) -> (np.ndarray, float):
+    """ Lasso regression to generate a de novo risk score
+    (The covariates can be a sparse matrix, which glmnet takes as it is.)
+    """
+    if rng is None:
+        rng = make_rng()
+
     # Divide the input data into a train and a test set
     train_covariates = sample_covariates[is_train_set]
     train_responses = sample_responses[is_train_set]
@@ -305,12 +321,12 @@ def lasso_regression(sample_covariates: np.ndarray, sample_responses: np.ndarray
     test_responses = sample_responses[~is_train_set]
 
     # Allocate fold IDs for cross-validation
-    family_to_fold_id = make_equal_groups(np.unique(sample_families), num_cv_fold)
+    family_to_fold_id = make_equal_groups(np.unique(sample_families), num_cv_fold, rng)
     train_fold_ids = np.vectorize(lambda family_id: family_to_fold_id[family_id])(train_families)
 
     # Train Lasso model
     lasso_model = ElasticNet(alpha=1, n_lambda=100, standardize=True, n_splits=num_cv_fold, n_jobs=num_parallel,
-                             scoring='mean_squared_error', random_state=random_state)
+                             scoring='mean_squared_error', random_state=int(rng.integers(2 ** 31)))
     lasso_model.fit(train_covariates, train_responses, train_fold_ids)
     opt_model_idx = np.argmax(getattr(lasso_model, 'cv_mean_score_'))
     coeffs = getattr(lasso_model, 'coef_path_')
@@ -325,14 +341,18 @@ def lasso_regression(sample_covariates: np.ndarray, sample_responses: np.ndarray
     return opt_coeff, rsq
 
 
-def make_equal_groups(items: np.ndarray, n_group: int) -> dict:
+def make_equal_groups(items: np.ndarray, n_group: int, rng: np.random.Generator = None) -> dict:
     """ Randomly allocate group IDs to each sample and make groups with equal or similar sizes.
     This function returns a dictionary which key and value are an item and its group ID, respectively.
     """
     item_size = len(items)
     item_to_group_id = {}
     sizes_per_group = div_dist_num(item_size, n_group)
-    perm_items = np.random.permutation(items)
+
+    if rng is None:
+        rng = make_rng()
+
+    perm_items = rng.permutation(items)
     start_idx = 0
 
     for group_id in range(n_group):
@@ -346,16 +366,20 @@ def make_equal_groups(items: np.ndarray, n_group: int) -> dict:
     return item_to_group_id
 
 
-def get_perm_rsq(num_perm: int, sample_cat_vals: np.ndarray, sample_types: np.ndarray, sample_families: np.ndarray,
-                 is_train_set: np.ndarray, rare_cat_cutoff: int, num_cv_fold: int, num_parallel: int) -> list:
+def get_perm_rsq(num_perm: int, sample_cat_vals, sample_types: np.ndarray, sample_families: np.ndarray,
+                 is_train_set: np.ndarray, rare_cat_cutoff: int, num_cv_fold: int, num_parallel: int,
+                 seed: int = None) -> list:
     """ Get R squares of the lasso regression after each label swapping trial.
     The length of the returned list equals to the number of the permutations.
+    Each permutation uses its own random stream determined by the seed and its index.
     """
     perm_rsqs = []
 
-    for _ in range(num_perm):
+    for perm_idx in range(num_perm):
+        rng = make_rng(seed, _PERMUTATION_STREAM_ID, perm_idx)
+
         # Label swapping
-        swap_sample_types = swap_label(sample_types, sample_families)
+        swap_sample_types = swap_label(sample_types, sample_families, rng)
         swap_responses = np.vectorize(lambda sample_type: 1.0 if sample_type == 'case' else -1.0)(swap_sample_types)
 
         # Filter categories and leave only rare categories (few variants in controls)
@@ -364,7 +388,7 @@ def get_perm_rsq(num_perm: int, sample_cat_vals: np.ndarray, sample_types: np.nd
         rare_cat_vals = sample_cat_vals[:, is_rare_cat]
 
         _, rsq = lasso_regression(rare_cat_vals, swap_responses, sample_families, is_train_set,
-                                  num_cv_fold, num_parallel)
+                                  num_cv_fold, num_parallel, rng)
         perm_rsqs.append(rsq)
 
     return perm_rsqs
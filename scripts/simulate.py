@@ -7,16 +7,25 @@ For more detailed information, please refer to An et al., 2018 (PMID 30545852).
 
 """
 import argparse
+import glob
 import multiprocessing as mp
 import os
-from functools import partial
 
 import numpy as np
 import pandas as pd
 import yaml
 
-from fastafile import FastaFile
-from utils import get_curr_time, div_list
+from cwas.core.base_index import has_base_index, load_base_index
+from cwas.core.common import make_rng
+from cwas.core.context_index import has_context_index, load_context_index, load_context_mut_rates
+from cwas.core.rate_map import WindowRateMap, load_window_rate_map
+from cwas.core.simulation import append_sim_manifest, get_file_md5, make_rand_mut_table, read_sim_manifests, \
+    save_rand_mut_table, write_rand_mut_vcf
+from cwas.fastafile import FastaFile
+from utils import get_curr_time
+
+# Data used by each process of the pool to generate random mutations (Set by 'init_rand_mut_worker')
+_rand_mut_worker_data = {}
 
 
 def main():
@@ -63,6 +72,33 @@ def create_arg_parser() -> argparse.ArgumentParser:
     parser.add_argument('-p', '--num_proc', dest='num_proc', required=False, type=int,
                         help='Number of processes for this script (only necessary for split VCF files) '
                              '(Default: 1)', default=1)
+    parser.add_argument('--seed', dest='seed', required=False, type=int,
+                        help='Seed of random number generators. Each simulation uses its own random stream '
+                             'derived from this seed and its simulation index, so outputs are the same '
+                             'regardless of the number of processes. (Default: None (random))', default=None)
+    parser.add_argument('-f', '--out_format', dest='out_format', required=False, type=str, choices=['vcf', 'npz'],
+                        help='Format of outputs. "vcf" makes one VCF file per simulation. "npz" makes one compact '
+                             'binary file per batch of simulations, which can be exported to VCF files '
+                             'by export_rand_mut.py. (Default: vcf)', default='vcf')
+    parser.add_argument('-b', '--batch_size', dest='batch_size', required=False, type=int,
+                        help='Number of simulations in one output file (only for the "npz" format) (Default: 100)',
+                        default=100)
+    parser.add_argument('-r', '--context_rate', dest='context_rate_path', required=False, type=str,
+                        help='File listing mutation rates of each trinucleotide context (CONTEXT, ALT and RATE '
+                             'columns). If it is given, substitutions follow this trinucleotide context mutation '
+                             'model instead of the default mutation spectrum (Lynch 2010). Run the "prepare" step '
+                             'with --context_index first. (Default: None)', default=None)
+    parser.add_argument('-w', '--rate_map', dest='rate_map_path', required=False, type=str,
+                        help='BED file listing genomic windows (e.g. 1 kb) with their mutation rates per base '
+                             '(chrom, start, end, rate). If it is given, sites are drawn from the windows in proportion '
+                             'to (rate) * (window size) instead of the effective sizes of chromosomes. '
+                             'Its alias table is cached as "{BED path}.alias.npz". (Default: None)', default=None)
+    parser.add_argument('--sim_start', dest='sim_start', required=False, type=int,
+                        help='Index of the first simulation of this run. Disjoint ranges of simulations can be '
+                             'generated by several runs (e.g. on different nodes) into the same output directory. '
+                             '(Default: 1)', default=1)
+    parser.add_argument('--sim_end', dest='sim_end', required=False, type=int,
+                        help='Index of the last simulation of this run (Default: --num_sim)', default=None)
 
     return parser
 
@@ -73,7 +109,15 @@ def print_args(args: argparse.Namespace):
     print(f'[Setting] Output directory: {args.out_dir}')
     print(f'[Setting] Output tag (prefix of output files): {args.out_tag}')
     print(f'[Setting] Number of simulations: {args.num_sim}')
+    print(f'[Setting] Range of simulations of this run: '
+          f'[{args.sim_start}, {args.num_sim if args.sim_end is None else args.sim_end}]')
     print(f'[Setting] Number of processes for multiprocessing: {args.num_proc}')
+    print(f'[Setting] Seed of random number generators: {args.seed}')
+    print(f'[Setting] Output format: {args.out_format}')
+    print(f'[Setting] Mutation rates of trinucleotide contexts: {args.context_rate_path}')
+    print(f'[Setting] Regional mutation-rate map: {args.rate_map_path}')
+    if args.out_format == 'npz':
+        print(f'[Setting] Number of simulations in one output file: {args.batch_size}')
 
 
 def check_args_validity(args: argparse.Namespace):
@@ -86,6 +130,21 @@ def check_args_validity(args: argparse.Namespace):
     if args.num_proc < 1 or args.num_proc > mp.cpu_count():
         raise ValueError(f'--num_proc got an invalid value ({args.num_proc}). '
                          f'It must be in the range [1, {mp.cpu_count()}].')
+    if args.seed is not None and args.seed < 0:
+        raise ValueError(f'--seed got an invalid value ({args.seed}). The value must be a non-negative integer.')
+    if args.batch_size < 1:
+        raise ValueError(f'--batch_size got an invalid value ({args.batch_size}). The value must be more than 0.')
+    if args.context_rate_path is not None and not os.path.isfile(args.context_rate_path):
+        raise FileNotFoundError(f'The input file "{args.context_rate_path}" cannot be found.')
+    if args.rate_map_path is not None and not os.path.isfile(args.rate_map_path):
+        raise FileNotFoundError(f'The input file "{args.rate_map_path}" cannot be found.')
+    if args.context_rate_path is not None and args.rate_map_path is not None:
+        raise ValueError('--context_rate and --rate_map cannot be used together.')
+    if args.sim_start < 1:
+        raise ValueError(f'--sim_start got an invalid value ({args.sim_start}). The value must be more than 0.')
+    if args.sim_end is not None and args.sim_end < args.sim_start:
+        raise ValueError(f'--sim_end got an invalid value ({args.sim_end}). '
+                         f'The value must not be less than --sim_start ({args.sim_start}).')
 
 
 def simulate_mutation(filepath_dict: dict, args: argparse.Namespace):
@@ -136,34 +195,127 @@ def simulate_mutation(filepath_dict: dict, args: argparse.Namespace):
         fasta_file_path = filepath_dict[f'{chrom}']
         fasta_path_dict[chrom] = fasta_file_path
 
+    # Use position arrays of each trinucleotide context for the context-aware mutation model
+    # or position arrays of each reference base to draw random mutations without rejection if available
+    base_index_dir = filepath_dict['base_index']
+    context_index_dir = None
+    context_mut_rates = None
+    rate_map = None
+
+    if args.rate_map_path is not None:
+        print(f'[{get_curr_time()}, Progress] Load the regional mutation-rate map and its alias table')
+        rate_map = load_window_rate_map(args.rate_map_path, chroms)
+        base_index_dir = None
+        print(f'[{get_curr_time()}, Progress] Draw random mutations from the windows of the rate map '
+              f'by rejection sampling on the FASTA files')
+    elif args.context_rate_path is not None:
+        context_index_dir = filepath_dict['context_index']
+
+        if not has_context_index(context_index_dir, unq_chroms):
+            raise FileNotFoundError(f'Position arrays of each trinucleotide context cannot be found in '
+                                    f'"{context_index_dir}". Run the "prepare" step with --context_index first.')
+
+        context_mut_rates = load_context_mut_rates(args.context_rate_path)
+        base_index_dir = None
+        print(f'[{get_curr_time()}, Progress] Draw random mutations from the position arrays of each '
+              f'trinucleotide context')
+    elif has_base_index(base_index_dir, unq_chroms):
+        print(f'[{get_curr_time()}, Progress] Draw random mutations from the position arrays of each reference base')
+    else:
+        print(f'[{get_curr_time()}, Progress] Position arrays of each reference base cannot be found '
+              f'so draw random mutations by rejection sampling on the FASTA files')
+        base_index_dir = None
+
     # Make files listing random mutations
     print(f'[{get_curr_time()}, Progress] Create files listing random mutations generated by simulation')
     os.makedirs(args.out_dir, exist_ok=True)
-    output_paths = []
+    sim_start = args.sim_start
+    sim_end = args.num_sim if args.sim_end is None else args.sim_end
 
-    for n in range(args.num_sim):
-        output_filename = f'{args.out_tag}.{n + 1:05d}.vcf'
-        output_path = os.path.join(args.out_dir, output_filename)
-        output_paths.append(output_path)
+    # Skip the simulations completed by previous runs
+    done_sim_set = get_done_sim_set(args.out_dir, args.out_tag, args.seed)
+    sim_ind = [sim_idx for sim_idx in range(sim_start, sim_end + 1) if sim_idx not in done_sim_set]
 
+    if len(sim_ind) < sim_end - sim_start + 1:
+        print(f'[{get_curr_time()}, Progress] Skip {sim_end - sim_start + 1 - len(sim_ind)} simulations '
+              f'already completed according to the manifests')
+
+    sim_tasks = make_sim_tasks(sim_ind, args.out_dir, args.out_tag, args.out_format, args.batch_size)
+    manifest_path = os.path.join(args.out_dir, f'{args.out_tag}.{sim_start:05d}-{sim_end:05d}.manifest.txt')
+    worker_args = (fam_to_label_cnt, fam_to_sample_set, fasta_path_dict, chroms, chrom_probs, chrom_sizes,
+                   base_index_dir, context_index_dir, context_mut_rates, rate_map, args.seed)
+
+    # Tasks are handed to the processes one by one so that no process stays idle while others have many left.
+    # Completed tasks are recorded to the manifest immediately, so an interrupted run can be resumed.
     if args.num_proc == 1:
-        make_rand_mut_files(output_paths, fam_to_label_cnt, fam_to_sample_set, fasta_path_dict,
-                            chrom_probs, chrom_sizes)
+        init_rand_mut_worker(*worker_args)
+        results = map(run_rand_mut_task, sim_tasks)
+        record_rand_mut_results(results, manifest_path, args.seed, len(sim_tasks))
     else:
-        output_paths_subs = div_list(output_paths, args.num_proc)
-        pool = mp.Pool(args.num_proc)
-        pool.map(
-            partial(make_rand_mut_files,
-                    fam_to_label_cnt=fam_to_label_cnt,
-                    fam_to_sample_set=fam_to_sample_set,
-                    fasta_path_dict=fasta_path_dict,
-                    chrom_probs=chrom_probs,
-                    chrom_sizes=chrom_sizes,
-                    ),
-            output_paths_subs
-        )
-        pool.close()
-        pool.join()
+        with mp.Pool(args.num_proc, initializer=init_rand_mut_worker, initargs=worker_args) as pool:
+            results = pool.imap_unordered(run_rand_mut_task, sim_tasks)
+            record_rand_mut_results(results, manifest_path, args.seed, len(sim_tasks))
+
+
+def get_done_sim_set(out_dir: str, out_tag: str, seed: int = None) -> set:
+    """ Read the manifests in the output directory and return a set of indices of the completed simulations
+    which output files still exist and match the checksums in the manifests.
+    """
+    manifest_paths = sorted(glob.glob(os.path.join(out_dir, f'{glob.escape(out_tag)}.*.manifest.txt')))
+    manifest_df = read_sim_manifests(manifest_paths)
+
+    if len(manifest_df.index) == 0:
+        return set()
+
+    seeds = set(manifest_df['SEED'])
+    if seeds != {seed}:
+        raise ValueError(f'The manifests in "{out_dir}" record simulations generated with other seeds '
+                         f'({", ".join(map(str, seeds))}). Use the same seed to resume the simulations '
+                         f'or use another output directory.')
+
+    file_to_md5 = {}  # Key: Output file name, Value: Its current MD5 checksum (None if the file does not exist)
+    done_sim_set = set()
+
+    for sim_idx, file_name, md5 in manifest_df[['SIM', 'FILE', 'MD5']].values:
+        if file_name not in file_to_md5:
+            file_path = os.path.join(out_dir, file_name)
+            file_to_md5[file_name] = get_file_md5(file_path) if os.path.isfile(file_path) else None
+
+        if file_to_md5[file_name] == md5:
+            done_sim_set.add(sim_idx)
+
+    return done_sim_set
+
+
+def make_sim_tasks(sim_ind: list, out_dir: str, out_tag: str, out_format: str, batch_size: int) -> list:
+    """ Group the simulations into tasks and return a list of tuples of simulation indices and their output path.
+    For the 'npz' format, the simulations are grouped by fixed batches, [1, batch_size], [batch_size + 1, ...], ...,
+    so that the output files of disjoint runs do not overlap.
+    """
+    sim_tasks = []
+
+    if out_format == 'vcf':
+        for sim_idx in sim_ind:
+            output_path = os.path.join(out_dir, f'{out_tag}.{sim_idx:05d}.vcf')
+            sim_tasks.append(([sim_idx], output_path))
+    else:
+        batch_to_sim_ind = {}
+
+        for sim_idx in sim_ind:
+            batch_to_sim_ind.setdefault((sim_idx - 1) // batch_size, []).append(sim_idx)
+
+        for batch_sim_ind in batch_to_sim_ind.values():
+            output_path = os.path.join(out_dir, f'{out_tag}.{batch_sim_ind[0]:05d}-{batch_sim_ind[-1]:05d}.npz')
+            sim_tasks.append((batch_sim_ind, output_path))
+
+    return sim_tasks
+
+
+def record_rand_mut_results(results, manifest_path: str, seed: int, num_task: int):
+    """ Record the results of 'run_rand_mut_task' in the manifest as soon as each task is completed """
+    for i, (sim_ind, output_path, md5) in enumerate(results):
+        append_sim_manifest(manifest_path, sim_ind, seed, os.path.basename(output_path), md5)
+        print(f'[{get_curr_time()}, Progress] "{output_path}" has been created. ({i + 1}/{num_task})')
 
 
 def parse_vcf(vcf_path: str, rdd_colnames: list = None) -> pd.DataFrame:
@@ -240,132 +392,81 @@ def label_variant(ref: str, alt: str) -> int:
         return 3  # INDEL3
 
 
-def make_rand_mut_files(output_paths: list, fam_to_label_cnt: dict, fam_to_sample_set: dict, fasta_path_dict: dict,
-                        chrom_probs: np.ndarray, chrom_sizes: np.ndarray):
-    """ Make VCF files listing random mutations
-    This is a wrapper for the 'make_rand_mut_file' function to support multiprocessing.
+def init_rand_mut_worker(fam_to_label_cnt: dict, fam_to_sample_set: dict, fasta_path_dict: dict,
+                         chroms: np.ndarray, chrom_probs: np.ndarray, chrom_sizes: np.ndarray,
+                         base_index_dir: str = None, context_index_dir: str = None,
+                         context_mut_rates: np.ndarray = None, rate_map: WindowRateMap = None,
+                         seed: int = None):
+    """ Open the FASTA files and load data to generate random mutations once per process.
+    Memory-mapped files are shared by all the processes via the page cache.
+    Compressed FASTA files (bgzip) are read block by block instead.
+    """
+    _rand_mut_worker_data.update(
+        fam_to_label_cnt=fam_to_label_cnt,
+        fam_to_sample_set=fam_to_sample_set,
+        fasta_file_dict={chrom: FastaFile(fasta_path, use_mmap=not fasta_path.endswith('.gz'))
+                         for chrom, fasta_path in fasta_path_dict.items()},
+        chroms=chroms,
+        chrom_probs=chrom_probs,
+        chrom_sizes=chrom_sizes,
+        base_index_dict=None if base_index_dir is None else load_base_index(base_index_dir, list(fasta_path_dict)),
+        context_index_dict=None if context_index_dir is None else load_context_index(context_index_dir,
+                                                                                      list(fasta_path_dict)),
+        context_mut_rates=context_mut_rates,
+        rate_map=rate_map,
+        seed=seed,
+    )
+
+
+def run_rand_mut_task(sim_task: tuple) -> (list, str, str):
+    """ Make a file listing random mutations of the simulations in the task
+    and return the simulation indices, the output path and the MD5 checksum of the output.
+    The output is written to a temporary file first so that an interrupted task does not leave a partial output.
+
+    :param sim_task: Tuple of simulation indices and their output path.
+                     Random mutations of each simulation are generated from a random stream
+                     determined by the seed and the simulation index.
     """
-    # Open the FASTA files
-    fasta_file_dict = {chrom: FastaFile(fasta_path_dict[chrom]) for chrom in fasta_path_dict}
-
-    for output_path in output_paths:
-        make_rand_mut_file(output_path, fam_to_label_cnt, fam_to_sample_set, fasta_file_dict, chrom_probs, chrom_sizes)
-
-    # Close the FASTA files
-    for chrom in fasta_file_dict:
-        fasta_file_dict[chrom].close()
-
-
-def make_rand_mut_file(output_path: str, fam_to_label_cnt: dict, fam_to_sample_set: dict, fasta_file_dict: dict,
-                       chrom_probs: np.ndarray, chrom_sizes: np.ndarray):
-    """ Make a VCF file listing random mutations """
-    rand_variants = []
-
-    for fam in fam_to_label_cnt:
-        label_cnt_arr = fam_to_label_cnt[fam]
-        sample_ids = list(fam_to_sample_set[fam])
-
-        for label, label_cnt in enumerate(label_cnt_arr):
-            for i in range(label_cnt):
-                rand_variant = make_random_mutation(label, sample_ids, fasta_file_dict, chrom_probs, chrom_sizes)
-                rand_variants.append(rand_variant)
-
-    rand_variants.sort(key=lambda x: (x.get('chrom'), x.get('pos')))
-    write_variant_list(output_path, rand_variants)
-
-
-def make_random_mutation(label: int, sample_ids: list, fasta_file_dict: dict,
-                         chrom_probs: np.ndarray, chrom_sizes: np.ndarray) -> dict:
-    """ Generate and return a random mutation in the VCF format """
-    sample_id = np.random.choice(sample_ids)
-    ref = None
-    alt = None
-
-    while True:
-        chrom_idx = np.random.choice(range(len(chrom_probs)), p=chrom_probs)
-        chrom_size = chrom_sizes[chrom_idx]
-        chrom = f'chr{chrom_idx + 1}'
-        fasta_file = fasta_file_dict[chrom]
-
-        pos = np.random.randint(chrom_size)
-        base = fasta_file.get_base(chrom, pos).upper()
-
-        if base == 'N':
-            continue
-
-        ref, alt = pick_mutation()
-
-        if base != ref:
-            continue
-
-        break
-
-    alt += 'A' * label
-
-    variant = {
-        'chrom': chrom,
-        'pos': pos + 1,  # 0-based -> 1-based
-        'id': f'{chrom}:{pos + 1}:{ref}:{alt}',
-        'ref': ref,
-        'alt': alt,
-        'qual': '.',
-        'filter': '.',
-        'info': f'SAMPLE={sample_id}'
-    }
-    return variant
-
-
-def pick_mutation() -> (str, str):
-    """ Get a mutation from the mutation distribution model (Lynch 2010). """
-    x = np.random.uniform(0, 1)
-
-    if x <= 0.211062887:
-        ref = 'C'
-        alt = 'T'
-    elif x <= 0.422125774:
-        ref = 'G'
-        alt = 'A'
-    elif x <= 0.551200326:
-        ref = 'A'
-        alt = 'G'
-    elif x <= 0.680274877:
-        ref = 'T'
-        alt = 'C'
-    elif x <= 0.728393387:
-        ref = 'G'
-        alt = 'T'
-    elif x <= 0.776511898:
-        ref = 'C'
-        alt = 'A'
-    elif x <= 0.821985623:
-        ref = 'G'
-        alt = 'C'
-    elif x <= 0.867459349:
-        ref = 'C'
-        alt = 'G'
-    elif x <= 0.900590744:
-        ref = 'T'
-        alt = 'A'
-    elif x <= 0.933722139:
-        ref = 'A'
-        alt = 'T'
-    elif x <= 0.96686107:
-        ref = 'A'
-        alt = 'C'
+    sim_ind, output_path = sim_task
+    output_stem, output_ext = os.path.splitext(output_path)
+    tmp_output_path = f'{output_stem}.tmp{output_ext}'
+    make_rand_mut_file(tmp_output_path, sim_ind, **_rand_mut_worker_data)
+    md5 = get_file_md5(tmp_output_path)
+    os.replace(tmp_output_path, output_path)
+
+    return sim_ind, output_path, md5
+
+
+def make_rand_mut_file(output_path: str, sim_ind: list, fam_to_label_cnt: dict, fam_to_sample_set: dict,
+                       fasta_file_dict: dict, chroms: np.ndarray, chrom_probs: np.ndarray, chrom_sizes: np.ndarray,
+                       base_index_dict: dict = None, context_index_dict: dict = None,
+                       context_mut_rates: np.ndarray = None, rate_map: WindowRateMap = None,
+                       seed: int = None):
+    """ Make a file listing random mutations of the simulations.
+    The output is a VCF file if the output path ends with '.vcf' (Only one simulation is allowed.)
+    or a compact binary file if the output path ends with '.npz'.
+    """
+    rand_mut_dfs = []
+    sample_ids = None
+
+    for sim_idx in sim_ind:
+        rand_mut_df, sample_ids = make_rand_mut_table(fam_to_label_cnt, fam_to_sample_set, fasta_file_dict,
+                                                      chroms, chrom_probs, chrom_sizes,
+                                                      base_index_dict=base_index_dict,
+                                                      context_index_dict=context_index_dict,
+                                                      context_mut_rates=context_mut_rates,
+                                                      rate_map=rate_map,
+                                                      rng=make_rng(seed, sim_idx))
+        rand_mut_df['SIM'] = sim_idx
+        rand_mut_dfs.append(rand_mut_df)
+
+    rand_mut_df = pd.concat(rand_mut_dfs, ignore_index=True)
+
+    if output_path.endswith('.npz'):
+        save_rand_mut_table(output_path, rand_mut_df, chroms, sample_ids)
     else:
-        ref = 'T'
-        alt = 'G'
-
-    return ref, alt
-
-
-def write_variant_list(out_vcf_path, variants):
-    with open(out_vcf_path, 'w') as outfile:
-        print('#CHROM', 'POS', 'ID', 'REF', 'ALT', 'QUAL', 'FILTER', 'INFO', sep='\t', file=outfile)
-
-        for variant in variants:
-            print(variant['chrom'], variant['pos'], variant['id'], variant['ref'], variant['alt'],
-                  variant['qual'], variant['filter'], variant['info'], sep='\t', file=outfile)
+        assert len(sim_ind) == 1, 'A VCF file can list random mutations of only one simulation.'
+        write_rand_mut_vcf(output_path, rand_mut_df, chroms, sample_ids)
 
 
 if __name__ == '__main__':
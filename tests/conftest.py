@@ -0,0 +1,79 @@
+"""
+Common fixtures for the tests
+"""
+import shutil
+import struct
+import zlib
+
+import pytest
+
+
+@pytest.fixture
+def fasta_path(tmp_path):
+    """ Make a small FASTA file and its index (5 bases per line) """
+    seqs = {
+        'chr1': 'ACGTNacgtnAAAAACCCCC',
+        'chr2': 'NNNNNGGGGGTTTTT',
+    }
+    fa_path = tmp_path / 'test.fa'
+    fai_path = tmp_path / 'test.fa.fai'
+    offset = 0
+
+    with open(fa_path, 'w') as fa_file, open(fai_path, 'w') as fai_file:
+        for chrom, seq in seqs.items():
+            header = f'>{chrom}\n'
+            fa_file.write(header)
+            offset += len(header)
+            lines = [seq[i:i + 5] + '\n' for i in range(0, len(seq), 5)]
+            fa_file.write(''.join(lines))
+            print(chrom, len(seq), offset, 5, 6, sep='\t', file=fai_file)
+            offset += sum(map(len, lines))
+
+    return str(fa_path)
+
+
+def write_bgzf(out_path, data: bytes, block_size: int, write_gzi=True):
+    """ Compress the data into BGZF blocks which have 'block_size' bytes of
+    uncompressed data each and write its .gzi index if 'write_gzi' is True
+    """
+    gzi_entries = []
+    coffset = 0
+
+    with open(out_path, 'wb') as outfile:
+        for i in range(0, len(data), block_size):
+            chunk = data[i:i + block_size]
+            compressor = zlib.compressobj(9, zlib.DEFLATED, -15)
+            cdata = compressor.compress(chunk) + compressor.flush()
+            bsize = 18 + len(cdata) + 8
+            outfile.write(b'\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff'
+                          + struct.pack('<H', 6) + b'BC'
+                          + struct.pack('<HH', 2, bsize - 1) + cdata
+                          + struct.pack('<II', zlib.crc32(chunk), len(chunk)))
+            if i > 0:
+                gzi_entries.append((coffset, i))
+            coffset += bsize
+
+        # EOF marker
+        outfile.write(bytes.fromhex('1f8b08040000000000ff0600424302001b00'
+                                    '03000000000000000000'))
+
+    if write_gzi:
+        with open(f'{out_path}.gzi', 'wb') as gzi_file:
+            gzi_file.write(struct.pack('<Q', len(gzi_entries)))
+            for entry in gzi_entries:
+                gzi_file.write(struct.pack('<QQ', *entry))
+
+
+@pytest.fixture(params=[True, False], ids=['gzi', 'no_gzi'])
+def bgzf_fasta_path(request, fasta_path):
+    """ Compress the FASTA file from the 'fasta_path' fixture by bgzip
+    (7 bytes per block) with or without its .gzi index
+    """
+    fa_gz_path = fasta_path + '.gz'
+
+    with open(fasta_path, 'rb') as infile:
+        write_bgzf(fa_gz_path, infile.read(), 7, request.param)
+
+    shutil.copy(fasta_path + '.fai', fa_gz_path + '.fai')
+
+    return fa_gz_path
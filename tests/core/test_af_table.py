@@ -0,0 +1,58 @@
+"""
+Test the methods in cwas.core.af_table
+"""
+import numpy as np
+import pysam
+import pytest
+
+from cwas.core.af_table import AfTable, has_af_table, make_af_table, \
+    trim_alleles
+
+
+@pytest.fixture
+def sites_vcf_path(tmp_path):
+    vcf_path = str(tmp_path / 'sites.vcf')
+
+    with open(vcf_path, 'w') as vcf_file:
+        print('##fileformat=VCFv4.2', file=vcf_file)
+        print('##contig=<ID=chr1>', file=vcf_file)
+        print('##contig=<ID=chr2>', file=vcf_file)
+        print('#CHROM', 'POS', 'ID', 'REF', 'ALT', 'QUAL', 'FILTER', 'INFO',
+              sep='\t', file=vcf_file)
+        print('chr1', 10, '.', 'A', 'C,G', '.', 'PASS', 'AC=1,2;AF=0.1,0.2',
+              sep='\t', file=vcf_file)
+        print('chr1', 20, '.', 'ATT', 'A,AT,*', '.', 'PASS', 'AF=0.3,0.4,0.5',
+              sep='\t', file=vcf_file)
+        print('chr1', 30, '.', 'G', 'T', '.', 'PASS', 'AF=.', sep='\t',
+              file=vcf_file)
+        print('chr2', 5, '.', 'C', 'A', '.', 'PASS', 'AF=3.2e-05', sep='\t',
+              file=vcf_file)
+
+    return pysam.tabix_index(vcf_path, preset='vcf', force=True)
+
+
+def test_trim_alleles():
+    assert trim_alleles(20, 'ATT', 'AT') == (20, 'AT', 'A')
+    assert trim_alleles(20, 'CAG', 'CTG') == (21, 'A', 'T')
+    assert trim_alleles(20, 'A', 'AT') == (20, 'A', 'AT')
+
+
+def test_af_table(sites_vcf_path, tmp_path):
+    table_dir = str(tmp_path / 'af_table')
+    assert make_af_table(sites_vcf_path, 'chr1', table_dir) == 4
+    assert make_af_table(sites_vcf_path, 'chr2', table_dir) == 1
+    assert has_af_table(table_dir, ['chr1', 'chr2'])
+    assert not has_af_table(table_dir, ['chr1', 'chr3'])
+
+    af_table = AfTable(table_dir, 'gnomADg_AF')
+    afs = af_table.get_afs('chr1', [10, 10, 10, 20, 20, 30, 40],
+                           ['A', 'A', 'A', 'AT', 'ATT', 'G', 'C'],
+                           ['G', 'C', 'T', 'A', 'AT', 'T', 'A'])
+    assert afs.dtype == np.float32
+    assert np.array_equal(afs, np.array([0.2, 0.1, np.nan, 0.4, 0.4, np.nan,
+                                         np.nan], dtype=np.float32),
+                          equal_nan=True)
+
+    assert af_table.get_info_strs('chr2', [5, 5], ['C', 'C'], ['A', 'G']) == \
+        ['gnomADg_AF=3.2e-05', 'gnomADg_AF=.']
+    assert af_table.get_info_strs('chr3', [5], ['C'], ['A']) == ['gnomADg_AF=.']
@@ -0,0 +1,76 @@
+"""
+Test the methods in cwas.core.annot_cache
+"""
+import sqlite3
+
+from cwas.core.annot_cache import AnnotCache, make_fingerprint
+
+
+def test_annot_cache(tmp_path):
+    db_path = str(tmp_path / 'annot_cache.db')
+    fingerprint = make_fingerprint('vep --offline', {'gnomad': 'a.vcf.gz'})
+    assert fingerprint == make_fingerprint('vep --offline',
+                                           {'gnomad': 'a.vcf.gz'})
+    assert fingerprint != make_fingerprint('vep', {'gnomad': 'a.vcf.gz'})
+
+    var_annots = {
+        ('chr1', 10, 'A', 'C'): ('CSQ=C|missense_variant;phyloP=1.5', 5),
+        ('chr1', 20, 'G', 'GT'): (None, 1 << 70),
+    }
+
+    with AnnotCache(db_path, fingerprint) as annot_cache:
+        assert annot_cache.get(list(var_annots)) == {}
+        assert annot_cache.get_header() is None
+
+        annot_cache.put(var_annots)
+        annot_cache.put_header(['##INFO=<ID=CSQ>', '##INFO=<ID=ANNOT>'])
+
+    # Entries are persistent and visible only with the same fingerprint.
+    with AnnotCache(db_path, fingerprint) as annot_cache:
+        query_keys = [('chr1', 10, 'A', 'C'), ('chr1', 20, 'G', 'GT'),
+                      ('chr1', 10, 'A', 'G')]
+        assert annot_cache.get(query_keys) == var_annots
+        assert annot_cache.get_header() == ['##INFO=<ID=CSQ>',
+                                            '##INFO=<ID=ANNOT>']
+
+    with AnnotCache(db_path, 'other') as annot_cache:
+        assert annot_cache.get(list(var_annots)) == {}
+
+
+def test_annot_cache_eviction(tmp_path, monkeypatch):
+    db_path = str(tmp_path / 'annot_cache.db')
+    clock = iter(range(100))
+    monkeypatch.setattr('cwas.core.annot_cache.time.time',
+                        lambda: next(clock))
+    var_keys = [('chr1', pos, 'A', 'C') for pos in range(1, 4)]
+
+    with AnnotCache(db_path, 'fp', max_size=2) as annot_cache:
+        annot_cache.put({var_keys[0]: ('a', 1)})
+        annot_cache.put({var_keys[1]: ('b', 2)})
+        annot_cache.get([var_keys[0]])  # The 2nd entry is the least recent.
+        annot_cache.put({var_keys[2]: ('c', 3)})
+
+        assert annot_cache.get(var_keys) == {var_keys[0]: ('a', 1),
+                                             var_keys[2]: ('c', 3)}
+
+
+def test_annot_cache_deferred_last_used(tmp_path, monkeypatch):
+    db_path = str(tmp_path / 'annot_cache.db')
+    clock = iter(range(100))
+    monkeypatch.setattr('cwas.core.annot_cache.time.time',
+                        lambda: next(clock))
+    var_key = ('chr1', 1, 'A', 'C')
+
+    def read_last_used():
+        with sqlite3.connect(db_path) as conn:
+            return conn.execute('SELECT last_used FROM annot').fetchone()[0]
+
+    with AnnotCache(db_path, 'fp') as annot_cache:
+        annot_cache.put({var_key: ('a', 1)})
+        assert annot_cache.get([var_key]) == {var_key: ('a', 1)}
+
+        # The lookup does not write the database.
+        assert read_last_used() == 0
+
+    # The time of use is written when the cache is closed.
+    assert read_last_used() == 1
@@ -0,0 +1,50 @@
+"""
+Test the methods in cwas.core.base_index
+"""
+import pytest
+
+import cwas.core.base_index as base_index
+
+
+def test_make_base_index(fasta_path, tmp_path):
+    index_dir = str(tmp_path / 'base_index')
+    assert not base_index.has_base_index(index_dir, ['chr1', 'chr2'])
+
+    base_cnt_dicts = [base_index.make_base_index(fasta_path, chrom, index_dir)
+                      for chrom in ['chr1', 'chr2']]
+    assert base_cnt_dicts == [{'A': 7, 'C': 7, 'G': 2, 'T': 2, 'N': 2},
+                              {'A': 0, 'C': 0, 'G': 5, 'T': 5, 'N': 5}]
+
+    assert base_index.has_base_index(index_dir, ['chr1', 'chr2'])
+    base_index_dict = base_index.load_base_index(index_dir, ['chr1', 'chr2'])
+
+    # chr1: ACGTNacgtnAAAAACCCCC
+    a_arr, c_arr, g_arr, t_arr = base_index_dict['chr1']
+    assert a_arr.tolist() == [0, 5, 10, 11, 12, 13, 14]
+    assert c_arr.tolist() == [1, 6, 15, 16, 17, 18, 19]
+    assert g_arr.tolist() == [2, 7]
+    assert t_arr.tolist() == [3, 8]
+    assert str(a_arr.dtype) == 'uint32'
+
+    # chr2: NNNNNGGGGGTTTTT
+    a_arr, c_arr, g_arr, t_arr = base_index_dict['chr2']
+    assert len(a_arr) == 0 and len(c_arr) == 0
+    assert g_arr.tolist() == [5, 6, 7, 8, 9]
+    assert t_arr.tolist() == [10, 11, 12, 13, 14]
+
+
+@pytest.mark.parametrize('chunk_size', [1 << 24, 3])
+def test_non_n_intervals(fasta_path, tmp_path, monkeypatch, chunk_size):
+    monkeypatch.setattr(base_index, '_CHUNK_SIZE', chunk_size)
+    index_dir = str(tmp_path / 'base_index')
+
+    for chrom in ['chr1', 'chr2']:
+        base_index.make_base_index(fasta_path, chrom, index_dir)
+
+    # chr1: ACGTNacgtnAAAAACCCCC
+    assert base_index.load_non_n_intervals(index_dir, 'chr1').tolist() == \
+        [[0, 4], [5, 9], [10, 20]]
+
+    # chr2: NNNNNGGGGGTTTTT
+    assert base_index.load_non_n_intervals(index_dir, 'chr2').tolist() == \
+        [[5, 15]]
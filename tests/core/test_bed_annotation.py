@@ -0,0 +1,110 @@
+"""
+Test the methods in cwas.core.bed_annotation
+"""
+import numpy as np
+import pysam
+
+import cwas.core.bed_annotation as bed_annotation
+
+
+def test_get_search_regions():
+    # Substitution, insertion, deletion (1-based positions)
+    region_starts, region_ends = bed_annotation.get_search_regions(
+        [10, 10, 10], [1, 1, 4], [1, 3, 1]
+    )
+    assert region_starts.tolist() == [9, 9, 10]
+    assert region_ends.tolist() == [10, 11, 13]
+
+
+def test_annotate_regions():
+    starts = np.array([100, 200, 250, 300, 350, 500])
+    ends = np.array([200, 250, 300, 350, 400, 600])
+    annot_ints = np.array([1, 3, 7, 6, 2, 8], dtype=np.uint64)
+    region_starts = np.array([0, 99, 100, 199, 240, 399, 400, 450, 599])
+    region_ends = np.array([10, 100, 101, 201, 360, 401, 500, 550, 700])
+
+    # Brute force
+    expected = []
+    for region_start, region_end in zip(region_starts, region_ends):
+        is_overlap = (starts < region_end) & (region_start < ends)
+        expected.append(int(np.bitwise_or.reduce(annot_ints[is_overlap],
+                                                 initial=np.uint64(0))))
+
+    region_annots = bed_annotation.annotate_regions(
+        region_starts, region_ends, starts, ends, annot_ints)
+    assert region_annots.tolist() == expected == [0, 0, 1, 3, 7, 2, 0, 8, 8]
+
+
+def test_annotate_regions_many_keys():
+    # Annotation integers with more than 64 keys
+    annot_ints = np.array([1 << 70, 1 << 3], dtype=object)
+    region_annots = bed_annotation.annotate_regions(
+        np.array([5]), np.array([25]), np.array([0, 20]), np.array([10, 30]),
+        annot_ints)
+    assert region_annots.tolist() == [(1 << 70) | (1 << 3)]
+
+
+def test_load_annot_intervals(tmp_path):
+    bed_path = str(tmp_path / 'merged_annotation.bed')
+    with open(bed_path, 'w') as bed_file:
+        print('#ANNOT=A|B', file=bed_file)
+        print('chr1\t100\t200\t1', file=bed_file)
+        print('chr1\t200\t250\t3', file=bed_file)
+        print('chr2\t10\t20\t2', file=bed_file)
+    pysam.tabix_index(bed_path, preset='bed', force=True)
+
+    with pysam.TabixFile(bed_path + '.gz') as annot_bed_file:
+        starts, ends, annot_ints = \
+            bed_annotation.load_annot_intervals(annot_bed_file, 'chr1', 2)
+        assert starts.tolist() == [100, 200]
+        assert ends.tolist() == [200, 250]
+        assert annot_ints.dtype == np.uint64
+        assert annot_ints.tolist() == [1, 3]
+
+        starts, _, _ = \
+            bed_annotation.load_annot_intervals(annot_bed_file, 'chr3', 2)
+        assert len(starts) == 0
+
+
+def test_annot_index(tmp_path):
+    bed_path = str(tmp_path / 'merged_annotation.bed')
+    with open(bed_path, 'w') as bed_file:
+        print('#ANNOT=A|B|C', file=bed_file)
+        print('#chrom\tstart\tend\tannot_int', file=bed_file)
+        for bed_entry in [('chr1', 100, 200, 1), ('chr1', 200, 250, 3),
+                          ('chr1', 300, 350, 6), ('chr2', 0, 20, 4)]:
+            print(*bed_entry, sep='\t', file=bed_file)
+    pysam.tabix_index(bed_path, preset='bed', force=True)
+
+    index_path = str(tmp_path / 'merged_annotation.idx')
+    bed_annotation.write_annot_index(bed_path + '.gz', index_path)
+    assert bed_annotation.is_annot_index(index_path)
+    assert not bed_annotation.is_annot_index(bed_path + '.gz')
+    annot_index = bed_annotation.AnnotIndex(index_path)
+    assert annot_index.annot_keys == ['A', 'B', 'C']
+
+    starts, ends, annot_ints = annot_index.get_intervals('chr1')
+    assert starts.dtype == np.uint32 and annot_ints.dtype == np.uint64
+    sentinel = np.iinfo(np.uint32).max
+    assert starts.tolist() == [0, 100, 200, 250, 300, 350, sentinel]
+    assert ends.tolist() == [100, 200, 250, 300, 350, sentinel, sentinel]
+    assert annot_ints.tolist() == [0, 1, 3, 0, 6, 0, 0]
+
+    # The arrays are views of the memory-mapped index.
+    assert not any(arr.flags.owndata for arr in [starts, ends, annot_ints])
+
+    region_starts = np.array([0, 150, 240, 260, 340, 400])
+    region_ends = np.array([100, 201, 310, 270, 351, 500])
+    assert bed_annotation.annotate_regions(
+        region_starts, region_ends, starts, ends, annot_ints
+    ).tolist() == [0, 3, 7, 0, 6, 0]
+
+    starts, ends, annot_ints = annot_index.get_intervals('chr2')
+    assert starts.tolist() == [0, 20, sentinel]
+    assert annot_ints.tolist() == [4, 0, 0]
+
+    # Unknown chromosomes have no annotation.
+    starts, ends, annot_ints = annot_index.get_intervals('chr3')
+    assert bed_annotation.annotate_regions(
+        np.array([0]), np.array([10]), starts, ends, annot_ints
+    ).tolist() == [0]
@@ -0,0 +1,46 @@
+"""
+Test the methods in cwas.core.bigwig_annotation
+"""
+import numpy as np
+import pytest
+
+import cwas.core.bigwig_annotation as bigwig_annotation
+
+pyBigWig = pytest.importorskip('pyBigWig')
+
+
+@pytest.fixture
+def bigwig_path(tmp_path):
+    bw_path = str(tmp_path / 'score.bw')
+    bw_file = pyBigWig.open(bw_path, 'w')
+    bw_file.addHeader([('chr1', 100), ('chr2', 50)])
+    bw_file.addEntries('chr1', 10, values=[0.5, 1.0, 2.0, -1.0, 0.25],
+                       span=1, step=1)
+    bw_file.addEntries(['chr1'], [60], ends=[70], values=[3.0])
+    bw_file.close()
+    return bw_path
+
+
+@pytest.mark.parametrize('max_gap', [10000, 5])
+def test_score_regions(bigwig_path, monkeypatch, max_gap):
+    monkeypatch.setattr(bigwig_annotation, '_MAX_GAP', max_gap)
+    region_starts = np.array([65, 10, 12, 0, 11, 98, 30])
+    region_ends = np.array([66, 11, 15, 10, 13, 120, 30])
+
+    with pyBigWig.open(bigwig_path) as bw_file:
+        scores = bigwig_annotation.score_regions(bw_file, 'chr1',
+                                                 region_starts, region_ends)
+        assert np.array_equal(scores, [3.0, 0.5, 2.0, np.nan, 2.0, np.nan,
+                                       np.nan], equal_nan=True)
+
+        scores = bigwig_annotation.score_regions(bw_file, 'chr3',
+                                                 region_starts, region_ends)
+        assert np.isnan(scores).all()
+
+
+def test_bigwig_scorer(bigwig_path):
+    with bigwig_annotation.BigWigScorer({'A': bigwig_path,
+                                         'B': bigwig_path}) as scorer:
+        assert scorer.keys == ['A', 'B']
+        assert scorer.get_info_strs('chr1', np.array([11, 0]),
+                                    np.array([12, 1])) == ['A=1;B=1', 'A=.;B=.']
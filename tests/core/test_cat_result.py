@@ -0,0 +1,56 @@
+"""
+Test the methods in cwas.core.cat_result
+"""
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import sparse
+
+import cwas.core.cat_result as cat_result_mod
+from cwas.core.cat_result import CatResult
+
+
+@pytest.fixture
+def cat_result():
+    cnt_mat = sparse.csr_matrix(np.array([[1, 0, 2], [0, 0, 0], [0, 3, 1]]))
+    return CatResult(cnt_mat, ['s1', 's2', 's3'],
+                     ['SNV_Any_All_Any_Any', 'SNV_ASD_All_Any_Any',
+                      'Indel_Any_All_Any_Any'])
+
+
+@pytest.mark.parametrize('filename', ['cat_result.npz', 'cat_result.txt'])
+def test_read_write(cat_result, tmp_path, monkeypatch, filename):
+    monkeypatch.setattr(cat_result_mod, '_BLOCK_SIZE', 2)
+    path = str(tmp_path / filename)
+    cat_result.write(path)
+    read_result = CatResult.read(path)
+
+    assert sparse.issparse(read_result.cnt_mat)
+    assert np.array_equal(read_result.cnt_mat.toarray(),
+                          cat_result.cnt_mat.toarray())
+    assert read_result.sample_ids.tolist() == ['s1', 's2', 's3']
+    assert read_result.cat_names.tolist() == cat_result.cat_names.tolist()
+
+    if filename.endswith('.txt'):
+        cat_df = pd.read_table(path, index_col='SAMPLE')
+        assert cat_df.loc['s3', 'SNV_ASD_All_Any_Any'] == 3
+    else:
+        assert (tmp_path / 'cat_result.samples.txt').is_file()
+        assert (tmp_path / 'cat_result.categories.txt').is_file()
+
+
+def test_drop_and_adjust(cat_result):
+    drop_result = cat_result.drop_categories(['SNV_ASD_All_Any_Any',
+                                              'Indel_ASD_All_Any_Any'])
+    assert drop_result.cat_names.tolist() == ['SNV_Any_All_Any_Any',
+                                              'Indel_Any_All_Any_Any']
+    assert drop_result.cnt_mat.toarray().tolist() == [[1, 2], [0, 0], [0, 1]]
+
+    adj_result = drop_result.adjust([0.5, 1.0, 2.0])
+    assert adj_result.cnt_mat.toarray().tolist() == \
+        [[0.5, 1.0], [0.0, 0.0], [0.0, 2.0]]
+    assert np.array([True, False, True]) @ adj_result.cnt_mat == \
+        pytest.approx([0.5, 3.0])
+
+    with pytest.raises(ValueError):
+        CatResult(cat_result.cnt_mat, ['s1', 's2'], cat_result.cat_names)
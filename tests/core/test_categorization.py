@@ -0,0 +1,221 @@
+"""
+Test the methods in cwas.core.categorization
+"""
+import itertools
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+import pytest
+import yaml
+
+import cwas.core.categorization as categorization
+from cwas.core.gene_list_table import GeneListTable
+
+
+@pytest.fixture
+def category_dict():
+    return {
+        'var_type': {'All': 'All', 'SNV': 'SNV', 'Indel': 'Indel'},
+        'cons': {'All': 'All', 'phyloP46wayVt': 'phyloP46way'},
+        'gene_list': {'Any': 'Any', 'ASD': 'ASD', 'DDD': 'DDD'},
+        'effect': {'Any': 'Any', 'CodingRegion': 'CodingRegion',
+                   'LoFRegion': 'LoFRegion',
+                   'MissenseRegion': 'MissenseRegion',
+                   'MissenseHVARDRegionSimple': 'MissenseHVARDRegionSimple',
+                   'NoncodingRegion': 'NoncodingRegion',
+                   'PromoterRegion': 'PromoterRegion',
+                   'lincRnaRegion': 'lincRnaRegion'},
+        'region': {'Any': 'Any', 'EncodeDNase': 'DNase', 'HARs': 'HARs',
+                   'Vista': 'Vista'},
+    }
+
+
+@pytest.fixture
+def gene_list_table():
+    return GeneListTable(['GENE1', 'GENE2', 'GENE4'], [0b01, 0b11, 0b10],
+                         ['ASD', 'DDD'])
+
+
+@pytest.fixture
+def variant_df():
+    rng = np.random.default_rng(0)
+    num_var = 300
+    csq_choices = [
+        ('stop_gained', 'protein_coding', ''),
+        ('missense_variant', 'protein_coding', 'probably_damaging'),
+        ('missense_variant', 'protein_coding', 'benign'),
+        ('upstream_gene_variant', 'lincRNA', ''),
+        ('intron_variant&non_coding_transcript_variant', 'lincRNA', ''),
+        ('intergenic_variant', '', ''),
+    ]
+    csqs = [csq_choices[i]
+            for i in rng.integers(len(csq_choices), size=num_var)]
+    alleles = [('A', 'C'), ('A', 'AT'), ('GC', 'G')]
+    var_alleles = [alleles[i]
+                   for i in rng.integers(len(alleles), size=num_var)]
+
+    return pd.DataFrame({
+        'SAMPLE': rng.choice(['s1', 's2', 's3', 's4', 's5'], size=num_var),
+        'REF': [ref for ref, _ in var_alleles],
+        'ALT': [alt for _, alt in var_alleles],
+        'Consequence': [csq for csq, _, _ in csqs],
+        'BIOTYPE': [biotype for _, biotype, _ in csqs],
+        'PolyPhen': [polyphen for _, _, polyphen in csqs],
+        'SYMBOL': rng.choice(['', 'GENE1', 'GENE2', 'GENE3'], size=num_var),
+        'NEAREST': rng.choice(['GENE1', 'GENE4'], size=num_var),
+        'phyloP46wayVt': rng.choice(['', '0.5', '2', '3.5'], size=num_var),
+        'ANNOT': rng.integers(8, size=num_var).astype(np.uint64),
+    })
+
+
+@pytest.fixture
+def annot_keys():
+    return ['HARs', 'EncodeDNase', 'ChmE1']
+
+
+def test_parse_vep_vcf(tmp_path):
+    vep_vcf_path = tmp_path / 'vep.vcf'
+    vep_vcf_path.write_text(
+        '##fileformat=VCFv4.2\n'
+        '##INFO=<ID=CSQ,Number=.,Type=String,Description="Consequence '
+        'annotations from Ensembl VEP. Format: Allele|Consequence|SYMBOL">\n'
+        '##INFO=<ID=ANNOT,Key=HARs|EncodeDNase|Vista>\n'
+        '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n'
+        'chr1\t10\t.\tA\tC\t.\t.\tSAMPLE=s1;CSQ=C|stop_gained|GENE1;'
+        'gnomADg_AF=.;phyloP46wayVt=2.5;ANNOT=5\n'
+        'chr1\t20\t.\tG\tGT\t.\t.\tSAMPLE=s2;CSQ=GT||;gnomADg_AF=0.01;'
+        'ANNOT=0\n'
+    )
+    variant_df, annot_keys = categorization.parse_vep_vcf(str(vep_vcf_path),
+                                                          ['CHROM', 'INFO'])
+    assert annot_keys == ['HARs', 'EncodeDNase', 'Vista']
+    assert variant_df['ANNOT'].dtype == np.uint64
+    assert variant_df['ANNOT'].tolist() == [5, 0]
+    assert variant_df['SYMBOL'].tolist() == ['GENE1', '']
+    # Missing ('.') and absent INFO values are empty strings.
+    assert variant_df['gnomADg_AF'].tolist() == ['', '0.01']
+    assert variant_df['phyloP46wayVt'].tolist() == ['2.5', '']
+    assert 'CHROM' not in variant_df.columns
+
+    region_mat = categorization.get_region_mat(
+        variant_df, ['Any', 'Vista', 'EncodeDNase', 'HARs', 'ChmE1'],
+        annot_keys)
+    assert region_mat.tolist() == [[True, True, False, True, False],
+                                   [True, False, False, False, False]]
+
+
+def test_filter_by_af_known():
+    variant_df = pd.DataFrame({'POS': [1, 2, 3],
+                               'gnomADg_AF': ['', '0.01', '']})
+    assert categorization.filter_by_af_known(variant_df, 'yes') is variant_df
+    assert categorization.filter_by_af_known(
+        variant_df, 'no')['POS'].tolist() == [1, 3]
+    assert categorization.filter_by_af_known(
+        variant_df, 'only')['POS'].tolist() == [2]
+
+    # Variants without the AF column are AF-unknown.
+    no_af_df = variant_df.drop(columns='gnomADg_AF')
+    assert len(categorization.filter_by_af_known(no_af_df, 'no').index) == 3
+    assert len(categorization.filter_by_af_known(no_af_df, 'only').index) == 0
+
+    with pytest.raises(ValueError):
+        categorization.filter_by_af_known(variant_df, 'maybe')
+
+
+def test_get_effect_terms():
+    assert categorization.get_effect_terms(
+        'frameshift_variant', 'protein_coding', '') == \
+        {'Any', 'CodingRegion', 'FrameshiftRegion', 'LoFRegion'}
+    assert categorization.get_effect_terms(
+        'missense_variant&splice_region_variant', 'protein_coding',
+        'probably_damaging') == \
+        {'Any', 'CodingRegion', 'MissenseRegion', 'MissenseHVARDRegionSimple'}
+    assert categorization.get_effect_terms(
+        'upstream_gene_variant', 'lincRNA', '') == \
+        {'Any', 'NoncodingRegion', 'PromoterRegion'}
+    assert categorization.get_effect_terms(
+        'intron_variant', 'antisense', '') == \
+        {'Any', 'NoncodingRegion', 'IntronRegion', 'AntisenseRegion'}
+
+
+def test_expand_categories():
+    pattern_term_mats = [np.array([[True, True], [True, False]]),
+                         np.array([[True, False, True], [False, True, True]])]
+    cat_ptrs, cat_ids = categorization.expand_categories(pattern_term_mats)
+    assert cat_ptrs.tolist() == [0, 4, 6]
+    assert cat_ids.tolist() == [0, 2, 3, 5, 1, 2]
+
+
+@pytest.mark.parametrize('max_block_size', [1 << 24, 1000])
+def test_categorize_variants(variant_df, category_dict, gene_list_table,
+                             annot_keys, monkeypatch, max_block_size):
+    monkeypatch.setattr(categorization, '_MAX_BLOCK_SIZE', max_block_size)
+    gene_list_dict = {'GENE1': {'ASD'}, 'GENE2': {'ASD', 'DDD'},
+                      'GENE4': {'DDD'}}
+    cat_result = categorization.categorize_variants(
+        variant_df, category_dict, gene_list_table, annot_keys)
+    cat_result_df = pd.DataFrame(cat_result.cnt_mat.toarray(),
+                                 index=cat_result.sample_ids,
+                                 columns=cat_result.cat_names)
+
+    # Brute force
+    expected_cnts = {}
+
+    for row in variant_df.itertuples():
+        symbol = row.SYMBOL or row.NEAREST
+        is_snv = len(row.REF) == 1 and len(row.ALT) == 1
+        var_terms = [
+            ['All', 'SNV' if is_snv else 'Indel'],
+            ['Any', *sorted(gene_list_dict.get(symbol, set()))],
+            ['All'] + (['phyloP46way'] if row.phyloP46wayVt != '' and
+                       float(row.phyloP46wayVt) >= 2 else []),
+            [term for term in category_dict['effect']
+             if term in categorization.get_effect_terms(
+                 row.Consequence, row.BIOTYPE, row.PolyPhen)],
+            ['Any'] + (['DNase'] if row.ANNOT & 2 else []) +
+            (['HARs'] if row.ANNOT & 1 else []),
+        ]
+        sample_cnts = expected_cnts.setdefault(row.SAMPLE, Counter())
+        sample_cnts.update('_'.join(terms)
+                           for terms in itertools.product(*var_terms))
+
+    expected_df = pd.DataFrame(expected_cnts).T.fillna(0).astype(np.int64)
+    expected_df = expected_df.sort_index()[sorted(expected_df.columns)]
+    assert cat_result.sample_ids.tolist() == ['s1', 's2', 's3', 's4', 's5']
+    pd.testing.assert_frame_equal(
+        cat_result_df[sorted(cat_result_df.columns)], expected_df,
+        check_names=False
+    )
+
+
+def test_redundant_categories(variant_df, category_dict, gene_list_table,
+                              annot_keys, tmp_path):
+    full_result = categorization.categorize_variants(
+        variant_df, category_dict, gene_list_table, annot_keys)
+    rdd_cats = list(full_result.cat_names[::3]) + \
+        ['_'.join(['All', 'Any', 'All', 'LoFRegion', term])
+         for term in category_dict['region'].values()]
+    rdd_cat_path = tmp_path / 'redundant_categories.yaml'
+    rdd_cat_path.write_text(yaml.safe_dump(rdd_cats))
+
+    is_rdd_cat = categorization.load_rdd_cat_mask(str(rdd_cat_path),
+                                                  category_dict)
+    assert is_rdd_cat.sum() == len(set(rdd_cats))
+    assert (tmp_path / 'redundant_categories.bitset.npz').is_file()
+    assert np.array_equal(
+        categorization.load_rdd_cat_mask(str(rdd_cat_path), category_dict),
+        is_rdd_cat
+    )
+
+    cat_result = categorization.categorize_variants(
+        variant_df, category_dict, gene_list_table, annot_keys,
+        is_rdd_cat=is_rdd_cat)
+    expected_result = full_result.drop_categories(rdd_cats)
+    assert cat_result.cat_names.tolist() == expected_result.cat_names.tolist()
+    assert (cat_result.cnt_mat != expected_result.cnt_mat).nnz == 0
+
+    # The cached bitset is invalidated by the changed list.
+    rdd_cat_path.write_text(yaml.safe_dump(rdd_cats[:1]))
+    assert categorization.load_rdd_cat_mask(str(rdd_cat_path),
+                                            category_dict).sum() == 1
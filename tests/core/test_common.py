@@ -0,0 +1,40 @@
+"""
+Test the methods in cwas.core.common
+"""
+import numpy as np
+
+import cwas.core.common as common
+
+
+def test_make_rng():
+    # The same seed and task IDs make the same random stream.
+    vals1 = common.make_rng(42, 3).random(10)
+    vals2 = common.make_rng(42, 3).random(10)
+    assert np.array_equal(vals1, vals2)
+
+    # Different task IDs make different random streams.
+    vals3 = common.make_rng(42, 4).random(10)
+    vals4 = common.make_rng(42, 1, 3).random(10)
+    assert not np.array_equal(vals1, vals3)
+    assert not np.array_equal(vals1, vals4)
+
+    # Without a seed, each generator has fresh entropy.
+    assert not np.array_equal(common.make_rng().random(10),
+                              common.make_rng().random(10))
+
+
+def test_swap_label():
+    labels = np.array(['case', 'ctrl', 'case', 'ctrl', 'ctrl', 'case'])
+    group_ids = np.array(['F1', 'F1', 'F2', 'F2', 'F3', 'F3'])
+    swap_labels = common.swap_label(labels, group_ids, common.make_rng(0))
+
+    # Labels are only swapped within each group.
+    for group_id in np.unique(group_ids):
+        is_group = group_ids == group_id
+        assert sorted(swap_labels[is_group]) == sorted(labels[is_group])
+
+    # The same random stream makes the same result.
+    assert np.array_equal(
+        swap_labels,
+        common.swap_label(labels, group_ids, common.make_rng(0))
+    )
@@ -0,0 +1,73 @@
+"""
+Test the methods in cwas.core.context_index
+"""
+import numpy as np
+import pytest
+
+import cwas.core.context_index as context_index
+
+
+def get_context_pos_dict(index_dir: str, chrom: str) -> dict:
+    context_index_dict = context_index.load_context_index(index_dir, [chrom])
+    return {
+        context: pos_arr.tolist() for context, pos_arr in
+        zip(context_index.CONTEXTS, context_index_dict[chrom])
+        if len(pos_arr) > 0
+    }
+
+
+@pytest.mark.parametrize('chunk_size', [1 << 24, 3])
+def test_make_context_index(fasta_path, tmp_path, monkeypatch, chunk_size):
+    monkeypatch.setattr(context_index, '_CHUNK_SIZE', chunk_size)
+    index_dir = str(tmp_path / 'context_index')
+    assert not context_index.has_context_index(index_dir, ['chr1', 'chr2'])
+
+    for chrom in ['chr1', 'chr2']:
+        context_index.make_context_index(fasta_path, chrom, index_dir)
+
+    assert context_index.has_context_index(index_dir, ['chr1', 'chr2'])
+
+    # chr1: ACGTNacgtnAAAAACCCCC
+    assert get_context_pos_dict(index_dir, 'chr1') == {
+        'ACC': [15],
+        'ACG': [1, 2, 6, 7],
+        'CCC': [16, 17, 18],
+        'GTT': [14],
+        'TTT': [11, 12, 13],
+    }
+
+    # chr2: NNNNNGGGGGTTTTT
+    assert get_context_pos_dict(index_dir, 'chr2') == {
+        'ACC': [9],
+        'CCC': [6, 7, 8],
+        'GTT': [10],
+        'TTT': [11, 12, 13],
+    }
+
+
+def test_load_context_mut_rates(tmp_path):
+    rate_path = tmp_path / 'context_rate.txt'
+    rate_path.write_text('CONTEXT\tALT\tRATE\nACG\tT\t2.5\ncgt\tc\t1.0\n')
+    mut_rates = context_index.load_context_mut_rates(str(rate_path))
+
+    acg_idx = context_index.CONTEXTS.index('ACG')
+    assert mut_rates.shape == (32, 4)
+    assert mut_rates[acg_idx].tolist() == [0.0, 0.0, 1.0, 2.5]
+    assert mut_rates.sum() == 3.5
+
+    # 'CGT>A' is the same as 'ACG>T'.
+    rate_path.write_text('CONTEXT\tALT\tRATE\nACG\tT\t2.5\nCGT\tA\t1.0\n')
+    with pytest.raises(ValueError):
+        context_index.load_context_mut_rates(str(rate_path))
+
+    rate_path.write_text('CONTEXT\tALT\tRATE\nACG\tC\t1.0\n')
+    with pytest.raises(ValueError):
+        context_index.load_context_mut_rates(str(rate_path))
+
+
+def test_get_context_codes():
+    codes = np.array([0, 1, 2, 3, 4], dtype=np.uint8)  # ACGTN
+    context_codes = context_index.get_context_codes(codes)
+    assert [context_index.CONTEXTS[i] for i in context_codes[:2]] == \
+        ['ACG', 'ACG']
+    assert context_codes[2] == 32
@@ -0,0 +1,37 @@
+"""
+Test the methods in cwas.core.gene_list_table
+"""
+import numpy as np
+
+from cwas.core.gene_list_table import GeneListTable, get_gene_list_cache_path
+
+
+def test_gene_list_table(tmp_path):
+    gene_mat_path = tmp_path / 'gene_matrix.txt'
+    gene_mat_path.write_text('gene\tASD\tDDD\tPSD\n'
+                             'GENE2\t1\t1\t0\n'
+                             'GENE1\t1\t0\t0\n'
+                             'GENE3\t0\t0\t0\n'
+                             'GENE4\t0\t1\t1\n')
+    gene_list_table = GeneListTable.load(str(gene_mat_path))
+    assert gene_list_table.symbols.tolist() == ['GENE1', 'GENE2', 'GENE3',
+                                                'GENE4']
+    assert gene_list_table.masks.tolist() == [0b001, 0b011, 0b000, 0b110]
+    assert gene_list_table.get_list_mask('PSD') == 0b100
+    assert gene_list_table.get_list_mask('BE') == 0
+
+    masks = gene_list_table.get_masks(['GENE4', '', 'GENE0', 'GENE2',
+                                       'GENE5', 'GENE4'])
+    assert masks.dtype == np.uint64
+    assert masks.tolist() == [0b110, 0, 0, 0b011, 0, 0b110]
+
+    # The compiled table is cached and invalidated by a changed file.
+    assert (tmp_path / 'gene_matrix.bitmask.npz').is_file()
+    assert get_gene_list_cache_path(str(gene_mat_path)) == \
+        str(tmp_path / 'gene_matrix.bitmask.npz')
+    assert GeneListTable.load(str(gene_mat_path)).masks.tolist() == \
+        [0b001, 0b011, 0b000, 0b110]
+
+    gene_mat_path.write_text('gene\tASD\nGENE1\t0\nGENE5\t1\n')
+    gene_list_table = GeneListTable.load(str(gene_mat_path))
+    assert gene_list_table.get_masks(['GENE5', 'GENE1']).tolist() == [1, 0]
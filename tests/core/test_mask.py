@@ -0,0 +1,40 @@
+"""
+Test the methods in cwas.core.mask
+"""
+import gzip
+import shutil
+
+import pytest
+
+import cwas.core.mask as mask
+from cwas.fastafile import FastaFile
+
+
+@pytest.mark.parametrize('chunk_size', [1 << 24, 8])
+def test_write_masked_fasta(fasta_path, tmp_path, monkeypatch, chunk_size):
+    monkeypatch.setattr(mask, '_CHUNK_SIZE', chunk_size)
+    in_fa_path = str(tmp_path / 'in.fa.gz')
+    with open(fasta_path, 'rb') as infile, \
+            gzip.open(in_fa_path, 'wb') as outfile:
+        shutil.copyfileobj(infile, outfile)
+
+    bed_path = tmp_path / 'mask_region.bed'
+    bed_path.write_text('chr1\t2\t7\nchr1\t6\t8\nchr1\t18\t30\nchr3\t0\t10\n')
+    mask_regions = mask.read_mask_regions(str(bed_path))
+    assert sorted(mask_regions) == ['chr1', 'chr3']
+
+    out_fa_path = str(tmp_path / 'out.fa')
+    mask.write_masked_fasta(in_fa_path, out_fa_path, mask_regions)
+
+    # The input file is kept.
+    assert (tmp_path / 'in.fa.gz').is_file()
+
+    # The line layout and the index are the same as the input.
+    with open(fasta_path + '.fai') as fai_file:
+        expected_fai = fai_file.read()
+    with open(out_fa_path + '.fai') as fai_file:
+        assert fai_file.read() == expected_fai
+
+    with FastaFile(out_fa_path) as fasta_file:
+        assert fasta_file.get_seq('chr1', 0, 20) == 'ACNNNNNNtnAAAAACCCNN'
+        assert fasta_file.get_seq('chr2', 0, 15) == 'NNNNNGGGGGTTTTT'
@@ -0,0 +1,54 @@
+"""
+Test the methods in cwas.core.rate_map
+"""
+import numpy as np
+import pytest
+
+import cwas.core.rate_map as rate_map
+from cwas.core.common import make_rng
+
+
+def test_alias_table():
+    weights = np.array([1.0, 0.0, 3.0, 6.0])
+    accept_probs, alias_ind = rate_map.make_alias_table(weights)
+
+    # Probabilities of each item from the table
+    probs = accept_probs.copy()
+    np.add.at(probs, alias_ind, 1.0 - accept_probs)
+    assert np.allclose(probs / len(weights), weights / weights.sum())
+
+    item_ind = rate_map.draw_from_alias_table(accept_probs, alias_ind,
+                                              100000, make_rng(0))
+    freqs = np.bincount(item_ind, minlength=4) / len(item_ind)
+    assert freqs[1] == 0
+    assert np.allclose(freqs, [0.1, 0.0, 0.3, 0.6], atol=0.01)
+
+
+def test_load_window_rate_map(tmp_path):
+    bed_path = tmp_path / 'rate_map.bed'
+    bed_path.write_text('chr1\t0\t10\t1.0\n'
+                        'chr1\t10\t20\t0\n'
+                        'chr2\t5\t15\t3.0\n'
+                        'chr3\t0\t10\t1.0\n')
+    chroms = np.array(['chr1', 'chr2'])
+    window_rate_map = rate_map.load_window_rate_map(str(bed_path), chroms)
+
+    assert window_rate_map.chrom_ind.tolist() == [0, 1]
+    assert window_rate_map.starts.tolist() == [0, 5]
+    assert window_rate_map.ends.tolist() == [10, 15]
+
+    chrom_ind, positions = window_rate_map.draw_sites(10000, make_rng(0))
+    assert abs(np.mean(chrom_ind == 1) - 0.75) < 0.02
+    assert (positions[chrom_ind == 0] < 10).all()
+    assert ((positions[chrom_ind == 1] >= 5)
+            & (positions[chrom_ind == 1] < 15)).all()
+
+    # The cached alias table is used unless the BED file is changed.
+    cache_path = rate_map.get_rate_map_cache_path(str(bed_path))
+    cache_mtime = (tmp_path / cache_path).stat().st_mtime_ns
+    rate_map.load_window_rate_map(str(bed_path), chroms)
+    assert (tmp_path / cache_path).stat().st_mtime_ns == cache_mtime
+
+    bed_path.write_text('chr1\t0\t10\t0\n')
+    with pytest.raises(ValueError):
+        rate_map.load_window_rate_map(str(bed_path), chroms)
@@ -0,0 +1,286 @@
+"""
+Test the methods in cwas.core.simulation
+"""
+import gzip
+
+import numpy as np
+import pandas as pd
+
+import cwas.core.base_index as base_index
+import cwas.core.context_index as context_index
+import cwas.core.rate_map as rate_map
+import cwas.core.simulation as simulation
+from cwas.core.common import make_rng
+from cwas.fastafile import FastaFile
+
+
+def test_pick_mutations():
+    mut_ind = simulation.pick_mutations(100000, make_rng(0))
+    assert mut_ind.min() >= 0
+    assert mut_ind.max() < len(simulation.MUT_REF_CODES)
+
+    # C>T is the most frequent mutation type (~21%).
+    freqs = np.bincount(mut_ind) / len(mut_ind)
+    assert freqs.argmax() == 0
+    assert abs(freqs[0] - 0.211) < 0.01
+
+
+def test_conv_bases_to_codes():
+    codes = simulation.conv_bases_to_codes('ACGTNacgtn')
+    assert codes.tolist() == [0, 1, 2, 3, 4, 0, 1, 2, 3, 4]
+
+
+def test_make_rand_mut_table(fasta_path):
+    chroms = np.array(['chr1', 'chr2'])
+    chrom_sizes = np.array([20, 15])
+    chrom_probs = np.array([0.5, 0.5])
+    fam_to_label_cnt = {
+        'F1': np.array([5, 1, 0, 2]),
+        'F2': np.array([3, 0, 1, 0]),
+    }
+    fam_to_sample_set = {'F1': {'F1.p1', 'F1.s1'}, 'F2': {'F2.p1'}}
+
+    with FastaFile(fasta_path) as fasta_file:
+        fasta_file_dict = {'chr1': fasta_file, 'chr2': fasta_file}
+        rand_mut_df, sample_ids = simulation.make_rand_mut_table(
+            fam_to_label_cnt, fam_to_sample_set, fasta_file_dict, chroms,
+            chrom_probs, chrom_sizes, num_sim=3, rng=make_rng(0),
+        )
+
+        # Reference bases must be matched with the genome.
+        for chrom_idx, pos, ref in rand_mut_df[['CHROM', 'POS', 'REF']].values:
+            chrom = chroms[chrom_idx]
+            base = fasta_file.get_base(chrom, pos).upper()
+            assert base == simulation.BASES[ref]
+
+    assert list(rand_mut_df.columns) == simulation.RAND_MUT_COLS
+    assert len(rand_mut_df.index) == 12 * 3
+    assert (rand_mut_df['REF'] != rand_mut_df['ALT']).all()
+
+    # Each family keeps its label counts in each simulation.
+    var_samples = sample_ids[rand_mut_df['SAMPLE'].values]
+    for sim in range(3):
+        is_sim = rand_mut_df['SIM'].values == sim
+        for fam, label_cnt in fam_to_label_cnt.items():
+            is_fam = np.char.startswith(var_samples.astype(str), fam) & is_sim
+            labels = rand_mut_df['LABEL'].values[is_fam]
+            assert np.bincount(labels, minlength=4).tolist() == \
+                label_cnt.tolist()
+
+    # The rows are sorted by simulations, chromosomes and positions.
+    keys = list(zip(rand_mut_df['SIM'], rand_mut_df['CHROM'],
+                    rand_mut_df['POS']))
+    assert keys == sorted(keys)
+
+
+def test_make_rand_mut_table_from_index(fasta_path, tmp_path):
+    chroms = np.array(['chr1', 'chr2'])
+    index_dir = str(tmp_path / 'base_index')
+    for chrom in chroms:
+        base_index.make_base_index(fasta_path, chrom, index_dir)
+    base_index_dict = base_index.load_base_index(index_dir, chroms)
+
+    fam_to_label_cnt = {'F1': np.array([500, 0, 0, 0])}
+    fam_to_sample_set = {'F1': {'F1.p1'}}
+    rand_mut_df, _ = simulation.make_rand_mut_table(
+        fam_to_label_cnt, fam_to_sample_set, None, chroms,
+        np.array([0.5, 0.5]), np.array([20, 15]),
+        base_index_dict=base_index_dict, rng=make_rng(0),
+    )
+    assert len(rand_mut_df.index) == 500
+
+    with FastaFile(fasta_path) as fasta_file:
+        for chrom_idx, pos, ref in rand_mut_df[['CHROM', 'POS', 'REF']].values:
+            base = fasta_file.get_base(chroms[chrom_idx], pos).upper()
+            assert base == simulation.BASES[ref]
+
+
+def assert_fam_pos_exchangeable(rand_mut_df, chrom_size: int):
+    """ Assert that the positions of each family (one sample per family)
+    follow the same distribution regardless of the order of the families
+    """
+    fam_pos_means = rand_mut_df.groupby('SAMPLE')['POS'].mean().values
+    assert np.abs(fam_pos_means - chrom_size / 2).max() < chrom_size * 0.15
+
+    # No correlation between the order of the families and their positions
+    fam_ind = np.arange(len(fam_pos_means))
+    assert abs(np.corrcoef(fam_ind, fam_pos_means)[0, 1]) < 0.5
+
+
+def test_make_rand_mut_table_from_index_exchangeable():
+    chrom_size = 100000
+    base_index_dict = {'chr1': [np.arange(base_code, chrom_size, 4)
+                                for base_code in range(4)]}
+    fam_to_label_cnt = {f'F{i}': np.array([100, 0, 0, 0]) for i in range(20)}
+    fam_to_sample_set = {fam: {f'{fam}.p1'} for fam in fam_to_label_cnt}
+
+    rand_mut_df, _ = simulation.make_rand_mut_table(
+        fam_to_label_cnt, fam_to_sample_set, None, np.array(['chr1']),
+        np.array([1.0]), np.array([chrom_size]),
+        base_index_dict=base_index_dict, rng=make_rng(0),
+    )
+    assert_fam_pos_exchangeable(rand_mut_df, chrom_size)
+
+
+def test_make_rand_mut_table_reproducible(fasta_path):
+    chroms = np.array(['chr1', 'chr2'])
+    fam_to_label_cnt = {'F1': np.array([20, 1, 1, 1])}
+    fam_to_sample_set = {'F1': {'F1.p1', 'F1.s1'}}
+    rand_mut_dfs = []
+
+    with FastaFile(fasta_path, use_mmap=True) as fasta_file:
+        fasta_file_dict = {'chr1': fasta_file, 'chr2': fasta_file}
+        for seed in [7, 7, 8]:
+            rand_mut_df, _ = simulation.make_rand_mut_table(
+                fam_to_label_cnt, fam_to_sample_set, fasta_file_dict, chroms,
+                np.array([0.5, 0.5]), np.array([20, 15]), rng=make_rng(seed, 1),
+            )
+            rand_mut_dfs.append(rand_mut_df)
+
+    assert rand_mut_dfs[0].equals(rand_mut_dfs[1])
+    assert not rand_mut_dfs[0].equals(rand_mut_dfs[2])
+
+
+def test_save_load_rand_mut_table(fasta_path, tmp_path):
+    chroms = np.array(['chr1', 'chr2'])
+    fam_to_label_cnt = {'F1': np.array([10, 1, 2, 3])}
+    fam_to_sample_set = {'F1': {'F1.p1', 'F1.s1'}}
+
+    with FastaFile(fasta_path, use_mmap=True) as fasta_file:
+        fasta_file_dict = {'chr1': fasta_file, 'chr2': fasta_file}
+        rand_mut_df, sample_ids = simulation.make_rand_mut_table(
+            fam_to_label_cnt, fam_to_sample_set, fasta_file_dict, chroms,
+            np.array([0.5, 0.5]), np.array([20, 15]), num_sim=2,
+            rng=make_rng(0),
+        )
+
+    npz_path = str(tmp_path / 'rand_mut.npz')
+    simulation.save_rand_mut_table(npz_path, rand_mut_df, chroms, sample_ids)
+    load_df, load_chroms, load_sample_ids = \
+        simulation.load_rand_mut_table(npz_path)
+
+    assert np.array_equal(load_df.values, rand_mut_df.values)
+    assert load_chroms.tolist() == chroms.tolist()
+    assert load_sample_ids.tolist() == sample_ids.tolist()
+
+
+def test_write_rand_mut_vcf(tmp_path):
+    rand_mut_df = pd.DataFrame(
+        [[0, 0, 9, 1, 3, 0, 1], [0, 1, 99, 2, 0, 2, 0]],
+        columns=simulation.RAND_MUT_COLS,
+    )
+    vcf_path = tmp_path / 'rand_mut.vcf'
+    simulation.write_rand_mut_vcf(str(vcf_path), rand_mut_df,
+                                  np.array(['chr1', 'chr2']),
+                                  np.array(['S1', 'S2']))
+    lines = vcf_path.read_text().splitlines()
+    assert lines[0].startswith('#CHROM')
+    assert lines[1].split('\t') == \
+        ['chr1', '10', 'chr1:10:C:T', 'C', 'T', '.', '.', 'SAMPLE=S2']
+    assert lines[2].split('\t') == \
+        ['chr2', '100', 'chr2:100:G:AAA', 'G', 'AAA', '.', '.', 'SAMPLE=S1']
+
+    # Compressed and indexed output
+    simulation.write_rand_mut_vcf(str(vcf_path) + '.gz', rand_mut_df,
+                                  np.array(['chr1', 'chr2']),
+                                  np.array(['S1', 'S2']))
+    with gzip.open(str(vcf_path) + '.gz', 'rt') as vcf_file:
+        assert vcf_file.read().splitlines() == lines
+    assert (tmp_path / 'rand_mut.vcf.gz.tbi').is_file()
+
+
+def test_sim_manifest(tmp_path):
+    out_path = tmp_path / 'rand_mut.00001.vcf'
+    out_path.write_text('#CHROM\n')
+    md5 = simulation.get_file_md5(str(out_path))
+    assert md5 == '66f6335282360324dfe54baec11533d0'
+
+    manifest_path = str(tmp_path / 'rand_mut.00001-00003.manifest.txt')
+    simulation.append_sim_manifest(manifest_path, [1, 2], None,
+                                   out_path.name, md5)
+    simulation.append_sim_manifest(manifest_path, [3], None,
+                                   out_path.name, md5)
+    manifest_df = simulation.read_sim_manifests([manifest_path])
+
+    assert list(manifest_df.columns) == simulation.SIM_MANIFEST_COLS
+    assert manifest_df['SIM'].tolist() == [1, 2, 3]
+    assert manifest_df['SEED'].tolist() == [None] * 3
+    assert (manifest_df['FILE'] == out_path.name).all()
+    assert (manifest_df['MD5'] == md5).all()
+    assert len(simulation.read_sim_manifests([]).index) == 0
+
+
+def test_make_rand_mut_table_from_context_index(fasta_path, tmp_path):
+    chroms = np.array(['chr1', 'chr2'])
+    index_dir = str(tmp_path / 'context_index')
+    for chrom in chroms:
+        context_index.make_context_index(fasta_path, chrom, index_dir)
+    context_index_dict = context_index.load_context_index(index_dir, chroms)
+
+    # Only C>T in CpG contexts
+    context_mut_rates = np.zeros((32, 4))
+    context_mut_rates[context_index.CONTEXTS.index('ACG'), 3] = 1.0
+
+    with FastaFile(fasta_path, use_mmap=True) as fasta_file:
+        fasta_file_dict = {'chr1': fasta_file, 'chr2': fasta_file}
+        rand_mut_df, _ = simulation.make_rand_mut_table(
+            {'F1': np.array([200, 0, 0, 0])}, {'F1': {'F1.p1'}},
+            fasta_file_dict, chroms, np.array([0.5, 0.5]), np.array([20, 15]),
+            context_index_dict=context_index_dict,
+            context_mut_rates=context_mut_rates, rng=make_rng(0),
+        )
+
+    assert (rand_mut_df['CHROM'] == 0).all()
+    assert set(rand_mut_df['POS']) == {1, 2, 6, 7}
+    is_fwd = rand_mut_df['POS'].isin([1, 6])
+    assert (rand_mut_df.loc[is_fwd, 'REF'] == 1).all()  # C
+    assert (rand_mut_df.loc[is_fwd, 'ALT'] == 3).all()  # T
+    assert (rand_mut_df.loc[~is_fwd, 'REF'] == 2).all()  # G
+    assert (rand_mut_df.loc[~is_fwd, 'ALT'] == 0).all()  # A
+
+
+def test_make_rand_mut_table_from_context_index_exchangeable(tmp_path):
+    chrom_size = 60000
+    seq = ''.join(make_rng(0).choice(list('ACGT'), size=chrom_size))
+    fa_path = tmp_path / 'random.fa'
+    fa_path.write_text('>chr1\n' + ''.join(seq[i:i + 60] + '\n'
+                                           for i in range(0, chrom_size, 60)))
+    (tmp_path / 'random.fa.fai').write_text(
+        f'chr1\t{chrom_size}\t6\t60\t61\n')
+
+    chroms = np.array(['chr1'])
+    index_dir = str(tmp_path / 'context_index')
+    context_index.make_context_index(str(fa_path), 'chr1', index_dir)
+    context_index_dict = context_index.load_context_index(index_dir, chroms)
+    context_mut_rates = np.ones((32, 4))
+    fam_to_label_cnt = {f'F{i}': np.array([100, 0, 0, 0]) for i in range(20)}
+    fam_to_sample_set = {fam: {f'{fam}.p1'} for fam in fam_to_label_cnt}
+
+    with FastaFile(str(fa_path), use_mmap=True) as fasta_file:
+        rand_mut_df, _ = simulation.make_rand_mut_table(
+            fam_to_label_cnt, fam_to_sample_set, {'chr1': fasta_file}, chroms,
+            np.array([1.0]), np.array([chrom_size]),
+            context_index_dict=context_index_dict,
+            context_mut_rates=context_mut_rates, rng=make_rng(0),
+        )
+
+    assert_fam_pos_exchangeable(rand_mut_df, chrom_size)
+
+
+def test_make_rand_mut_table_from_rate_map(fasta_path, tmp_path):
+    chroms = np.array(['chr1', 'chr2'])
+    bed_path = tmp_path / 'rate_map.bed'
+    bed_path.write_text('chr1\t10\t20\t1.0\n')  # AAAAACCCCC
+    window_rate_map = rate_map.load_window_rate_map(str(bed_path), chroms)
+
+    with FastaFile(fasta_path, use_mmap=True) as fasta_file:
+        fasta_file_dict = {'chr1': fasta_file, 'chr2': fasta_file}
+        rand_mut_df, _ = simulation.make_rand_mut_table(
+            {'F1': np.array([100, 0, 0, 0])}, {'F1': {'F1.p1'}},
+            fasta_file_dict, chroms, np.array([0.5, 0.5]), np.array([20, 15]),
+            rate_map=window_rate_map, rng=make_rng(0),
+        )
+
+    assert (rand_mut_df['CHROM'] == 0).all()
+    assert rand_mut_df['POS'].between(10, 19).all()
+    assert rand_mut_df['REF'].isin([0, 1]).all()  # A or C
@@ -0,0 +1,33 @@
+"""
+Common fixtures for the tests of the scripts
+
+The scripts import helpers from a 'utils' module outside this package. If it
+is not available, a stand-in module backed by the equivalents in the 'cwas'
+package is registered so that the scripts can be imported by the tests.
+"""
+import os
+import sys
+import types
+
+import cwas.core.common as common
+import cwas.utils.cmd as cmd
+import cwas.utils.log as log
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..',
+                                'scripts'))
+
+
+def _make_utils_module() -> types.ModuleType:
+    utils = types.ModuleType('utils')
+    utils.get_curr_time = log._get_curr_time
+    utils.execute_cmd = cmd.execute
+    utils.bgzip_tabix = cmd.bgzip_tabix
+    utils.cmp_two_arr = common.cmp_two_arr
+    utils.div_dist_num = common.div_dist_num
+    return utils
+
+
+try:
+    from utils import get_curr_time  # noqa: F401
+except ImportError:
+    sys.modules['utils'] = _make_utils_module()
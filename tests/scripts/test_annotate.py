@@ -0,0 +1,63 @@
+"""
+Test the functions in scripts/annotate.py
+"""
+import pytest
+
+import annotate
+
+# A stand-in for VEP that fails at the first run for each input
+# and copies the input to the output afterwards.
+FAKE_VEP = '''#!/bin/sh
+while [ $# -gt 0 ]; do
+    case $1 in
+        -i) in_path=$2; shift;;
+        -o) out_path=$2; shift;;
+    esac
+    shift
+done
+if [ ! -e "$in_path.failed" ]; then
+    touch "$in_path.failed"
+    exit 1
+fi
+cp "$in_path" "$out_path"
+'''
+
+
+@pytest.fixture
+def vep_inputs(tmp_path):
+    vep_script = tmp_path / 'fake_vep.sh'
+    vep_script.write_text(FAKE_VEP)
+    vep_script.chmod(0o755)
+
+    header = '##fileformat=VCFv4.2\n' \
+             '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n'
+    records = ''.join(f'chr1\t{pos}\t.\tA\tC\t.\t.\t.\n'
+                      for pos in range(1, 8))
+    in_vcf_path = tmp_path / 'input.vcf'
+    in_vcf_path.write_text(header + records)
+
+    return str(vep_script), str(in_vcf_path), header + records
+
+
+def test_run_vep_by_chunk_retry(tmp_path, vep_inputs):
+    vep_script, in_vcf_path, expected = vep_inputs
+    out_vcf_path = str(tmp_path / 'output.vcf')
+
+    annotate.run_vep_by_chunk(in_vcf_path, out_vcf_path, vep_script, None,
+                              num_proc=2, num_chunk=3, max_retry=1)
+
+    with open(out_vcf_path) as out_vcf_file:
+        assert out_vcf_file.read() == expected
+
+    assert not list(tmp_path.glob('output.chunk*.vcf'))
+
+
+def test_run_vep_by_chunk_fail(tmp_path, vep_inputs):
+    vep_script, in_vcf_path, _ = vep_inputs
+    out_vcf_path = tmp_path / 'output.vcf'
+
+    with pytest.raises(SystemExit):
+        annotate.run_vep_by_chunk(in_vcf_path, str(out_vcf_path), vep_script,
+                                  None, num_proc=2, num_chunk=3, max_retry=0)
+
+    assert not out_vcf_path.exists()
@@ -0,0 +1,110 @@
+"""
+Test the functions in scripts/cwas_mp.py
+"""
+import pytest
+
+import cwas_mp
+
+HEADER = '##fileformat=VCFv4.2\n' \
+         '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n'
+
+# A stand-in for the annotation script which appends an INFO key
+FAKE_ANNOTATE = '''#!/bin/sh
+while [ $# -gt 0 ]; do
+    case $1 in
+        -i) in_path=$2; shift;;
+        -o) out_path=$2; shift;;
+    esac
+    shift
+done
+awk -F '\\t' -v OFS='\\t' '/^#/ {print; next} {$8 = $8 ";ANNOT=1"; print}' \\
+    "$in_path" > "$out_path"
+'''
+
+
+@pytest.fixture
+def sim_vcf_paths(tmp_path):
+    """ Write small VCF files of simulations and return their paths and
+    records
+    """
+    sim_records = [
+        [['chr1', 10, '.', 'A', 'C', '.', '.', 'SAMPLE=s1'],
+         ['chr2', 5, '.', 'G', 'T', '.', '.', 'SAMPLE=s2']],
+        [['chr1', 3, '.', 'C', 'G', '.', '.', 'SAMPLE=s3'],
+         ['chr1', 20, '.', 'T', 'A', '.', '.', 'SAMPLE=s4'],
+         ['chr10', 1, '.', 'A', 'G', '.', '.', 'SAMPLE=s5']],
+        [['chr2', 7, '.', 'T', 'C', '.', '.', '.']],
+    ]
+    in_vcf_paths = []
+
+    for i, records in enumerate(sim_records):
+        in_vcf_path = tmp_path / f'sim.{i}.vcf'
+        in_vcf_path.write_text(HEADER + ''.join(
+            '\t'.join(map(str, record)) + '\n' for record in records))
+        in_vcf_paths.append(str(in_vcf_path))
+
+    return in_vcf_paths, sim_records
+
+
+def add_annot(records: list) -> list:
+    """ Return the VCF lines of the records annotated by FAKE_ANNOTATE """
+    lines = []
+
+    for record in records:
+        info = 'ANNOT=1' if record[7] == '.' else f'{record[7]};ANNOT=1'
+        lines.append('\t'.join(map(str, record[:7] + [info])))
+
+    return lines
+
+
+def test_mux_demux_vcf_files(tmp_path, sim_vcf_paths):
+    in_vcf_paths, sim_records = sim_vcf_paths
+    batch_vcf_path = str(tmp_path / 'batch.vcf')
+    cwas_mp.mux_vcf_files(in_vcf_paths, batch_vcf_path)
+
+    with open(batch_vcf_path) as batch_vcf_file:
+        lines = batch_vcf_file.read().splitlines()
+    assert lines[1].startswith(f'##INFO=<ID={cwas_mp.SIM_TAG},')
+    assert lines[2].startswith('#CHROM')
+    assert [line.split('\t')[0] for line in lines[3:]] == \
+        ['chr1', 'chr1', 'chr1', 'chr2', 'chr2', 'chr10']
+
+    # A stand-in for the annotation
+    annot_vcf_path = str(tmp_path / 'batch.annot.vcf')
+    with open(annot_vcf_path, 'w') as annot_vcf_file:
+        for line in lines:
+            print(line if line.startswith('#') else line + ';ANNOT=1',
+                  file=annot_vcf_file)
+
+    out_vcf_paths = [str(tmp_path / f'sim.{i}.annot.vcf')
+                     for i in range(len(in_vcf_paths))]
+    cwas_mp.demux_vcf_file(annot_vcf_path, out_vcf_paths)
+
+    for out_vcf_path, records in zip(out_vcf_paths, sim_records):
+        with open(out_vcf_path) as out_vcf_file:
+            out_lines = out_vcf_file.read().splitlines()
+        assert out_lines[:2] == HEADER.splitlines()
+        assert out_lines[2:] == add_annot(records)
+
+
+def test_annotate_by_batch(tmp_path, sim_vcf_paths):
+    in_vcf_paths, sim_records = sim_vcf_paths
+    annot_script = tmp_path / 'fake_annotate.sh'
+    annot_script.write_text(FAKE_ANNOTATE)
+    annot_script.chmod(0o755)
+    out_dir = tmp_path / 'out'
+    out_dir.mkdir()
+    todo_paths = [(in_vcf_path, str(out_dir / f'sim.{i}.annot.vcf'))
+                  for i, in_vcf_path in enumerate(in_vcf_paths)]
+
+    cwas_mp.annotate_by_batch(str(annot_script), todo_paths, str(out_dir),
+                              batch_size=2, vep_script='vep')
+
+    for (_, out_vcf_path), records in zip(todo_paths, sim_records):
+        with open(out_vcf_path) as out_vcf_file:
+            out_lines = out_vcf_file.read().splitlines()
+        assert out_lines[2:] == add_annot(records)
+
+    # Only the outputs are left.
+    assert sorted(path.name for path in out_dir.iterdir()) == \
+        sorted(f'sim.{i}.annot.vcf' for i in range(len(in_vcf_paths)))
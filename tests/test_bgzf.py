@@ -0,0 +1,47 @@
+"""
+Test the methods in cwas.bgzf
+"""
+import gzip
+
+import numpy as np
+import pytest
+
+from cwas.bgzf import BgzfReader, BgzfWriter, is_bgzf
+
+
+def test_is_bgzf(fasta_path, bgzf_fasta_path):
+    assert is_bgzf(bgzf_fasta_path)
+    assert not is_bgzf(fasta_path)
+
+
+def test_bgzf_reader(fasta_path, bgzf_fasta_path):
+    with open(fasta_path, 'rb') as infile:
+        data = infile.read()
+
+    with BgzfReader(bgzf_fasta_path, cache_size=2) as reader:
+        assert reader.read(0, len(data)) == data
+        assert reader.read(5, 20) == data[5:25]
+        assert reader.read(len(data) - 3, 10) == data[-3:]
+
+        offsets = np.array([40, 3, 0, 17, len(data) - 1, 3])
+        assert reader.read_at(offsets).tobytes() == \
+            bytes(data[i] for i in offsets)
+
+        # Only the most recently used blocks are kept.
+        assert len(reader._block_cache) == 2
+
+
+@pytest.mark.parametrize('num_thread', [1, 4])
+def test_bgzf_writer(tmp_path, num_thread):
+    out_path = str(tmp_path / 'out.txt.gz')
+    data = b''.join(f'{i}\tline\n'.encode() for i in range(100000))
+
+    with BgzfWriter(out_path, num_thread, blocks_per_batch=2) as writer:
+        for i in range(0, len(data), 10000):
+            writer.write(data[i:i + 10000])
+
+    assert is_bgzf(out_path)
+    with gzip.open(out_path, 'rb') as infile:
+        assert infile.read() == data
+    with BgzfReader(out_path) as reader:
+        assert reader.read(123456, 100) == data[123456:123556]
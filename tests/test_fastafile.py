@@ -0,0 +1,59 @@
+"""
+Test the methods in cwas.fastafile
+"""
+import numpy as np
+import pytest
+
+from cwas.fastafile import FastaFile
+
+
+@pytest.mark.parametrize('use_mmap', [False, True])
+def test_get_base(fasta_path, use_mmap):
+    with FastaFile(fasta_path, use_mmap) as fasta_file:
+        assert fasta_file.get_base('chr1', 0) == 'A'
+        assert fasta_file.get_base('chr1', 5) == 'a'
+        assert fasta_file.get_base('chr2', 14) == 'T'
+
+        with pytest.raises(ValueError):
+            fasta_file.get_base('chr3', 0)
+        with pytest.raises(ValueError):
+            fasta_file.get_base('chr2', 15)
+
+
+@pytest.mark.parametrize('use_mmap', [False, True])
+def test_get_bases(fasta_path, use_mmap):
+    with FastaFile(fasta_path, use_mmap) as fasta_file:
+        positions = np.array([0, 4, 5, 19, 10])
+        bases = fasta_file.get_bases('chr1', positions)
+        assert bases.dtype == np.uint8
+        assert bases.tobytes() == b'ANaCA'
+        assert len(fasta_file.get_bases('chr1', np.array([], dtype=int))) == 0
+
+        with pytest.raises(ValueError):
+            fasta_file.get_bases('chr2', np.array([0, 15]))
+
+
+@pytest.mark.parametrize('use_mmap', [False, True])
+def test_get_seq(fasta_path, use_mmap):
+    with FastaFile(fasta_path, use_mmap) as fasta_file:
+        assert fasta_file.get_seq('chr1', 3, 12) == 'TNacgtnAA'
+        assert fasta_file.get_seq('chr2', 0, 15) == 'NNNNNGGGGGTTTTT'
+
+
+def test_mmap_gzip(tmp_path):
+    fa_gz_path = tmp_path / 'test.fa.gz'
+    fa_gz_path.write_bytes(b'')
+
+    with pytest.raises(ValueError):
+        FastaFile(str(fa_gz_path), use_mmap=True)
+
+
+def test_bgzf(bgzf_fasta_path):
+    with FastaFile(bgzf_fasta_path) as fasta_file:
+        assert fasta_file._bgzf_reader is not None
+        assert fasta_file.get_base('chr1', 5) == 'a'
+        assert fasta_file.get_base('chr2', 14) == 'T'
+        assert fasta_file.get_bases('chr1', np.array([0, 4, 5, 19, 10])) \
+            .tobytes() == b'ANaCA'
+        assert fasta_file.get_seq('chr1', 3, 12) == 'TNacgtnAA'
+        assert fasta_file.get_seq('chr2', 0, 15) == 'NNNNNGGGGGTTTTT'
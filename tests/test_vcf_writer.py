@@ -0,0 +1,45 @@
+"""
+Test the methods in cwas.vcf_writer
+"""
+import pysam
+import pytest
+
+from cwas.vcf_writer import VcfWriter
+
+
+def test_vcf_writer(tmp_path):
+    header = '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n'
+    records = [['chr1', pos, '.', 'A', 'C', '.', '.', f'SAMPLE=s{pos}']
+               for pos in range(1, 1001)]
+
+    for file_name in ['out.vcf', 'out.vcf.gz']:
+        out_vcf_path = str(tmp_path / file_name)
+
+        with VcfWriter(out_vcf_path, num_thread=2, buffer_size=100) as writer:
+            writer.write(header)
+            for record in records:
+                writer.write_record(record)
+
+    with open(tmp_path / 'out.vcf') as vcf_file:
+        lines = vcf_file.read().splitlines()
+    assert lines[0] == header.rstrip('\n')
+    assert lines[1:] == ['\t'.join(map(str, record)) for record in records]
+
+    # The compressed output is indexed.
+    assert (tmp_path / 'out.vcf.gz.tbi').is_file()
+    with pysam.TabixFile(str(tmp_path / 'out.vcf.gz')) as vcf_file:
+        assert list(vcf_file.fetch('chr1', 9, 11)) == lines[10:12]
+
+
+def test_vcf_writer_error(tmp_path):
+    for file_name in ['out.vcf', 'out.vcf.gz']:
+        out_vcf_path = tmp_path / file_name
+
+        with pytest.raises(ValueError):
+            with VcfWriter(str(out_vcf_path), buffer_size=10) as writer:
+                writer.write_record(['chr1', 1, '.', 'A', 'C', '.', '.', '.'])
+                raise ValueError('Interrupted')
+
+        # The partial output is not left behind.
+        assert not out_vcf_path.exists()
+        assert not (tmp_path / f'{file_name}.tbi').exists()